@@ -0,0 +1,608 @@
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+
+from dateutil.parser import parse
+import numpy as np
+import pandas as pd
+
+from data_cleaning import DatabaseCleaning, clean_source_frame
+from parallel_cleaning import ParallelCleaner
+from query_runner import QueryRunner
+
+''' This script times parts of the pipeline on synthetic data so that changes can be compared without
+connecting to AWS or the store API. The pipeline benchmark uploads to a local PostgreSQL or SQLite database
+and keeps its results in a JSON history, e.g. python3 benchmark.py pipeline --scale 1m --creds benchmark_creds.yaml'''
+
+def make_date_strings(num_rows, seed=0):
+    '''
+    This function generates a column of date strings in the mix of formats found in the raw sources.
+
+    Args:
+        num_rows (int): the number of date strings to generate.
+        seed (int): seed for the random number generator.
+
+    Returns:
+        pandas.Series: a column of date strings.
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('1940-01-01') + pd.to_timedelta(rng.integers(0, 30000, num_rows), unit='D')
+    formats = ['%Y-%m-%d', '%Y/%m/%d', '%B %Y %d', '%Y %B %d']
+    # most rows are ISO dates, the rest are split between the other formats
+    format_choice = rng.choice(len(formats), size=num_rows, p=[0.85, 0.05, 0.05, 0.05])
+    date_strings = pd.Series(dates.strftime(formats[0]), dtype='object')
+    for position, date_format in enumerate(formats[1:], start=1):
+        rows = format_choice == position
+        date_strings[rows] = dates[rows].strftime(date_format)
+
+    return date_strings
+
+def _with_invalid_rows(rng, valid_values, num_rows, invalid_share=0.02):
+    '''
+    This function picks random valid values for a column and replaces a share of them with junk and nulls, like the raw sources.
+    '''
+    values = rng.choice(valid_values, num_rows).astype(object)
+    values[rng.random(num_rows) < invalid_share] = 'XQ12K9'
+    values[rng.random(num_rows) < invalid_share / 2] = None
+    return values
+
+def _make_uuids(rng, num_rows):
+    '''
+    This function generates a list of random UUID strings.
+    '''
+    return [str(uuid.UUID(int=int(high) << 64 | int(low))) for high, low in zip(rng.integers(0, 2 ** 63, num_rows), rng.integers(0, 2 ** 63, num_rows))]
+
+def make_source_frames(num_rows, seed=0, start_row=0):
+    '''
+    This function generates dirty DataFrames shaped like the six raw sources: legacy_users, card_details, store_details, products, orders_table and date_times.
+
+    Args:
+        num_rows (int): the number of rows in each DataFrame.
+        seed (int): seed for the random number generator.
+        start_row (int): the row number of the first row, so that chunks of a larger table have unique row numbers and codes.
+
+    Returns:
+        dict: the raw DataFrames keyed by table name.
+    '''
+    rng = np.random.default_rng(seed)
+    row_numbers = np.arange(start_row, start_row + num_rows)
+
+    users_df = pd.DataFrame({'index': row_numbers, 'first_name': 'Sigfried', 'last_name': 'Noack', 'date_of_birth': make_date_strings(num_rows, seed),
+                             'company': 'Heydrich Junitz KG', 'email_address': 'rudi79@winkler.de', 'address': 'Zimmerstr. 1/0, 59015 Gießen',
+                             'country': _with_invalid_rows(rng, ["Germany", "United Kingdom", "United States"], num_rows),
+                             'country_code': rng.choice(['DE', 'GB', 'US'], num_rows), 'phone_number': '+49(0) 047905356',
+                             'join_date': make_date_strings(num_rows, seed + 1), 'user_uuid': _make_uuids(rng, num_rows)})
+
+    # some card numbers have '?' characters mixed in
+    card_numbers = rng.integers(10 ** 11, 10 ** 16, num_rows).astype(object)
+    question_marks = rng.random(num_rows) < 0.05
+    card_numbers[question_marks] = ['??' + str(card_number) for card_number in card_numbers[question_marks]]
+    cards_df = pd.DataFrame({'card_number': card_numbers, 'expiry_date': '09/26',
+                             'card_provider': _with_invalid_rows(rng, ["VISA 16 digit", "Mastercard", "JCB 15 digit", "Discover", "Maestro"], num_rows),
+                             'date_payment_confirmed': make_date_strings(num_rows, seed + 2)})
+
+    # staff_numbers has letters mixed in and the first store is the web portal with no coordinates,
+    # the index carries on across chunks because the cleaner drops the row labelled 0
+    staff_numbers = rng.integers(1, 100, num_rows).astype(str).astype(object)
+    staff_numbers[rng.random(num_rows) < 0.01] = 'J78'
+    stores_df = pd.DataFrame({'index': row_numbers, 'address': '1 High Street', 'longitude': (rng.random(num_rows) * 10).astype(str), 'lat': None,
+                              'locality': rng.choice(['Chapletown', 'Belper', 'Bushey', 'Exeter'], num_rows), 'store_code': [f"BL-{number:08X}" for number in row_numbers],
+                              'staff_numbers': staff_numbers, 'opening_date': make_date_strings(num_rows, seed + 3),
+                              'store_type': _with_invalid_rows(rng, ["Local", "Mall Kiosk", "Super Store", "Outlet", "Web Portal"], num_rows),
+                              'latitude': (rng.random(num_rows) * 50).astype(str), 'country_code': 'GB', 'continent': 'Europe'}, index=row_numbers)
+    if start_row == 0:
+        stores_df.loc[0, ['longitude', 'latitude', 'store_type']] = ['N/A', 'N/A', 'Web Portal']
+
+    # mixed-unit weights and '£' prices
+    products_df = pd.DataFrame({'Unnamed: 0': row_numbers, 'product_name': 'FurReal Dazzlin Dimples My Bouncin Puppy',
+                                'product_price': [f"£{price:.2f}" for price in rng.random(num_rows) * 100],
+                                'weight': rng.choice(['1.6kg', '100g', '500ml', '12 x 100g', '16oz', '77g .', '2k', '0.45kg'], num_rows),
+                                'category': _with_invalid_rows(rng, ['toys-and-games', 'sports-and-leisure', 'pets', 'homeware'], num_rows),
+                                'EAN': rng.integers(10 ** 12, 10 ** 13, num_rows).astype(str), 'date_added': make_date_strings(num_rows, seed + 4),
+                                'uuid': _make_uuids(rng, num_rows), 'removed': _with_invalid_rows(rng, ['Still_avaliable', 'Removed'], num_rows),
+                                # product codes are 11 characters like the real ones, so they repeat after 10 million rows
+                                'product_code': [f"r{number % 10}-{number % 10 ** 7:07d}b" for number in row_numbers]})
+
+    orders_df = pd.DataFrame({'level_0': row_numbers, 'index': row_numbers, 'date_uuid': _make_uuids(rng, num_rows), 'first_name': None, 'last_name': None,
+                              'user_uuid': rng.choice(users_df['user_uuid'].to_numpy(), num_rows), 'card_number': rng.choice(card_numbers[~question_marks], num_rows),
+                              'store_code': rng.choice(stores_df['store_code'].to_numpy(), num_rows), 'product_code': rng.choice(products_df['product_code'].to_numpy(), num_rows),
+                              '1': None, 'product_quantity': rng.integers(1, 14, num_rows)})
+
+    time_period = _with_invalid_rows(rng, ["Evening", "Morning", "Late_Hours", "Midday"], num_rows)
+    invalid_dates = ~pd.Series(time_period).isin(["Evening", "Morning", "Late_Hours", "Midday"]).to_numpy()
+    date_parts = {part: rng.integers(low, high, num_rows).astype(str).astype(object) for part, (low, high) in {'month': (1, 13), 'year': (1993, 2023), 'day': (1, 29)}.items()}
+    for values in date_parts.values():
+        values[invalid_dates] = 'NULL'
+    seconds = rng.integers(0, 24 * 60 * 60, num_rows)
+    dates_df = pd.DataFrame({'timestamp': [f"{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}" for second in seconds], **date_parts,
+                             'time_period': time_period, 'date_uuid': orders_df['date_uuid']})
+
+    return {'legacy_users': users_df, 'card_details': cards_df, 'store_details': stores_df, 'products': products_df, 'orders_table': orders_df, 'date_times': dates_df}
+
+def time_rows_per_second(function, data):
+    '''
+    This function runs a function once on the given data and returns the result and the throughput.
+
+    Args:
+        function (callable): the function to time.
+        data (pandas.Series): the data passed to the function.
+
+    Returns:
+        tuple: the result of the function and the number of rows processed per second.
+    '''
+    start = time.perf_counter()
+    result = function(data)
+    elapsed = time.perf_counter() - start
+
+    return result, len(data) / elapsed
+
+def benchmark_date_parsing(num_rows=200000):
+    '''
+    This function compares the row-by-row dateutil parse with DatabaseCleaning.parse_date_column and prints the rows/sec of each.
+
+    Args:
+        num_rows (int): the number of rows to benchmark on.
+
+    Returns:
+        dict: the rows/sec for the row-by-row and vectorised parsers.
+    '''
+    date_strings = make_date_strings(num_rows)
+    cleaner = DatabaseCleaning()
+
+    def row_by_row(series):
+        return pd.to_datetime(series.apply(parse), errors='coerce')
+
+    old_result, old_rate = time_rows_per_second(row_by_row, date_strings)
+    new_result, new_rate = time_rows_per_second(cleaner.parse_date_column, date_strings)
+
+    # both parsers must agree before the timings mean anything
+    pd.testing.assert_series_equal(old_result.astype('datetime64[ns]'), new_result, check_names=False)
+
+    print(f"Date parsing on {num_rows} rows: row-by-row {old_rate:,.0f} rows/sec, vectorised {new_rate:,.0f} rows/sec ({new_rate / old_rate:.1f}x)")
+
+    return {'row_by_row': old_rate, 'vectorised': new_rate}
+
+def benchmark_weight_parsing(num_rows=5000000, seed=0):
+    '''
+    This function compares the old two-pass regex weight conversion with DatabaseCleaning.parse_weight_column and prints the rows/sec of each.
+    The parsers agree on plain weights, while the old one turned multipacks such as '12 x 100g' into 12kg and read ounces as kg,
+    so the number of rows the new parser converts differently is printed too.
+
+    Args:
+        num_rows (int): the number of rows to benchmark on.
+        seed (int): seed for the random number generator.
+
+    Returns:
+        dict: the rows/sec for the two-pass and single-pass parsers.
+    '''
+    weights = make_source_frames(1000, seed)['products']['weight']
+    weights = pd.Series(np.random.default_rng(seed).choice(weights.to_numpy(), num_rows))
+    cleaner = DatabaseCleaning()
+
+    def two_pass(series):
+        numeric_value = pd.to_numeric(series.str.extract(r'(\d+.\d+|\d+)')[0], errors='coerce')
+        unit = series.str.extract('([a-zA-Z]+)')[0]
+        return numeric_value * unit.map({'ml': 0.001, 'g': 0.001, 'kg': 1, 'k': 1}).fillna(1)
+
+    old_result, old_rate = time_rows_per_second(two_pass, weights)
+    new_result, new_rate = time_rows_per_second(cleaner.parse_weight_column, weights)
+
+    # both parsers must agree on the weights the old one handled before the timings mean anything
+    plain_weights = ~weights.str.contains(r'[xX]|oz', regex=True)
+    pd.testing.assert_series_equal(old_result[plain_weights], new_result[plain_weights], check_names=False)
+
+    print(f"Weight parsing on {num_rows} rows: two-pass {old_rate:,.0f} rows/sec, single-pass {new_rate:,.0f} rows/sec ({new_rate / old_rate:.1f}x), "
+          f"{(~plain_weights).sum():,} multipack and ounce rows now converted")
+
+    return {'two_pass': old_rate, 'single_pass': new_rate}
+
+def benchmark_cleaning_memory(num_rows=1000000):
+    '''
+    This function reports the peak memory each cleaner allocates on a large synthetic table, next to the size of its input and output.
+    The peak is measured with tracemalloc, which sees Python and NumPy allocations. Process RSS is not used because the allocator
+    reuses pages freed while the data was generated, which hides the cleaner's own peak.
+
+    Args:
+        num_rows (int): the number of rows in each synthetic table.
+
+    Returns:
+        dict: the input size, output size and peak allocated memory in MB, keyed by table name.
+    '''
+    results = {}
+    source_frames = make_source_frames(num_rows)
+    cleaner = DatabaseCleaning()
+
+    for table_name, source_df in source_frames.items():
+        gc.collect()
+        tracemalloc.start()
+        clean_df = clean_source_frame(cleaner, table_name, source_df)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[table_name] = {'input_mb': source_df.memory_usage(deep=True).sum() / 1024 ** 2,
+                               'output_mb': clean_df.memory_usage(deep=True).sum() / 1024 ** 2,
+                               'peak_allocated_mb': peak_bytes / 1024 ** 2}
+        print(f"{table_name}: input {results[table_name]['input_mb']:.0f}MB, output {results[table_name]['output_mb']:.0f}MB, "
+              f"peak allocated while cleaning {results[table_name]['peak_allocated_mb']:.0f}MB")
+        del clean_df
+
+    return results
+
+def benchmark_compact_dtypes(num_rows=1000000):
+    '''
+    This function reports how much memory each cleaned table takes with the standard dtypes and with the compact ones,
+    i.e. categoricals for enumerated columns, Arrow strings for text and UUIDs and the smallest integer types that fit.
+
+    Args:
+        num_rows (int): the number of rows in each synthetic table.
+
+    Returns:
+        dict: the standard and compact sizes in MB and the saving as a fraction, keyed by table name.
+    '''
+    results = {}
+    source_frames = make_source_frames(num_rows)
+    standard_cleaner, compact_cleaner = DatabaseCleaning(), DatabaseCleaning(compact=True)
+
+    for table_name, source_df in source_frames.items():
+        standard_mb = clean_source_frame(standard_cleaner, table_name, source_df).memory_usage(deep=True).sum() / 1024 ** 2
+        compact_mb = clean_source_frame(compact_cleaner, table_name, source_df).memory_usage(deep=True).sum() / 1024 ** 2
+        results[table_name] = {'standard_mb': standard_mb, 'compact_mb': compact_mb, 'saving': 1 - compact_mb / standard_mb}
+        print(f"{table_name}: standard dtypes {standard_mb:.0f}MB, compact dtypes {compact_mb:.0f}MB ({results[table_name]['saving']:.0%} smaller)")
+
+    return results
+
+def benchmark_parallel_cleaning(num_rows=2000000, max_workers=None):
+    '''
+    This function compares the rows per second of each cleaner run in one process and run on a ParallelCleaner, and checks they give the same rows.
+
+    Args:
+        num_rows (int): the number of rows in each synthetic table.
+        max_workers (int): the number of worker processes, one per core if None.
+
+    Returns:
+        dict: the serial and parallel rows per second, keyed by table name.
+    '''
+    results = {}
+    source_frames = make_source_frames(num_rows)
+    serial_cleaner = DatabaseCleaning()
+
+    with ParallelCleaner(max_workers=max_workers) as parallel_cleaner:
+        print(f"Cleaning {num_rows} rows per table on {parallel_cleaner.max_workers} processes:")
+        # start the workers before timing
+        parallel_cleaner.clean_date_data(source_frames['date_times'])
+        for table_name, source_df in source_frames.items():
+            serial_df, serial_rate = time_rows_per_second(lambda source_df: clean_source_frame(serial_cleaner, table_name, source_df), source_df)
+            parallel_df, parallel_rate = time_rows_per_second(lambda source_df: clean_source_frame(parallel_cleaner, table_name, source_df), source_df)
+            # the partial weight sums add up in a different order, so the imputed weights may differ in the last bits
+            pd.testing.assert_frame_equal(serial_df, parallel_df, check_exact=False)
+            results[table_name] = {'serial': serial_rate, 'parallel': parallel_rate}
+            print(f"{table_name}: serial {serial_rate:,.0f} rows/sec, parallel {parallel_rate:,.0f} rows/sec ({parallel_rate / serial_rate:.1f}x)")
+
+    return results
+
+# modules main.py --help must start without, as they take most of the start-up time
+HEAVY_MODULES = ('numpy', 'pandas', 'pyarrow', 'sqlalchemy', 'psycopg2', 'boto3', 'requests', 'tabula', 'matplotlib')
+# modules only needed to extract, clean or chart, which the query path must not load
+EXTRACT_AND_CHART_MODULES = ('boto3', 'requests', 'tabula', 'matplotlib', 'data_extraction', 'data_cleaning', 'parallel_cleaning')
+# the most seconds main.py --help and the query subcommand may spend importing
+HELP_IMPORT_BUDGET = 0.25
+QUERY_IMPORT_BUDGET = 1.5
+
+def benchmark_integrity_check(num_rows=1000000, chunksize=100000):
+    '''
+    This function times the foreign key check of the cleaned orders against the cleaned dimension tables, a chunk at a time as the orders are uploaded,
+    with the hashed anti-joins of ReferentialIntegrityChecker and with a pandas merge for comparison, and checks both find the same orphans.
+    The synthetic orders reference every dimension row, so the orphans are the orders whose keys the cleaners dropped.
+
+    Args:
+        num_rows (int): the number of rows in each synthetic table.
+        chunksize (int): the number of orders checked at a time, as streamed from the RDS table.
+
+    Returns:
+        dict: the orphan rows found and the rows per second of both checks, keyed by foreign key name.
+    '''
+    # imported here so the other benchmarks run without the database libraries
+    from integrity import ReferentialIntegrityChecker
+    from schema import TABLE_SCHEMAS, prepare_frame
+
+    cleaner = DatabaseCleaning()
+    table_frames = {DESTINATION_TABLES[table_name]: prepare_frame(TABLE_SCHEMAS[DESTINATION_TABLES[table_name]], clean_source_frame(cleaner, table_name, source_df))
+                    for table_name, source_df in make_source_frames(num_rows).items()}
+    orders_df = table_frames['orders_table']
+    foreign_keys = TABLE_SCHEMAS['orders_table'].foreign_keys
+    order_chunks = [orders_df.iloc[start:start + chunksize] for start in range(0, len(orders_df), chunksize)]
+
+    checker = ReferentialIntegrityChecker('orders_table')
+    start = time.perf_counter()
+    for foreign_key in foreign_keys:
+        checker.add_keys(foreign_key.references_table, foreign_key.references_column, table_frames[foreign_key.references_table][foreign_key.references_column])
+    for chunk_df in order_chunks:
+        checker.check(chunk_df)
+    hashed_rate = len(orders_df) / (time.perf_counter() - start)
+
+    # the merge joins each chunk to the referenced keys again, as nothing is kept between chunks
+    merge_orphans = dict.fromkeys((foreign_key.name for foreign_key in foreign_keys), 0)
+    start = time.perf_counter()
+    for chunk_df in order_chunks:
+        for foreign_key in foreign_keys:
+            keys_df = table_frames[foreign_key.references_table][[foreign_key.references_column]].drop_duplicates()
+            merged_df = chunk_df[[foreign_key.column]].merge(keys_df, how='left', left_on=foreign_key.column, right_on=foreign_key.references_column, indicator=True)
+            merge_orphans[foreign_key.name] += int(((merged_df['_merge'] == 'left_only') & merged_df[foreign_key.column].notna()).sum())
+    merge_rate = len(orders_df) / (time.perf_counter() - start)
+
+    results = {}
+    print(f"Checking the foreign keys of {len(orders_df)} orders in chunks of {chunksize} ({hashed_rate:,.0f} rows/sec with hashed anti-joins):")
+    for foreign_key in foreign_keys:
+        report = checker.reports[foreign_key.name]
+        assert report.orphan_rows == merge_orphans[foreign_key.name], \
+            f"{foreign_key.name}: {report.orphan_rows} orphans with the hashed anti-join, {merge_orphans[foreign_key.name]} with the merge"
+        results[foreign_key.name] = {'orphan_rows': report.orphan_rows, 'hashed_rows_per_sec': hashed_rate, 'merge_rows_per_sec': merge_rate}
+        print(f"  {foreign_key.name}: {report.orphan_rows} orphans, e.g. {report.samples[:2]}")
+    print(f"  pandas merge: {merge_rate:,.0f} rows/sec ({hashed_rate / merge_rate:.1f}x slower than the hashed anti-joins)")
+
+    return results
+
+def profile_imports(main_args):
+    '''
+    This function runs main.py under python -X importtime and reads which modules it imported and how long they took.
+
+    Args:
+        main_args (list): the command line arguments for main.py.
+
+    Returns:
+        tuple: the total import time in seconds and the set of imported module names.
+    '''
+    completed = subprocess.run([sys.executable, '-X', 'importtime', 'main.py', *main_args], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    total_us, modules = 0, set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, cumulative_us, name = line.split('|')
+        modules.add(name.strip())
+        # nested imports are indented below the import that triggered them and are already in its cumulative time
+        if not name[1:].startswith(' ') and cumulative_us.strip().isdigit():
+            total_us += int(cumulative_us)
+
+    return total_us / 10 ** 6, modules
+
+def benchmark_import_time(creds_file=None, help_budget=HELP_IMPORT_BUDGET, query_budget=QUERY_IMPORT_BUDGET):
+    '''
+    This function checks that main.py starts quickly: --help must import none of the heavy libraries, and the query subcommand none of the
+    extraction, cleaning or charting code, each within its import time budget.
+
+    Args:
+        creds_file (str): YAML credentials of a database to run the query subcommand against, the query path is not checked if the file is missing.
+        help_budget (float): the most seconds --help may spend importing.
+        query_budget (float): the most seconds the query subcommand may spend importing.
+
+    Returns:
+        list: the problems found, empty if main.py is within its budgets.
+    '''
+    problems = []
+    checks = [('--help', ['--help'], help_budget, HEAVY_MODULES)]
+    if creds_file is not None and os.path.exists(creds_file):
+        checks.append(('query', ['--sales-data-creds', os.path.abspath(creds_file), '--no-chart', 'query'], query_budget, EXTRACT_AND_CHART_MODULES))
+    else:
+        print(f"Not checking the query path, as there are no credentials in {creds_file}")
+
+    for label, main_args, budget, forbidden_modules in checks:
+        seconds, modules = profile_imports(main_args)
+        imported = [module for module in forbidden_modules if module in modules]
+        print(f"main.py {label}: {seconds:.2f}s importing {len(modules)} modules, budget {budget:.2f}s" + (f", imports {', '.join(imported)}" if imported else ""))
+        if seconds > budget:
+            problems.append(f"{label} spends {seconds:.2f}s importing, over its {budget:.2f}s budget")
+        if imported:
+            problems.append(f"{label} imports {', '.join(imported)}")
+
+    return problems
+
+# scale factors for the pipeline benchmark, in rows per source table
+SCALE_FACTORS = {'10k': 10000, '100k': 100000, '1m': 1000000, '10m': 10000000, '100m': 100000000}
+
+# the sales_data table each raw source is uploaded to
+DESTINATION_TABLES = {'legacy_users': 'dim_users', 'card_details': 'dim_card_details', 'store_details': 'dim_store_details',
+                      'products': 'dim_products', 'orders_table': 'orders_table', 'date_times': 'dim_date_times'}
+
+def iter_source_chunks(num_rows, chunk_rows=1000000, seed=0):
+    '''
+    This function generates the six raw source tables chunk by chunk, so that large scale factors never have to fit in memory at once.
+
+    Args:
+        num_rows (int): the total number of rows in each table.
+        chunk_rows (int): the number of rows in each chunk.
+        seed (int): seed for the random number generator, each chunk uses the next seed.
+
+    Yields:
+        dict: the raw DataFrames for one chunk, keyed by table name.
+    '''
+    for chunk_number, start_row in enumerate(range(0, num_rows, chunk_rows)):
+        yield make_source_frames(min(chunk_rows, num_rows - start_row), seed=seed + chunk_number, start_row=start_row)
+
+def benchmark_business_queries(engine, file_path='sql_files/essential_queries/business_queries.sql', max_workers=1):
+    '''
+    This function times each statement of the business queries script against a database.
+    A statement that fails, e.g. PostgreSQL-only syntax run on SQLite, is recorded with its error and the rest still run.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): the engine connected to the database holding the uploaded tables.
+        file_path (str): path to the business queries SQL script.
+        max_workers (int): the number of queries run at the same time, 1 times each query on its own.
+
+    Returns:
+        list: the statement number, first line, seconds, number of rows returned and any error for each statement.
+    '''
+    results = QueryRunner(engine, max_workers=max_workers).run_file(file_path)
+    return [{'statement': result.statement_number, 'sql': ' '.join(result.sql.split())[:60], 'seconds': result.seconds,
+             'rows': result.rows, 'error': result.error} for result in results]
+
+def benchmark_pipeline(scale='10k', creds_file='db_creds.yaml', chunk_rows=1000000, seed=0, query_file_path='sql_files/essential_queries/business_queries.sql'):
+    '''
+    This function runs the clean and upload steps on synthetic data at a scale factor, then the business queries on the uploaded tables,
+    and times each DatabaseCleaning method, each upload_to_db and each query. The database can be a local PostgreSQL or SQLite,
+    given by a credentials file with the usual fields or a single URL field, e.g. URL: sqlite:///benchmark.db
+
+    Args:
+        scale (str): a key of SCALE_FACTORS.
+        creds_file (str): path to the YAML credentials of the database to upload to, which has its tables replaced.
+        chunk_rows (int): the number of rows generated, cleaned and uploaded at a time.
+        seed (int): seed for the random number generator.
+        query_file_path (str): path to the business queries SQL script.
+
+    Returns:
+        dict: the timings of the run.
+    '''
+    # imported here so the date and memory benchmarks run without the database libraries
+    from database_utils import DatabaseConnector
+    from schema import TABLE_SCHEMAS, create_indexes, create_tables, prepare_frame
+
+    num_rows = SCALE_FACTORS[scale]
+    cleaner = DatabaseCleaning()
+    clean_results = {table_name: {'seconds': 0.0, 'rows_in': 0, 'rows_out': 0} for table_name in DESTINATION_TABLES}
+    upload_results = {table_name: {'seconds': 0.0, 'rows': 0} for table_name in DESTINATION_TABLES.values()}
+
+    with DatabaseConnector() as database_connector:
+        engine = database_connector.init_db_engine(creds_file)
+        # load into the typed tables the pipeline uses
+        create_tables(engine, {table_name: TABLE_SCHEMAS[table_name] for table_name in DESTINATION_TABLES.values()})
+        for chunk_number, source_frames in enumerate(iter_source_chunks(num_rows, chunk_rows, seed)):
+            for table_name, source_df in source_frames.items():
+                start = time.perf_counter()
+                clean_df = clean_source_frame(cleaner, table_name, source_df)
+                clean_results[table_name]['seconds'] += time.perf_counter() - start
+                clean_results[table_name]['rows_in'] += len(source_df)
+                clean_results[table_name]['rows_out'] += len(clean_df)
+
+                destination_table = DESTINATION_TABLES[table_name]
+                start = time.perf_counter()
+                table_df = prepare_frame(TABLE_SCHEMAS[destination_table], clean_df)
+                database_connector.upload_to_db(table_df, destination_table, creds_file, if_exists='truncate' if chunk_number == 0 else 'append')
+                upload_results[destination_table]['seconds'] += time.perf_counter() - start
+                upload_results[destination_table]['rows'] += len(clean_df)
+            del source_frames, clean_df
+
+        # the queries run on indexed tables, as they do after the pipeline's create_indexes stage
+        start = time.perf_counter()
+        create_indexes(engine, {table_name: TABLE_SCHEMAS[table_name] for table_name in DESTINATION_TABLES.values()})
+        index_results = {'all tables': {'seconds': time.perf_counter() - start, 'rows': sum(timings['rows'] for timings in upload_results.values())}}
+        query_results = benchmark_business_queries(engine, query_file_path)
+        dialect = engine.dialect.name
+
+    for timings in clean_results.values():
+        timings['rows_per_sec'] = timings['rows_in'] / timings['seconds']
+    for timings in list(upload_results.values()) + list(index_results.values()):
+        timings['rows_per_sec'] = timings['rows'] / timings['seconds']
+
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': _git_commit(), 'scale': scale, 'rows': num_rows,
+            'database': dialect, 'clean': clean_results, 'upload': upload_results, 'index': index_results,
+            'queries': query_results}
+
+def _git_commit():
+    '''
+    This function returns the short hash of the checked out commit, or None outside a git repository.
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def record_benchmark(result, history_path='benchmark_history.json', tolerance=0.25, min_seconds=0.05):
+    '''
+    This function appends a benchmark result to the JSON history and prints how each timing compares with the last run
+    at the same scale on the same database, flagging anything more than tolerance slower as a regression.
+    Timings shorter than min_seconds are too noisy to compare and are never flagged.
+
+    Args:
+        result (dict): the result of benchmark_pipeline.
+        history_path (str): path to the JSON history file, created if it does not exist.
+        tolerance (float): the fraction slower a timing can be before it is flagged.
+        min_seconds (float): the shortest timing that can be flagged.
+
+    Returns:
+        list: descriptions of the regressions found.
+    '''
+    history = []
+    if os.path.exists(history_path):
+        with open(history_path, 'r') as history_file:
+            history = json.load(history_file)
+
+    previous = next((run for run in reversed(history) if run['scale'] == result['scale'] and run['database'] == result['database']), None)
+    regressions = []
+    timings = [(f"{section} {name}", section, name) for section in ('clean', 'upload', 'index') for name in result.get(section, {})]
+    for label, section, name in timings:
+        seconds = result[section][name]['seconds']
+        line = f"{label}: {seconds:.3f}s ({result[section][name]['rows_per_sec']:,.0f} rows/sec)"
+        if previous is not None and name in previous.get(section, {}):
+            change = seconds / previous[section][name]['seconds'] - 1
+            line += f", {change:+.0%} vs {previous['commit'] or previous['timestamp']}"
+            if change > tolerance and seconds >= min_seconds:
+                regressions.append(label)
+                line += " REGRESSION"
+        print(line)
+
+    previous_queries = {query['statement']: query for query in previous['queries']} if previous is not None else {}
+    for query in result['queries']:
+        if query['error'] is not None:
+            print(f"query {query['statement']} ({query['sql']}): failed, {query['error']}")
+            continue
+        line = f"query {query['statement']} ({query['sql']}): {query['seconds']:.3f}s" + ("" if query['rows'] is None else f", {query['rows']} rows")
+        previous_query = previous_queries.get(query['statement'])
+        if previous_query is not None and previous_query['seconds']:
+            change = query['seconds'] / previous_query['seconds'] - 1
+            line += f", {change:+.0%}"
+            if change > tolerance and query['seconds'] >= min_seconds:
+                regressions.append(f"query {query['statement']}")
+                line += " REGRESSION"
+        print(line)
+
+    history.append(result)
+    with open(history_path, 'w') as history_file:
+        json.dump(history, history_file, indent=2)
+
+    return regressions
+
+def parse_args():
+    '''
+    This function reads the command line options for the benchmarks.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    '''
+    parser = argparse.ArgumentParser(description="Benchmark the cleaning, upload and query steps on synthetic data.")
+    parser.add_argument('benchmarks', nargs='*', choices=['date_parsing', 'weight_parsing', 'memory', 'compact', 'parallel', 'integrity', 'import_time', 'pipeline'],
+                        default=['date_parsing', 'weight_parsing', 'memory', 'compact'], help="benchmarks to run")
+    parser.add_argument('--scale', choices=list(SCALE_FACTORS), default='10k', help="rows per source table for the pipeline benchmark")
+    parser.add_argument('--creds', default='benchmark_creds.yaml', help="YAML credentials of the local PostgreSQL or SQLite database the pipeline benchmark uploads to")
+    parser.add_argument('--chunk-rows', type=int, default=1000000, help="rows generated, cleaned and uploaded at a time")
+    parser.add_argument('--history', default='benchmark_history.json', help="JSON file the pipeline benchmark results are appended to")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if 'date_parsing' in args.benchmarks:
+        benchmark_date_parsing()
+    if 'weight_parsing' in args.benchmarks:
+        benchmark_weight_parsing()
+    if 'memory' in args.benchmarks:
+        benchmark_cleaning_memory()
+    if 'compact' in args.benchmarks:
+        benchmark_compact_dtypes()
+    if 'parallel' in args.benchmarks:
+        benchmark_parallel_cleaning()
+    if 'integrity' in args.benchmarks:
+        benchmark_integrity_check()
+    if 'import_time' in args.benchmarks:
+        problems = benchmark_import_time(args.creds)
+        if problems:
+            raise SystemExit(f"main.py is over its start-up budget: {'; '.join(problems)}")
+    if 'pipeline' in args.benchmarks:
+        result = benchmark_pipeline(args.scale, args.creds, chunk_rows=args.chunk_rows)
+        regressions = record_benchmark(result, args.history)
+        if regressions:
+            print(f"Slower than the last run: {', '.join(regressions)}")
@@ -0,0 +1,196 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import pandas as pd
+
+from extraction_cache import parquet_ready
+
+''' Keeps a durable record of each pipeline run, so a failed run can be resumed instead of started again. The manifest
+holds, for each stage, the fingerprint of its inputs, whether it finished or failed, how many rows it produced and
+how long it took. The load stages also keep their cleaned output as Parquet parts, so a stage that failed while
+uploading can upload again without extracting and cleaning its source again.'''
+
+class CheckpointStore:
+    '''
+    This class can be used to record the outcome of each pipeline stage in a manifest, and keep the cleaned output of the load stages as Parquet artifacts.
+
+    '''
+
+    def __init__(self, checkpoint_dir='.checkpoints'):
+        '''
+        This function opens the checkpoint directory, creating it and its manifest if needed.
+
+        Args:
+            checkpoint_dir (str): The directory the manifest and the artifacts are kept in.
+        '''
+        self.checkpoint_dir = checkpoint_dir
+        self.manifest_path = os.path.join(checkpoint_dir, 'manifest.json')
+        # stages running on the pipeline's threads record their outcome at the same time
+        self._lock = threading.Lock()
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as manifest_file:
+                self.manifest = json.load(manifest_file)
+        else:
+            self.manifest = {}
+        # the stages as the last run left them, which the resume decisions are based on
+        self.previous = {name: dict(entry) for name, entry in self.manifest.items()}
+
+    def fingerprint(self, name, inputs, dependency_fingerprints):
+        '''
+        This function combines what a stage's output depends on into one fingerprint.
+
+        Args:
+            name (str): The name of the stage.
+            inputs (object): The version of the stage's own inputs, e.g. its source's ETag, which must be JSON serialisable.
+            dependency_fingerprints (list): The fingerprints of the stages it depends on.
+
+        Returns:
+            str: The fingerprint.
+        '''
+        fingerprint_json = json.dumps([name, inputs, dependency_fingerprints], default=str)
+        return hashlib.sha256(fingerprint_json.encode('utf-8')).hexdigest()[:20]
+
+    def is_done(self, name, fingerprint=None):
+        '''
+        This function checks whether a stage finished in the last run, and if a fingerprint is given, whether it ran on the same inputs.
+
+        Args:
+            name (str): The name of the stage.
+            fingerprint (str): The fingerprint of the stage's inputs in this run.
+
+        Returns:
+            bool: True if the stage can be skipped.
+        '''
+        entry = self.previous.get(name)
+        return entry is not None and entry['status'] == 'done' and (fingerprint is None or entry['fingerprint'] == fingerprint)
+
+    def previous_fingerprint(self, name):
+        '''
+        This function returns the fingerprint a stage last ran with, or None if it never ran.
+        '''
+        return self.previous.get(name, {}).get('fingerprint')
+
+    def start(self, name, fingerprint, keep_artifact=False):
+        '''
+        This function records that a stage has started.
+
+        Args:
+            name (str): The name of the stage.
+            fingerprint (str): The fingerprint of the stage's inputs.
+            keep_artifact (bool): Keep a complete artifact from the last run for the stage to reuse, if its inputs have not changed.
+        '''
+        with self._lock:
+            entry = {'status': 'running', 'fingerprint': fingerprint, 'started_at': time.time()}
+            previous = self.previous.get(name, {})
+            if keep_artifact and previous.get('fingerprint') == fingerprint and 'artifact' in previous:
+                entry['artifact'] = previous['artifact']
+            self.manifest[name] = entry
+            self._save_manifest()
+
+    def finish(self, name, seconds, rows=None):
+        '''
+        This function records that a stage finished.
+
+        Args:
+            name (str): The name of the stage.
+            seconds (float): The wall time of the stage.
+            rows (int): The number of rows the stage produced, if it produced a table.
+        '''
+        with self._lock:
+            self.manifest[name].update(status='done', seconds=round(seconds, 3), rows=rows, finished_at=time.time())
+            self._save_manifest()
+
+    def fail(self, name, seconds, error):
+        '''
+        This function records that a stage failed, and why.
+        '''
+        with self._lock:
+            self.manifest[name].update(status='failed', seconds=round(seconds, 3), error=f"{type(error).__name__}: {error}", finished_at=time.time())
+            self._save_manifest()
+
+    def invalidate(self, names):
+        '''
+        This function marks finished stages as outdated, e.g. because a stage they depend on is about to run again, so a resumed run does not skip them.
+
+        Args:
+            names (list): The names of the stages.
+        '''
+        with self._lock:
+            outdated = [name for name in names if self.manifest.get(name, {}).get('status') == 'done']
+            for name in outdated:
+                self.manifest[name]['status'] = 'outdated'
+            if outdated:
+                self._save_manifest()
+
+    def reusable_artifact(self, name):
+        '''
+        This function returns the record of a stage's cleaned output if a complete one was kept from a run on the same inputs.
+
+        Args:
+            name (str): The name of the stage.
+
+        Returns:
+            dict: The number of parts and rows, and anything else saved with the artifact, or None if the source must be extracted again.
+        '''
+        with self._lock:
+            return self.manifest.get(name, {}).get('artifact')
+
+    def start_artifact(self, name):
+        '''
+        This function empties a stage's artifact directory before its cleaned output is written to it.
+        '''
+        with self._lock:
+            self.manifest.get(name, {}).pop('artifact', None)
+            self._save_manifest()
+        artifact_dir = os.path.join(self.checkpoint_dir, name)
+        shutil.rmtree(artifact_dir, ignore_errors=True)
+        os.makedirs(artifact_dir)
+
+    def write_part(self, name, part_number, clean_df):
+        '''
+        This function writes one part of a stage's cleaned output as Parquet.
+
+        Args:
+            name (str): The name of the stage.
+            part_number (int): The number of the part, e.g. the number of the RDS chunk.
+            clean_df (pandas.DataFrame): The cleaned rows.
+        '''
+        parquet_ready(clean_df).to_parquet(os.path.join(self.checkpoint_dir, name, f"part-{part_number:05d}.parquet"))
+
+    def complete_artifact(self, name, parts, rows, **details):
+        '''
+        This function records that every part of a stage's cleaned output has been written, so a resumed run can upload it without extracting it again.
+
+        Args:
+            name (str): The name of the stage.
+            parts (int): The number of parts written.
+            rows (int): The number of rows in all the parts.
+            **details: Anything else the stage needs to upload the artifact, e.g. its watermark, which must be JSON serialisable.
+        '''
+        with self._lock:
+            self.manifest[name]['artifact'] = {'parts': parts, 'rows': rows, **details}
+            self._save_manifest()
+
+    def read_parts(self, name):
+        '''
+        This function reads a stage's cleaned output back, one part at a time.
+
+        Yields:
+            pandas.DataFrame: The next part, in the order they were written.
+        '''
+        for part_path in sorted(glob.glob(os.path.join(self.checkpoint_dir, name, 'part-*.parquet'))):
+            yield pd.read_parquet(part_path)
+
+    def _save_manifest(self):
+        '''
+        This function writes the manifest to disk, replacing the old one in a single step, so a crash never leaves half a manifest.
+        '''
+        temporary_path = self.manifest_path + '.tmp'
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2, default=str)
+        os.replace(temporary_path, self.manifest_path)
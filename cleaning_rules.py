@@ -0,0 +1,233 @@
+from dataclasses import dataclass, field
+import pandas as pd
+
+from tracing import current_span
+
+''' The cleaning rules for each source table, and the compiler which turns a table's rules into
+a CleaningPlan that DatabaseCleaning runs. Changing a rule or adding a source only means editing TABLE_RULES.'''
+
+@dataclass(frozen=True)
+class TableRules:
+    '''
+    This class holds the declarative cleaning rules for one source table.
+
+    Attributes:
+        name (str): the name of the table the rules are for.
+        filter_column (str): the column whose values decide which rows are valid.
+        valid_values (tuple): the values of filter_column that mark a valid row, rows with anything else or NULL are dropped.
+        drop_index_labels (tuple): index labels of rows to drop.
+        drop_columns (tuple): columns to leave out of the cleaned table.
+        index_column (str): a column to use as the index of the cleaned table.
+        text_replacements (dict): column name mapped to (old, new) substring replacements, applied to the text of the column before filtering.
+        value_replacements (dict): column name mapped to {old value: new value} replacements of whole values.
+        upper_case_columns (tuple): columns converted to upper case.
+        renames (dict): old column name mapped to new name, renamed columns are moved after the others.
+        dtypes (dict): column name (after renaming) mapped to its dtype.
+        compact_dtypes (dict): column name mapped to a smaller dtype used instead in compact mode: 'category' for enumerated columns,
+            Arrow-backed strings for text and UUIDs, and the smallest integer type that holds the values.
+        date_columns (tuple): columns of mixed-format date strings converted to datetime64.
+    '''
+    name: str
+    filter_column: str = None
+    valid_values: tuple = ()
+    drop_index_labels: tuple = ()
+    drop_columns: tuple = ()
+    index_column: str = None
+    text_replacements: dict = field(default_factory=dict)
+    value_replacements: dict = field(default_factory=dict)
+    upper_case_columns: tuple = ()
+    renames: dict = field(default_factory=dict)
+    dtypes: dict = field(default_factory=dict)
+    compact_dtypes: dict = field(default_factory=dict)
+    date_columns: tuple = ()
+
+# text stored in Arrow buffers rather than as a Python object per value
+ARROW_STRING = 'string[pyarrow]'
+
+TABLE_RULES = {
+    'users': TableRules(
+        name='users',
+        filter_column='country',
+        valid_values=("Germany", "United Kingdom", "United States"),
+        index_column='index',
+        dtypes={'first_name': 'string', 'last_name': 'string', 'company': 'string', 'email_address': 'string', 'address': 'string',
+                'country': 'string', 'country_code': 'string', 'phone_number': 'string', 'user_uuid': 'string'},
+        compact_dtypes={'first_name': ARROW_STRING, 'last_name': ARROW_STRING, 'company': ARROW_STRING, 'email_address': ARROW_STRING,
+                        'address': ARROW_STRING, 'country': 'category', 'country_code': 'category', 'phone_number': ARROW_STRING,
+                        'user_uuid': ARROW_STRING},
+        date_columns=('date_of_birth', 'join_date'),
+    ),
+    'card_details': TableRules(
+        name='card_details',
+        filter_column='card_provider',
+        valid_values=("American Express", "Diners Club / Carte Blanche", "Discover", "JCB 15 digit", "JCB 16 digit", "Maestro", "Mastercard",
+                      "VISA 13 digit", "VISA 16 digit", "VISA 19 digit"),
+        # drop the '?' characters in invalid card_numbers
+        text_replacements={'card_number': [("?", "")]},
+        dtypes={'card_number': 'int64', 'expiry_date': 'string', 'card_provider': 'string'},
+        compact_dtypes={'expiry_date': 'category', 'card_provider': 'category'},
+        date_columns=('date_payment_confirmed',),
+    ),
+    'store_details': TableRules(
+        name='store_details',
+        filter_column='store_type',
+        valid_values=("Local", "Mall Kiosk", "Super Store", "Outlet", "Web Portal"),
+        # the web portal at index 0 has N/A longitude and latitude, it is re-entered in SQL
+        drop_index_labels=(0,),
+        drop_columns=('lat',),
+        # staff_numbers has values with "accidental" letters mixed in
+        value_replacements={'staff_numbers': {"J78": "78", "30e": "30", "80R": "80", "A97": "97", "3n9": "39"}},
+        dtypes={'latitude': 'float64', 'longitude': 'float64', 'address': 'string', 'locality': 'string', 'store_code': 'string',
+                'staff_numbers': 'int64', 'store_type': 'string', 'country_code': 'string', 'continent': 'string'},
+        compact_dtypes={'address': ARROW_STRING, 'locality': 'category', 'store_code': ARROW_STRING, 'staff_numbers': 'int16',
+                        'store_type': 'category', 'country_code': 'category', 'continent': 'category'},
+        date_columns=('opening_date',),
+    ),
+    'products': TableRules(
+        name='products',
+        filter_column='removed',
+        valid_values=("Still_available", "Removed"),
+        # correct the spelling mistake of 'avaliable' before filtering, and remove £ from the price
+        text_replacements={'removed': [('Still_avaliable', 'Still_available')], 'product_price': [("£", "")]},
+        upper_case_columns=('product_code',),
+        renames={'product_price': 'product_price_sterling'},
+        dtypes={'product_name': 'string', 'category': 'string', 'EAN': 'string', 'uuid': 'string', 'product_code': 'string',
+                'removed': 'string', 'product_price_sterling': 'float64'},
+        compact_dtypes={'product_name': ARROW_STRING, 'category': 'category', 'EAN': ARROW_STRING, 'uuid': ARROW_STRING,
+                        'product_code': ARROW_STRING, 'removed': 'category'},
+        date_columns=('date_added',),
+    ),
+    'orders': TableRules(
+        name='orders',
+        drop_columns=("first_name", "last_name", "1"),
+        upper_case_columns=('product_code',),
+        dtypes={'date_uuid': 'string', 'user_uuid': 'string', 'store_code': 'string', 'product_code': 'string'},
+        # there are far fewer stores than orders
+        compact_dtypes={'date_uuid': ARROW_STRING, 'user_uuid': ARROW_STRING, 'store_code': 'category', 'product_code': ARROW_STRING,
+                        'product_quantity': 'int16'},
+    ),
+    'date_times': TableRules(
+        name='date_times',
+        filter_column='time_period',
+        valid_values=("Evening", "Morning", "Late_Hours", "Midday"),
+        dtypes={'month': 'int32', 'year': 'int32', 'day': 'int32', 'time_period': 'string', 'date_uuid': 'string', 'timestamp': 'string'},
+        compact_dtypes={'month': 'int8', 'year': 'int16', 'day': 'int8', 'time_period': 'category', 'date_uuid': ARROW_STRING,
+                        'timestamp': ARROW_STRING},
+    ),
+}
+
+class CleaningPlan:
+    '''
+    This class is the compiled, reusable form of a table's rules. Running it on a DataFrame does one membership test,
+    builds the kept columns in one pass, casts them with one batched astype and parses all date columns in one pass.
+    A plan holds no state from the frames it cleans, so the same plan can be run on every chunk of a streamed table.
+
+    '''
+
+    def __init__(self, rules, parse_dates, compact=False):
+        '''
+        This function compiles a table's rules into a plan.
+
+        Args:
+            rules (TableRules): the rules to compile.
+            parse_dates (callable): the function that converts a Series of date strings to datetime64.
+            compact (bool): cast to the rules' compact dtypes where they have one.
+        '''
+        self.rules = rules
+        self.dtypes = {**rules.dtypes, **rules.compact_dtypes} if compact else dict(rules.dtypes)
+        # the filter column only holds the valid values, so every chunk gets the same categories
+        if self.dtypes.get(rules.filter_column) == 'category':
+            self.dtypes[rules.filter_column] = pd.CategoricalDtype(rules.valid_values)
+        self.parse_dates = parse_dates
+        self.valid_values = pd.Index(rules.valid_values)
+        self.drop_index_labels = pd.Index(rules.drop_index_labels)
+        # columns that need their text edited are cast to string first
+        self.text_columns = set(rules.text_replacements) | set(rules.upper_case_columns)
+
+    def execute(self, input_df):
+        '''
+        This function runs the plan on a DataFrame. The input DataFrame is not modified.
+
+        Args:
+            input_df (pandas.DataFrame): the raw DataFrame to clean.
+
+        Returns:
+            pandas.DataFrame: the cleaned DataFrame.
+        '''
+        rules = self.rules
+
+        # 1. one membership test, on the filter column after its text has been corrected
+        # the rows each mask removes are recorded on the current span, counting only rows the earlier masks kept
+        span = current_span()
+        row_mask = None
+        if rules.filter_column is not None:
+            row_mask = self._edit_column(rules.filter_column, input_df[rules.filter_column]).isin(self.valid_values).to_numpy(dtype=bool)
+            span.set_attribute(f"rows_dropped_by_{rules.filter_column}", int(len(row_mask) - row_mask.sum()))
+        if len(self.drop_index_labels):
+            keep_labels = ~input_df.index.isin(self.drop_index_labels)
+            kept_rows = len(input_df) if row_mask is None else int(row_mask.sum())
+            row_mask = keep_labels if row_mask is None else row_mask & keep_labels
+            span.set_attribute("rows_dropped_by_index", kept_rows - int(row_mask.sum()))
+
+        def select(column):
+            return input_df[column] if row_mask is None else input_df[column][row_mask]
+
+        index = input_df.index if row_mask is None else input_df.index[row_mask]
+        if rules.index_column is not None:
+            index = pd.Index(select(rules.index_column), name=rules.index_column)
+
+        # 2. one pass over the columns, masking and editing each one once
+        clean_columns = {}
+        renamed_columns = {}
+        for column in input_df.columns:
+            if column in rules.drop_columns or column == rules.index_column:
+                continue
+            clean_column = self._edit_column(column, select(column).set_axis(index))
+            if column in rules.renames:
+                renamed_columns[rules.renames[column]] = clean_column
+            else:
+                clean_columns[column] = clean_column
+        clean_columns.update(renamed_columns)
+        clean_df = pd.DataFrame(clean_columns, index=index, copy=False)
+
+        # 3. one batched astype
+        clean_df = clean_df.astype({column: dtype for column, dtype in self.dtypes.items() if column in clean_df.columns})
+
+        # 4. one date pass, every date column is stacked into one Series, parsed together and split back
+        date_columns = [column for column in rules.date_columns if column in clean_df.columns]
+        if date_columns:
+            stacked_dates = pd.concat([clean_df[column] for column in date_columns], ignore_index=True)
+            parsed_dates = self.parse_dates(stacked_dates).to_numpy()
+            for position, column in enumerate(date_columns):
+                clean_df[column] = parsed_dates[position * len(clean_df):(position + 1) * len(clean_df)]
+
+        return clean_df
+
+    def _edit_column(self, column, values):
+        '''
+        This function applies the text and value replacements and upper-casing for a column.
+        '''
+        rules = self.rules
+        if column in self.text_columns:
+            values = values.astype('string')
+            for old, new in rules.text_replacements.get(column, []):
+                values = values.str.replace(old, new, regex=False)
+            if column in rules.upper_case_columns:
+                values = values.str.upper()
+        if column in rules.value_replacements:
+            values = values.replace(rules.value_replacements[column])
+        return values
+
+def compile_rules(rules, parse_dates, compact=False):
+    '''
+    This function compiles a table's cleaning rules into a CleaningPlan.
+
+    Args:
+        rules (TableRules): the rules to compile.
+        parse_dates (callable): the function that converts a Series of date strings to datetime64.
+        compact (bool): cast to the rules' compact dtypes where they have one.
+
+    Returns:
+        CleaningPlan: the compiled plan.
+    '''
+    return CleaningPlan(rules, parse_dates, compact)
@@ -1,15 +1,96 @@
 from dateutil.parser import parse
+import re
+import numpy as np
 import pandas as pd
 
+from cleaning_rules import TABLE_RULES, compile_rules
+
+# date formats seen in the raw sources, tried in order before falling back to dateutil
+DATE_FORMATS = ['%Y-%m-%d', '%Y/%m/%d', '%B %d %Y', '%B %Y %d', '%Y %B %d', '%d %B %Y']
+
+# a weight is an optional multipack count, a quantity and a unit, e.g. '1.6kg', '12 x 100g' or '77g .'
+WEIGHT_PATTERN = re.compile(r'^\s*(?:(?P<count>\d+)\s*[xX]\s*)?(?P<quantity>\d*\.?\d+)\s*(?P<unit>[a-zA-Z]*)')
+# kg per unit, with millilitres weighed as water and a weight without a unit taken to be in kg
+UNIT_TO_KG = {'': 1.0, 'kg': 1.0, 'k': 1.0, 'g': 0.001, 'ml': 0.001, 'l': 1.0, 'oz': 0.028349523125, 'lb': 0.45359237}
+
 class DatabaseCleaning:
     '''
     This class can be used to clean data from a variety of Amazon Web Services (AWS) data sources.
 
     '''
 
+    def __init__(self, rules=TABLE_RULES, compact=False):
+        '''
+        This function creates the cleaner. The rules for each table are compiled into plans when they are first used.
+
+        Args:
+            rules (dict): the TableRules for each table, keyed by table name.
+            compact (bool): clean to compact dtypes, i.e. categoricals, Arrow strings and small integers, which use less memory.
+        '''
+        self.rules = rules
+        self.compact = compact
+        self._plans = {}
+
+    def parse_date_column(self, date_series, date_formats=DATE_FORMATS):
+        '''
+        This function converts a column of mixed-format date strings to datetime64.
+        Each known format is parsed in one vectorised call and only the rows left over are passed to dateutil's parse.
+
+        Args:
+            date_series (pandas.Series): the column of date strings to convert.
+            date_formats (list): strftime formats to try, in order.
+
+        Returns:
+            pandas.Series: the converted column, with NaT where a value could not be parsed.
+        '''
+        date_strings = date_series.astype('string').str.strip()
+        parsed = pd.Series(pd.NaT, index=date_series.index, dtype='datetime64[ns]')
+        # positions that still need parsing, nulls are left as NaT
+        remaining = date_strings.notna().to_numpy(dtype=bool, copy=True)
+
+        for date_format in date_formats:
+            if not remaining.any():
+                break
+            attempt = pd.to_datetime(date_strings[remaining], format=date_format, errors='coerce')
+            matched = attempt.notna().to_numpy()
+            matched_rows = np.flatnonzero(remaining)[matched]
+            parsed.iloc[matched_rows] = attempt[matched].to_numpy()
+            remaining[matched_rows] = False
+
+        # anything that matched none of the formats goes through the slow fuzzy parser
+        if remaining.any():
+            leftover = date_strings[remaining].apply(self._fuzzy_parse)
+            parsed.iloc[np.flatnonzero(remaining)] = pd.to_datetime(leftover, errors='coerce').to_numpy()
+
+        return parsed
+
+    def _fuzzy_parse(self, date_string):
+        '''
+        This function parses a single date string with dateutil, returning NaT if it cannot be read.
+        '''
+        try:
+            return parse(date_string)
+        except (ValueError, OverflowError):
+            return pd.NaT
+
+    def cleaning_plan(self, table_name):
+        '''
+        This function returns the compiled cleaning plan for a table, compiling its rules the first time they are needed.
+
+        Args:
+            table_name (str): the name of the table in the rules, e.g. 'users'.
+
+        Returns:
+            CleaningPlan: the plan, which can be reused for every chunk of the table.
+        '''
+        if table_name not in self._plans:
+            self._plans[table_name] = compile_rules(self.rules[table_name], self.parse_date_column, self.compact)
+        return self._plans[table_name]
+
     def clean_user_data(self, user_df):
         '''
         This function is used to clean the user dataframe and return the cleaned dataframe.
+        The input dataframe is not modified.
 
         Args:
             user_df (pandas.DataFrame): the input dataframe containing user data. 
@@ -17,33 +98,13 @@ class DatabaseCleaning:
         Returns:
             pandas.DataFrame: the cleaned DataFrame.
         '''
-        # Set index as index
-        user_df = user_df.set_index('index')
-
-        # Create mask and apply it to get rid of invalid rows and NULL/NaN
-        selected_countries = ["Germany", "United Kingdom", "United States"]
-        country_mask = user_df.loc[:,"country"].isin(selected_countries) # ,: means search all rows in just country
-        user_df_mask = user_df[country_mask]
-
-        ## convert most columns to string datatype
-        # create dictionary to map column name to dataype
-        col_data_types = {'first_name': 'string', 'last_name': 'string', 'company':'string', 'email_address':'string', 'address':'string', 'country':'string', 'country_code':'string','phone_number':'string','user_uuid':'string'}
-        # use a for loop to iterate through the columns and change the dtype
-        for column, data_type in col_data_types.items():
-            user_df_mask[column] = user_df_mask[column].astype(data_type)
-
-        ## convert date columns to datetime
-        user_df_mask['date_of_birth'] = user_df_mask['date_of_birth'].apply(parse)
-        user_df_mask['date_of_birth'] = user_df_mask['date_of_birth'].apply(pd.to_datetime, infer_datetime_format=True, errors='coerce')
-        user_df_mask['join_date'] = user_df_mask['join_date'].apply(parse)
-        user_df_mask['join_date'] = user_df_mask['join_date'].apply(pd.to_datetime, infer_datetime_format=True, errors='coerce') # .apply() applies a function, with arguments inside brackets
-        # this prevents the rows being turned into nulls and then deleted.
-    
-        return user_df_mask
+        # keep valid countries, cast to string, parse the date columns and use index as the index
+        return self.cleaning_plan('users').execute(user_df)
 
     def clean_card_data(self, card_df):
         '''
         This function is used to clean the card dataframe and return the cleaned dataframe.
+        The input dataframe is not modified.
 
         Args:
             card_df (pandas.DataFrame): the input dataframe containing card data. 
@@ -51,34 +112,13 @@ class DatabaseCleaning:
         Returns:
             pandas.DataFrame: the cleaned DataFrame.
         '''
-        # mask to filter card_provider to delete invalid data and null rows
-        card_provider_list = ["American Express","Diners Club / Carte Blanche", "Discover", "JCB 15 digit", "JCB 16 digit", "Maestro", "Mastercard", "VISA 13 digit", "VISA 16 digit", "VISA 19 digit"]
-        card_mask = card_df.loc[:,"card_provider"].isin(card_provider_list)
-        df_mask = card_df[card_mask]
-
-        # drop the '?' characters in invalid card_numbers
-        # to search specifically for character, convert to string
-        df_mask['card_number'] = df_mask['card_number'].astype('string')
-        replacements = [("?", "")]
-        for char, replacement in replacements:
-            df_mask["card_number"] = df_mask["card_number"].str.replace(char, replacement)
-        # convert into int64
-        df_mask['card_number'] = df_mask['card_number'].astype('int64')
-
-        # turn other cols into strings 
-        col_data_types = {'expiry_date':'string', 'card_provider':'string'}
-        for column, data_type in col_data_types.items():
-            df_mask[column] = df_mask[column].astype(data_type)
-        
-        # cast columns to datetime
-        df_mask['date_payment_confirmed'] = df_mask['date_payment_confirmed'].apply(parse)
-        df_mask['date_payment_confirmed'] = df_mask['date_payment_confirmed'].apply(pd.to_datetime, infer_datetime_format=True, errors='coerce') 
-
-        return df_mask
+        # keep valid card providers, drop the '?' characters in card_number and parse date_payment_confirmed
+        return self.cleaning_plan('card_details').execute(card_df)
 
     def clean_store_data(self, store_df):
         '''
         This function is used to clean the store dataframe and return the cleaned dataframe.
+        The input dataframe is not modified.
 
         Args:
             store_df (pandas.DataFrame): the input dataframe containing store data. 
@@ -86,68 +126,61 @@ class DatabaseCleaning:
         Returns:
             pandas.DataFrame: the cleaned DataFrame.
         '''
-        # drop empty lat column
-        store_info_df_no_lat = store_df.drop('lat', axis=1)
-
-        # create store_type mask for cleaning strange data and nulls 
-        store_type_list = ["Local", "Mall Kiosk", "Super Store", "Outlet", "Web Portal"]
-        store_type_mask = store_info_df_no_lat.loc[:,"store_type"].isin(store_type_list)
-        store_info_mask = store_info_df_no_lat[store_type_mask]
-    
-        # ValueError: could not convert string to float: 'N/A'
-        # drop N/A from longitude or latitude at index 0
-        store_info_mask_nona = store_info_mask.drop([0], axis=0) # had to re-enter this row in SQL
-
-        # convert columns to string and flaot64
-        col_data_types = {"latitude":"float64", "longitude":"float64", "address":"string", "locality":"string", "store_code":"string", "store_type":"string", "country_code":"string", "continent":"string"}
-        for column, data_type in col_data_types.items():
-            store_info_mask_nona[column] = store_info_mask_nona[column].astype(data_type)
+        # keep valid store types apart from the web portal at index 0, fix staff_numbers and drop the empty lat column
+        return self.cleaning_plan('store_details').execute(store_df)
 
-        # staff_number has values with "accidental" letters mixed in so can't convert to int64
-        store_info_mask_nona['staff_numbers'] = store_info_mask_nona['staff_numbers'].replace(["J78", "30e", "80R", "A97", "3n9"], ["78", "30", "80", "97", "39"])
-        # convert to int64
-        store_info_mask_nona['staff_numbers'] = store_info_mask_nona['staff_numbers'].astype("int64")
-        #print(store_info_mask_nona.info())
+    def parse_weight_column(self, weight_series, unit_to_kg=UNIT_TO_KG):
+        '''
+        This function converts a column of weight strings in mixed units to kg.
+        The weights repeat a lot, so each distinct string is parsed once, with a single regex giving its multipack count, quantity and unit,
+        and the kg values are then spread back to the rows with one lookup.
 
-        # change opening_date to datetime64
-        store_info_mask_nona['opening_date'] = store_info_mask_nona['opening_date'].apply(parse)
-        store_info_mask_nona['opening_date'] = store_info_mask_nona['opening_date'].apply(pd.to_datetime, infer_datetime_format=True, errors='coerce') 
+        Args:
+            weight_series (pandas.Series): the column of weight strings, e.g. '1.6kg', '12 x 100g' or '16oz'.
+            unit_to_kg (dict): kg per unit, keyed by lower case unit.
 
-        return store_info_mask_nona
+        Returns:
+            pandas.Series: the weights in kg, with NaN where a weight is missing or its unit is unknown.
+        '''
+        codes, unique_weights = pd.factorize(weight_series)
+        parts = pd.Series(unique_weights, dtype='string').str.extract(WEIGHT_PATTERN)
+        unique_kg = (pd.to_numeric(parts['quantity']) * pd.to_numeric(parts['count']).fillna(1)
+                     * parts['unit'].str.lower().map(unit_to_kg)).to_numpy(dtype=float, na_value=np.nan)
+        # factorize gives missing weights the code -1
+        weights_kg = np.append(unique_kg, np.nan)[codes]
 
+        return pd.Series(weights_kg, index=weight_series.index, name=weight_series.name)
 
-    def convert_product_weights(self, product_df):
+    def convert_product_weights(self, product_df, inplace=False):
         '''
         This function is used to convert the weights column from mixed units to solely kg units within the products dataframe and return the dataframe with converted column.
 
         Args:
             product_df (pandas.DataFrame): the input dataframe containing product data. 
+            inplace (bool): if True the weight column of product_df is replaced by weight_kg and product_df is returned,
+                otherwise product_df is left as it is and a new DataFrame is returned.
 
         Returns:
             pandas.DataFrame: the DataFrame with weight column converted to kg.
         '''
-        # create new columns, using regex to seperate weight and unit
-        product_df['numeric_value'] = pd.to_numeric(product_df['weight'].str.extract('(\d+.\d+|\d+)')[0], errors='coerce') # casts as a float 
-        product_df['unit'] = product_df['weight'].str.extract('([a-zA-Z]+)')
-        
-        # define dictionary for conversion
-        conversion_factors = {'ml': 0.001, 'g': 0.001, 'kg': 1, 'k': 1}
-        
-        product_df.loc[product_df['unit'] == 'ml', 'numeric_value'] *= conversion_factors['ml']
-        # for every row where ['unit'] equals ml, it multiplies the corresponding 'numeric_value' row by the value of the 'ml' key in the conversion_factors dictionary
-        product_df.loc[product_df['unit'] == 'g', 'numeric_value'] *= conversion_factors['g']
-        product_df.loc[product_df['unit'].isin(['kg', 'k']), 'numeric_value'] *= conversion_factors['kg']
+        # parse the count, quantity and unit of each weight and convert it to kg
+        weight_kg = self.parse_weight_column(product_df['weight'])
 
-        product_df['weight_kg'] = product_df['numeric_value']
+        if inplace:
+            product_df['weight_kg'] = weight_kg
+            product_df.drop(['weight'], axis=1, inplace=True)
+            return product_df
 
-        # drop unnecessary columns
-        product_df.drop(['weight', 'numeric_value', 'unit'], axis=1, inplace=True)
+        # drop unnecessary column
+        weight_kg_df = product_df.drop(['weight'], axis=1)
+        weight_kg_df['weight_kg'] = weight_kg
         
-        return product_df
+        return weight_kg_df
     
     def clean_products_data(self, product_df):
         '''
         This function is used to clean the product dataframe and return the cleaned dataframe.
+        The input dataframe is not modified.
 
         Args:
             product_df (pandas.DataFrame): the input dataframe containing product data. 
@@ -155,46 +188,58 @@ class DatabaseCleaning:
         Returns:
             pandas.DataFrame: the cleaned DataFrame.
         '''
-        # create mask to filter invalid data using removed column:
-        # first correct spelling mistake of 'avaliable'
-        product_df["removed"] = product_df["removed"].astype("string")
-        product_df["removed"] = product_df["removed"].str.replace('Still_avaliable', 'Still_available', regex=True)
-        # filter
-        availability_list = ["Still_available", "Removed"] 
-        availability_mask = product_df.loc[:,"removed"].isin(availability_list)
-        product_mask_df = product_df[availability_mask]
-
-        # remove £ from price column and convert to float64
-        # cast as string
-        product_mask_df["product_price"] = product_mask_df["product_price"].astype("string")
-        # create new col from it while removing the £ sign
-        product_mask_df["product_price_sterling"] = product_mask_df["product_price"].str.replace("£", "", regex=True)
-        # convert to float
-        product_mask_df["product_price_sterling"] = product_mask_df["product_price_sterling"].astype(float)
-        # delete 'product_price' column
-        product_mask_df = product_mask_df.drop(["product_price"], axis=1)
-
-        # cast columns to correct datatype apart from datetime
-        col_data_types = {'product_name':'string', 'category':'string', 'EAN':'string', 'uuid':'string', 'product_code':'string'}
-        for column, data_type in col_data_types.items():
-            product_mask_df[column] = product_mask_df[column].astype(data_type)
-
-        # make all product_code upper()
-        product_mask_df["product_code"] = product_mask_df["product_code"].str.upper()
-            
+        product_mask_df = self.clean_products_partition(product_df)
+
         # impute data for the weights which are 0kg, using mean
         #product_mask_df["weight_kg"].describe()
-        product_mask_df["weight_kg"] = product_mask_df["weight_kg"].fillna(product_mask_df["weight_kg"].mean())  # mean = 3.15
+        return self.impute_weights(product_mask_df, self.weight_totals(product_mask_df))  # mean = 3.15
 
-        # cast datetime
-        product_mask_df['date_added'] = product_mask_df['date_added'].apply(parse)
-        product_mask_df['date_added'] = product_mask_df['date_added'].apply(pd.to_datetime, infer_datetime_format=True, errors='coerce') 
-        
-        return product_mask_df
+    def clean_products_partition(self, product_df):
+        '''
+        This function runs the row by row part of clean_products_data, which can be run on any slice of the product rows.
+        The missing weights are left for impute_weights, as their mean depends on every row.
+
+        Args:
+            product_df (pandas.DataFrame): the input dataframe containing product data, with weight_kg from convert_product_weights.
+
+        Returns:
+            pandas.DataFrame: the cleaned DataFrame, with NaN where weight_kg is missing.
+        '''
+        # correct 'Still_avaliable', keep valid rows, upper case product_code and replace product_price with product_price_sterling
+        return self.cleaning_plan('products').execute(product_df)
+
+    def weight_totals(self, product_df):
+        '''
+        This function returns the sum and count of the known weights, the partial aggregate behind the mean used by impute_weights.
+        The totals of several slices of the rows are added together to give the totals of the whole table.
+
+        Args:
+            product_df (pandas.DataFrame): the cleaned product rows.
+
+        Returns:
+            tuple: the sum of weight_kg and the number of rows where it is known.
+        '''
+        return float(product_df["weight_kg"].sum()), int(product_df["weight_kg"].count())
+
+    def impute_weights(self, product_df, totals):
+        '''
+        This function fills the missing weights with the mean weight, in place.
+
+        Args:
+            product_df (pandas.DataFrame): the cleaned product rows.
+            totals (tuple): the sum and count of the known weights over the whole table, from weight_totals.
+
+        Returns:
+            pandas.DataFrame: product_df with no missing weights, unless no weight is known at all.
+        '''
+        weight_sum, weight_count = totals
+        product_df["weight_kg"] = product_df["weight_kg"].fillna(weight_sum / weight_count if weight_count else np.nan)
+        return product_df
 
     def clean_orders_data(self, orders_df):
         '''
         This function is used to clean the orders dataframe and return the cleaned dataframe.
+        The input dataframe is not modified.
 
         Args:
             orders_df (pandas.DataFrame): the input dataframe containing orders data. 
@@ -202,23 +247,14 @@ class DatabaseCleaning:
         Returns:
             pandas.DataFrame: the cleaned DataFrame.
         '''
-        # drop unnecessary columns 
-        df_dropped_cols = orders_df.drop(["first_name", "last_name", "1"], axis=1) 
-        
-        # make product_code upper case
-        df_dropped_cols["product_code"] = df_dropped_cols["product_code"].str.upper()
-        
-        # cast other columns to string
-        col_data_types = {"date_uuid":"string", "user_uuid":"string", "store_code":"string", "product_code":"string"}
-        for column, data_type in col_data_types.items():
-            df_dropped_cols[column] = df_dropped_cols[column].astype(data_type)
-        
-        return df_dropped_cols
+        # drop unnecessary columns, make product_code upper case and cast the other columns to string
+        return self.cleaning_plan('orders').execute(orders_df)
     
 
     def clean_date_data(self, date_df):
         '''
         This function is used to clean the date dataframe and return the cleaned dataframe.
+        The input dataframe is not modified.
 
         Args:
             date_df (pandas.DataFrame): the input dataframe containing date data. 
@@ -226,28 +262,31 @@ class DatabaseCleaning:
         Returns:
             pandas.DataFrame: the cleaned DataFrame.
         '''
-        # use mask to remove invalid data 
-        # use time_period as has fewest variables 
-        time_period_list = ["Evening", "Morning", "Late_Hours", "Midday"]
-        time_period_mask = date_df.loc[:,"time_period"].isin(time_period_list)
-        time_df_mask = date_df[time_period_mask]
+        # use time_period to remove invalid data as it has fewest variables, and cast month, year and day to int32
+        time_df_mask = self.cleaning_plan('date_times').execute(date_df)
 
-        # create new column as an amalgamation of month year day
-        time_df_mask['purchase_date'] = pd.to_datetime(time_df_mask["year"] + "-" + time_df_mask["month"]+ "-" + time_df_mask["day"])
+        # create new column as an amalgamation of month year day, assembled from the integer columns rather than strings
+        time_df_mask['purchase_date'] = pd.to_datetime(time_df_mask[['year', 'month', 'day']])
 
-        # cast timestamp and purchase_date as strings to combine
-        time_df_mask["timestamp"] = time_df_mask["timestamp"].astype("string")
-        time_df_mask["purchase_date"] = time_df_mask["purchase_date"].astype("string")
+        # add the timestamp as a new datetime column
+        time_df_mask["purchase_datetime"] = time_df_mask['purchase_date'] + pd.to_timedelta(time_df_mask["timestamp"])
+        
+        return time_df_mask
 
-        # combine and convert to datetime as a new column
-        time_df_mask["purchase_datetime"] = pd.to_datetime(time_df_mask["purchase_date"] + " " + time_df_mask["timestamp"])
+def clean_source_frame(cleaner, table_name, source_df):
+    '''
+    This function runs the DatabaseCleaning method that matches a raw source table.
 
-        # recast the date column as datetime
-        time_df_mask["purchase_date"] = pd.to_datetime(time_df_mask["purchase_date"])
+    Args:
+        cleaner (DatabaseCleaning): the cleaning instance, or a ParallelCleaner.
+        table_name (str): the name of the raw source table.
+        source_df (pandas.DataFrame): the raw DataFrame.
 
-        # cast the other columns as strings
-        col_data_types = {"month": "int32", "year":"int32", "day":"int32", "time_period": "string", "date_uuid": "string"}
-        for column, data_type in col_data_types.items():
-            time_df_mask[column] = time_df_mask[column].astype(data_type)
-        
-        return time_df_mask 
+    Returns:
+        pandas.DataFrame: the cleaned DataFrame.
+    '''
+    if table_name == 'products':
+        return cleaner.clean_products_data(cleaner.convert_product_weights(source_df))
+    clean_methods = {'legacy_users': cleaner.clean_user_data, 'card_details': cleaner.clean_card_data, 'store_details': cleaner.clean_store_data,
+                     'orders_table': cleaner.clean_orders_data, 'date_times': cleaner.clean_date_data}
+    return clean_methods[table_name](source_df)
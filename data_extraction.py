@@ -1,16 +1,94 @@
 import boto3
-from io import StringIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+import gzip
+import io
+import os
+import tempfile
+import time
 import pandas as pd
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import column, func, select, table, text
 import tabula
 from database_utils import DatabaseConnector
+from tracing import current_span
+
+def _read_pdf_pages(pdf_path, page_numbers):
+    '''
+    This function parses a range of pages of a local PDF with tabula, one page at a time so each table keeps its page number.
+    It runs in a worker process, and tabula's in-process JVM is started once per worker and reused for every page it parses.
+
+    Args:
+        pdf_path (str): Path to the local PDF file.
+        page_numbers (list): The page numbers to parse.
+
+    Returns:
+        tuple: A list of (page number, DataFrame) pairs and the seconds taken to parse the range.
+    '''
+    start_time = time.perf_counter()
+    page_tables = []
+    for page_number in page_numbers:
+        for page_df in tabula.read_pdf(pdf_path, pages=page_number):
+            page_tables.append((page_number, page_df))
+
+    return page_tables, time.perf_counter() - start_time
 
 class DataExtractor:
     '''
     This class can be used to extract data from different data sources.
     ''' 
 
-    def read_rds_table(self, instance_of_DbCon_class, table_name, engine):
+    def __init__(self, cache=None, api_cache_ttl=24 * 60 * 60, s3_client=None):
+        '''
+        This function sets up the extractor with an optional local cache of raw extractions.
+
+        Args:
+            cache (ExtractionCache): If given, the PDF, S3 and store API extractions are saved to and reused from this cache.
+            api_cache_ttl (float): The number of seconds cached store API data is reused for, as the API sends no ETag.
+            s3_client (botocore.client.S3): The S3 client to use, e.g. one pointed at a local S3 stand-in. A default boto3 client is created if not given.
+        '''
+        self.cache = cache
+        self.api_cache_ttl = api_cache_ttl
+        self.s3_client = s3_client
+
+    def _cached_extract(self, source, validator, extract_function, ttl=None):
+        '''
+        This function returns the cached DataFrame for a source if it is still valid, otherwise it runs the extraction and caches the result.
+
+        Args:
+            source (str): The URL the data comes from, used as the cache key.
+            validator (str): The source's current ETag/Last-Modified, or None.
+            extract_function (callable): The function that extracts the DataFrame from the source.
+            ttl (float): Overrides the cache's default TTL for this source.
+
+        Returns:
+            pandas.DataFrame: The extracted DataFrame.
+        '''
+        if self.cache is None:
+            return extract_function()
+        cached_df = self.cache.get(source, validator, ttl)
+        if cached_df is not None:
+            return cached_df
+        extracted_df = extract_function()
+        self.cache.put(source, extracted_df, validator)
+        return extracted_df
+
+    def _http_validator(self, url):
+        '''
+        This function asks a web server for the ETag or Last-Modified header of a file without downloading it.
+
+        Args:
+            url (str): The URL of the file.
+
+        Returns:
+            str: The ETag or Last-Modified value, or None if the server sends neither.
+        '''
+        response = requests.head(url, allow_redirects=True, timeout=30)
+        return response.headers.get('ETag') or response.headers.get('Last-Modified')
+
+    def read_rds_table(self, instance_of_DbCon_class, table_name, engine, chunksize=None, since=None):
         '''
         This function reads a table from an RDS database using the provided SQLAlchemy engine instance.
 
@@ -18,37 +96,166 @@ class DataExtractor:
             instance_of_DbCon_class (DatabaseConnector): An instance of the DatabaseConnector class.
             table_name (str): The name of the table to be read from the database.
             engine (sqlalchemy.engine.base.Engine): The SQLAlchemy engine connected to the RDS database.
+            chunksize (int): If given, return an iterator of DataFrames with this many rows each instead of the whole table.
+            since (tuple): Optional (column, value) pair, only rows where the column is greater than the value are read, in column order.
             
         Returns:
-            pandas.DataFrame: A DataFrame containing the data from the specified table.
+            pandas.DataFrame: A DataFrame containing the data from the specified table, or an iterator of DataFrame chunks.
+        '''
+        if chunksize:
+            return self.stream_rds_table(table_name, engine, chunksize, since)
+        if since:
+            return pd.read_sql_query(self._rows_since_query(table_name, *since), con=engine)
+        table_df = pd.read_sql_table(table_name=table_name, con=engine)
+        return table_df
+
+    def stream_rds_table(self, table_name, engine, chunksize=100000, since=None):
         '''
-        if table_name == "legacy_users":
-            df_legacy_users = pd.read_sql_table(table_name="legacy_users", con=engine) 
-            return df_legacy_users
-        elif table_name == "orders_table":
-            orders_df = pd.read_sql_table(table_name="orders_table", con=engine)
-            return orders_df
-        elif table_name == "legacy_store_details":
-            legacy_stores_df = pd.read_sql_table(table_name="legacy_store_details", con=engine)
-            return legacy_stores_df
+        This function reads a table from an RDS database in chunks through a server-side cursor, so only one chunk is held in memory at a time.
+
+        Args:
+            table_name (str): The name of the table to be read from the database.
+            engine (sqlalchemy.engine.base.Engine): The SQLAlchemy engine connected to the RDS database.
+            chunksize (int): The number of rows in each chunk.
+            since (tuple): Optional (column, value) pair, only rows where the column is greater than the value are read, in column order.
 
-    def retrieve_pdf_data(self, link):
+        Yields:
+            pandas.DataFrame: The next chunk of rows from the table.
+        '''
+        # stream_results makes psycopg2 use a named (server-side) cursor instead of fetching every row up front
+        with engine.connect().execution_options(stream_results=True) as connection:
+            if since:
+                table_chunks = pd.read_sql_query(self._rows_since_query(table_name, *since), con=connection, chunksize=chunksize)
+            else:
+                table_chunks = pd.read_sql_table(table_name=table_name, con=connection, chunksize=chunksize)
+            for table_chunk in table_chunks:
+                yield table_chunk
+
+    def rds_table_version(self, table_name, engine, watermark_column='index'):
+        '''
+        This function returns the version of an RDS table without reading it, its row count and the largest value of its increasing row number.
+        Rows are only ever added to the RDS tables, so the version changes whenever new rows arrive.
+
+        Args:
+            table_name (str): The name of the table in the RDS database.
+            engine (sqlalchemy.engine.base.Engine): The SQLAlchemy engine connected to the RDS database.
+            watermark_column (str): The table's increasing row number.
+
+        Returns:
+            str: The row count and the largest row number.
+        '''
+        query = select(func.count(), func.max(column(watermark_column))).select_from(table(table_name))
+        with engine.connect() as connection:
+            row_count, last_row = connection.execute(query).one()
+        return f"{row_count}|{last_row}"
+
+    def _rows_since_query(self, table_name, watermark_column, watermark_value):
+        '''
+        This function builds a query for the rows of a table past a watermark, ordered by the watermark column so each chunk moves the watermark forward.
+        '''
+        query = select(text('*')).select_from(table(table_name)).order_by(column(watermark_column))
+        if watermark_value is not None:
+            query = query.where(column(watermark_column) > watermark_value)
+        return query
+
+    def retrieve_pdf_data(self, link, max_workers=None):
         '''
         This function retrieves data from a PDF located at the provided link.
+        The PDF is downloaded once to a temporary file, split into page ranges and the ranges are parsed in parallel worker processes.
+        The page each row came from is kept as the first level of the returned DataFrame's index.
 
         Args:
-            link (str): The link to the PDF.
+            link (str): The link to the PDF, or a path to a local PDF file.
+            max_workers (int): The number of worker processes, defaults to the number of CPUs.
             
         Returns:
-            pandas.DataFrame: A DataFrame containing the data extracted from the PDF.
+            pandas.DataFrame: A DataFrame containing the data extracted from the PDF, indexed by (pdf_page, row).
         '''
         # use tabula to reads remote pdf into list of DataFrame using tabula
         self.link = link
-        pdf_dataframe_list = tabula.read_pdf(self.link, pages='all') 
-        pdf_dataframe = pd.concat(pdf_dataframe_list, ignore_index=True) # convert list into dataframe
+        is_remote = link.startswith(('http://', 'https://'))
+
+        def read_pdf():
+            if not is_remote:
+                return self._read_pdf_parallel(link, max_workers)
+            with tempfile.TemporaryDirectory() as download_dir:
+                pdf_path = os.path.join(download_dir, 'download.pdf')
+                with requests.get(link, stream=True, timeout=60) as response:
+                    response.raise_for_status()
+                    with open(pdf_path, 'wb') as pdf_file:
+                        for block in response.iter_content(chunk_size=1024 * 1024):
+                            pdf_file.write(block)
+                return self._read_pdf_parallel(pdf_path, max_workers)
+
+        # with a cache, the PDF is only parsed again when the server reports a new ETag/Last-Modified
+        validator = self._http_validator(link) if self.cache is not None and is_remote else None
+        pdf_dataframe = self._cached_extract(link, validator, read_pdf)
         
         return pdf_dataframe
 
+    def _read_pdf_parallel(self, pdf_path, max_workers=None):
+        '''
+        This function parses a local PDF in page ranges on a process pool and concatenates the tables in page order.
+        The time taken for each range is recorded on the current span as pdf_range_seconds.
+        '''
+        max_workers = max_workers or os.cpu_count() or 1
+        page_count = self._count_pdf_pages(pdf_path)
+        if page_count == 0:
+            return self._concat_page_tables([])
+
+        # one contiguous range of pages per worker
+        pages = list(range(1, page_count + 1))
+        range_size = -(-page_count // max_workers)
+        page_ranges = [pages[start:start + range_size] for start in range(0, page_count, range_size)]
+
+        with ProcessPoolExecutor(max_workers=len(page_ranges)) as executor:
+            range_results = list(executor.map(_read_pdf_pages, [pdf_path] * len(page_ranges), page_ranges))
+
+        page_tables = []
+        range_seconds = {}
+        for page_range, (range_tables, elapsed_time) in zip(page_ranges, range_results):
+            range_seconds[f"{page_range[0]}-{page_range[-1]}"] = round(elapsed_time, 3)
+            page_tables.extend(range_tables)
+        current_span().set_attribute('pdf_range_seconds', range_seconds)
+
+        return self._concat_page_tables(page_tables)
+
+    def _concat_page_tables(self, page_tables):
+        '''
+        This function concatenates (page number, DataFrame) pairs into one DataFrame indexed by (pdf_page, row).
+        '''
+        if not page_tables:
+            return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['pdf_page', 'row']))
+        # convert list into dataframe, keeping the page number of each row in the index
+        pdf_dataframe = pd.concat([page_df.reset_index(drop=True) for _, page_df in page_tables], keys=[page_number for page_number, _ in page_tables])
+        pdf_dataframe.index.names = ['pdf_page', 'row']
+
+        return pdf_dataframe
+
+    def pdf_version(self, link):
+        '''
+        This function returns the version of a PDF without downloading it, the server's ETag or Last-Modified, or the size and modification time of a local file.
+
+        Args:
+            link (str): The link to the PDF, or a path to a local PDF file.
+
+        Returns:
+            str: The PDF's version, or None if the server sends neither header.
+        '''
+        if link.startswith(('http://', 'https://')):
+            return self._http_validator(link)
+        file_stat = os.stat(link)
+        return f"{file_stat.st_size}|{file_stat.st_mtime_ns}"
+
+    def _count_pdf_pages(self, pdf_path):
+        '''
+        This function returns the number of pages in a local PDF, read from its page tree, which is found whether or not its objects are compressed.
+        '''
+        # pypdf is only needed to split a PDF into page ranges, so it is not imported by runs that do not parse one
+        from pypdf import PdfReader
+
+        return len(PdfReader(pdf_path).pages)
+
     def list_number_of_stores(self, num_stores_endpoint_url, header):
         '''
         This function retrieves the number of stores from an API endpoint.
@@ -65,58 +272,222 @@ class DataExtractor:
         
         return number_of_stores 
     
-    def retrieve_stores_data(self, store_endpoint_template, number_of_stores, header):
+    def retrieve_stores_data(self, store_endpoint_template, number_of_stores, header, max_workers=8, retries=3, backoff=0.5, timeout=30):
         '''
         This function retrieves data for all stores from an API and saves them in a DataFrame.
+        All requests share one keep-alive session, and with max_workers above 1 they are sent from a bounded thread pool.
 
         Args:
             store_endpoint_template (str): The template URL for retrieving store data.
             number_of_stores (int): The total number of stores.
             header (dict): The header containing necessary authentication details.
+            max_workers (int): The number of requests to have in flight at once.
+            retries (int): How many times to retry a store after a connection error or a 429/5xx response.
+            backoff (float): The delay in seconds before the first retry, doubled on each further retry.
+            timeout (float): The timeout in seconds for each request.
             
         Returns:
-            pandas.DataFrame: A DataFrame containing the data for all stores.
-        '''
-        stores_list = []
-        store_num = 1
-      
-        for store_num in range(0, number_of_stores):
-            full_endpoint = store_endpoint_template + str(store_num)
-            response = requests.get(full_endpoint, headers=header)
-            store_data = response.json()
-            stores_list.append(store_data)
-            store_num += 1
+            pandas.DataFrame: A DataFrame containing the data for all stores, in store number order.
+        '''
+        store_endpoints = [store_endpoint_template + str(store_num) for store_num in range(0, number_of_stores)]
+        # the API sends no ETag, so cached store data is reused until api_cache_ttl runs out
+        cache_source = self._stores_cache_source(store_endpoint_template, number_of_stores)
+        return self._cached_extract(cache_source, None, lambda: self._fetch_stores(store_endpoints, header, max_workers, retries, backoff, timeout), ttl=self.api_cache_ttl)
+
+    def _stores_cache_source(self, store_endpoint_template, number_of_stores):
+        '''
+        This function returns the key the store API data is cached under, which changes with the number of stores.
+        '''
+        return f"{store_endpoint_template}[0-{number_of_stores - 1}]"
+
+    def stores_version(self, store_endpoint_template, number_of_stores):
+        '''
+        This function returns the version of the store API data. The API sends no ETag, so the data only has a version while it is cached,
+        the number of stores and when they were cached, and retrieve_stores_data will give back the same data until api_cache_ttl runs out.
+
+        Args:
+            store_endpoint_template (str): The template URL for retrieving store data.
+            number_of_stores (int): The total number of stores.
+
+        Returns:
+            str: The number of stores and when they were cached, or None if they are not cached and would be requested again.
+        '''
+        if self.cache is None:
+            return None
+        saved_at = self.cache.saved_at(self._stores_cache_source(store_endpoint_template, number_of_stores), ttl=self.api_cache_ttl)
+        return None if saved_at is None else f"{number_of_stores}|{saved_at}"
+
+    def _fetch_stores(self, store_endpoints, header, max_workers, retries, backoff, timeout):
+        '''
+        This function sends the store details requests and collects the responses into a DataFrame in endpoint order.
+        '''
+        with requests.Session() as session:
+            session.headers.update(header)
+            # keep one pooled connection per worker so every request reuses an open connection
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(max_workers, 1))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            def fetch_store(full_endpoint):
+                return self._get_json_with_retry(session, full_endpoint, retries, backoff, timeout)
+
+            if max_workers > 1:
+                # executor.map returns results in the order of store_endpoints
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    stores_list = list(executor.map(fetch_store, store_endpoints))
+            else:
+                stores_list = [fetch_store(full_endpoint) for full_endpoint in store_endpoints]
 
         stores_df = pd.DataFrame(stores_list)
     
         return stores_df
 
-    def extract_from_s3(self, s3_address):
+    def _get_json_with_retry(self, session, url, retries, backoff, timeout):
+        '''
+        This function sends a GET request through the given session and returns the decoded JSON, retrying with exponential backoff on transient failures.
+
+        Args:
+            session (requests.Session): The session used to send the request.
+            url (str): The URL to request.
+            retries (int): The number of retries allowed.
+            backoff (float): The delay in seconds before the first retry.
+            timeout (float): The timeout in seconds for the request.
+
+        Returns:
+            dict: The JSON body of the response.
+
+        Raises:
+            requests.HTTPError: If the response is an error other than 429/5xx, or still one after the last retry.
+        '''
+        for attempt in range(retries + 1):
+            try:
+                response = session.get(url, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+            else:
+                # rate limiting and server errors are worth another try
+                if response.status_code == 429 or response.status_code >= 500:
+                    if attempt == retries:
+                        response.raise_for_status()
+                else:
+                    # any other error, e.g. a bad API key or a missing store, is raised rather than put in the stores frame
+                    response.raise_for_status()
+                    return response.json()
+            time.sleep(backoff * 2 ** attempt)
+
+    def extract_from_s3(self, s3_address, chunksize=None, multipart_threshold=64 * 1024 ** 2, part_size=16 * 1024 ** 2, max_workers=8):
         '''
         This function extracts data from an S3 bucket based on the provided address.
+        CSV and JSON objects are parsed straight from the S3 response stream, gzip objects (.csv.gz, .json.gz) are decompressed as they are read,
+        and objects larger than multipart_threshold, or Parquet files, which need a seekable file, are downloaded as byte ranges in parallel to a temporary file first.
 
         Args:
             s3_address (str): The S3 address specifying the bucket and object key.
+            chunksize (int): If given, return an iterator of DataFrames with this many rows each. Supported for CSV, JSON lines (.jsonl) and Parquet.
+            multipart_threshold (int): The object size in bytes from which the ranged parallel download is used.
+            part_size (int): The size in bytes of each ranged request.
+            max_workers (int): The number of ranged requests sent at once.
             
         Returns:
-            pandas.DataFrame: A DataFrame containing the data extracted from the S3 bucket.
+            pandas.DataFrame: A DataFrame containing the data extracted from the S3 bucket, or an iterator of DataFrame chunks.
         '''
         # check logged into aws cli 'aws configure list'
-        s3 = boto3.client('s3')
+        s3 = self.s3_client if self.s3_client is not None else boto3.client('s3')
         # split address into bucket name and object key
         bucket_name, object_key = s3_address.replace("s3://", "").split("/", 1)
 
-        # check file type based on extension
-        _, file_extension = object_key.rsplit('.', 1) # underscore is throwaway variable
-        
-        # Download the CSV file from S3
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        content = response['Body'].read().decode('utf-8')
-        
-        # Convert CSV content to DataFrame based on filetype
-        if file_extension.lower() == 'json':
-            df = pd.read_json(content)
-        elif file_extension.lower() == 'csv':
-            df = pd.read_csv(StringIO(content))
+        # check file type based on extension, looking past a .gz suffix
+        key_parts = object_key.lower().split('.')
+        compression = 'gzip' if key_parts[-1] == 'gz' else None
+        file_extension = key_parts[-2] if compression else key_parts[-1]
+        if file_extension not in ('csv', 'json', 'jsonl', 'parquet'):
+            raise ValueError(f"Unsupported file type for {s3_address}")
+        if chunksize and file_extension == 'json':
+            raise ValueError("Chunked reading of JSON needs a JSON lines (.jsonl) object")
+
+        object_head = s3.head_object(Bucket=bucket_name, Key=object_key)
+        download = (s3, bucket_name, object_key, object_head, multipart_threshold, part_size, max_workers)
+
+        if chunksize:
+            return self._read_s3_chunks(download, file_extension, compression, chunksize)
+
+        def read_object():
+            with self._open_s3_object(*download, seekable=file_extension == 'parquet') as body:
+                # Convert content to DataFrame based on filetype
+                if file_extension == 'parquet':
+                    df = pd.read_parquet(body)
+                elif file_extension in ('json', 'jsonl'):
+                    df = pd.read_json(body, lines=file_extension == 'jsonl', compression=compression)
+                elif file_extension == 'csv':
+                    df = pd.read_csv(body, compression=compression)
+            return df
+
+        # with a cache, the object is only downloaded again when its ETag or LastModified changes
+        validator = self._s3_validator(object_head)
+        df = self._cached_extract(s3_address, validator, read_object)
+
+        return df
+
+    def _s3_validator(self, object_head):
+        '''
+        This function turns the head of an S3 object into the validator its cache entry is saved with.
+        '''
+        return f"{object_head['ETag']}|{object_head['LastModified'].isoformat()}"
+
+    def s3_version(self, s3_address):
+        '''
+        This function returns the version of an S3 object, its ETag and LastModified, without downloading it.
+
+        Args:
+            s3_address (str): The S3 address specifying the bucket and object key.
+
+        Returns:
+            str: The object's ETag and LastModified.
+        '''
+        s3 = self.s3_client if self.s3_client is not None else boto3.client('s3')
+        bucket_name, object_key = s3_address.replace("s3://", "").split("/", 1)
+        return self._s3_validator(s3.head_object(Bucket=bucket_name, Key=object_key))
+
+    def _read_s3_chunks(self, download, file_extension, compression, chunksize):
+        '''
+        This function yields an S3 object as DataFrame chunks, holding only one chunk in memory at a time.
+        '''
+        with self._open_s3_object(*download, seekable=file_extension == 'parquet') as body:
+            if file_extension == 'parquet':
+                for record_batch in pq.ParquetFile(body).iter_batches(batch_size=chunksize):
+                    yield record_batch.to_pandas()
+            elif file_extension == 'jsonl':
+                # the chunked JSON reader needs text lines, so decode the byte stream as it is read
+                byte_stream = gzip.GzipFile(fileobj=body) if compression else body
+                yield from pd.read_json(io.TextIOWrapper(byte_stream, encoding='utf-8'), lines=True, chunksize=chunksize)
+            else:
+                yield from pd.read_csv(body, chunksize=chunksize, compression=compression)
+
+    @contextmanager
+    def _open_s3_object(self, s3, bucket_name, object_key, object_head, multipart_threshold, part_size, max_workers, seekable=False):
+        '''
+        This function opens an S3 object as a readable file, either the streaming response body or a temporary file filled by parallel ranged requests.
+        '''
+        object_size = object_head['ContentLength']
+        if object_size < multipart_threshold and not seekable:
+            body = s3.get_object(Bucket=bucket_name, Key=object_key, IfMatch=object_head['ETag'])['Body']
+            try:
+                yield body
+            finally:
+                body.close()
+            return
+
+        with tempfile.TemporaryFile() as temporary_file:
+            file_descriptor = temporary_file.fileno()
+
+            def download_part(start_byte):
+                end_byte = min(start_byte + part_size, object_size) - 1
+                # IfMatch makes every part fail if the object is replaced part way through the download
+                part = s3.get_object(Bucket=bucket_name, Key=object_key, Range=f"bytes={start_byte}-{end_byte}", IfMatch=object_head['ETag'])
+                os.pwrite(file_descriptor, part['Body'].read(), start_byte)
 
-        return df
\ No newline at end of file
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(download_part, range(0, object_size, part_size)))
+            temporary_file.seek(0)
+            yield temporary_file
@@ -1,12 +1,46 @@
-from sqlalchemy import create_engine, text, inspect
+from io import StringIO
+import logging
+import threading
+import time
+from sqlalchemy import create_engine, event, text, inspect
+from sqlalchemy.engine import make_url
 import yaml
 
+logger = logging.getLogger(__name__)
+
+# table in the sales_data database which records the high-water mark of each incrementally loaded source table
+WATERMARK_TABLE = 'etl_watermarks'
+
 class DatabaseConnector:
     '''
     This class can be used to connect to and upload to the sales_data database. 
+    Engines are created once per credentials file and reused, call dispose() or use the class as a context manager to close them.
 
     ''' 
 
+    def __init__(self, pool_size=5, max_overflow=10, pool_pre_ping=True):
+        '''
+        This function sets the connection pool options used for every engine the class creates.
+
+        Args:
+            pool_size (int): The number of connections each engine keeps open in its pool.
+            max_overflow (int): The number of extra connections an engine may open when the pool is exhausted.
+            pool_pre_ping (bool): Whether to test pooled connections before use, replacing any that have dropped.
+        '''
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_pre_ping = pool_pre_ping
+        # engines keyed by credentials file, and how many DBAPI connections each one has opened
+        self._engines = {}
+        self._engines_lock = threading.Lock()
+        self.connection_counts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.dispose()
+
     def read_db_creds(self, file):
         '''
         This function reads the contents of a YAML file and returns a dictionary.
@@ -27,6 +61,7 @@ class DatabaseConnector:
     def init_db_engine(self, file):
         '''
         This function uses the yaml credentials dictionary to initialise and return a SQAlchemy database engine.
+        The engine is cached, so later calls with the same file reuse it and its connection pool.
 
         Args:
             file (str): Path to the YAML file containing the database credentials.
@@ -34,14 +69,42 @@ class DatabaseConnector:
         Returns:
             sqlalchemy.engine.base.Engine: A SQLAlchemy engine connected to the specified database.
         '''
-        # Read database credentials from the specified YAML file
-        dict_yaml_func = self.read_db_creds(file)
+        with self._engines_lock:
+            if file in self._engines:
+                return self._engines[file]
+
+            # Read database credentials from the specified YAML file
+            dict_yaml_func = self.read_db_creds(file)
+
+            # Build the URL from the database credentials, a full URL (e.g. for a local SQLite file) takes priority
+            if 'URL' in dict_yaml_func:
+                db_url = make_url(dict_yaml_func['URL'])
+            else:
+                db_url = make_url(f"postgresql+psycopg2://{dict_yaml_func['USER']}:{dict_yaml_func['PASSWORD']}@{dict_yaml_func['HOST']}:{dict_yaml_func['PORT']}/{dict_yaml_func['DATABASE']}")
+
+            # SQLite uses its own pool classes which do not take the queue pool settings
+            pool_kwargs = {'pool_pre_ping': self.pool_pre_ping}
+            if db_url.get_backend_name() != 'sqlite':
+                pool_kwargs.update(pool_size=self.pool_size, max_overflow=self.max_overflow)
+            engine = create_engine(db_url, **pool_kwargs)
 
-        # Create a SQLAlchemy engine using the database credentials
-        engine = create_engine(f"postgresql+psycopg2://{dict_yaml_func['USER']}:{dict_yaml_func['PASSWORD']}@{dict_yaml_func['HOST']}:{dict_yaml_func['PORT']}/{dict_yaml_func['DATABASE']}")
-        # Connect to the database using the engine
-        engine.connect()
-        return engine
+            # count every new DBAPI connection so connection reuse can be checked
+            self.connection_counts[file] = 0
+            @event.listens_for(engine, 'connect')
+            def count_connection(dbapi_connection, connection_record):
+                self.connection_counts[file] += 1
+
+            self._engines[file] = engine
+            return engine
+
+    def dispose(self):
+        '''
+        This function closes the connection pools of every cached engine and empties the cache.
+        '''
+        with self._engines_lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
 
     def list_db_tables(self, file):
         '''
@@ -54,11 +117,7 @@ class DatabaseConnector:
             list: A list of table names in the 'public' schema.
         '''
         # Create the database engine
-        engine = self.init_db_engine(file) 
-        # Inspect the structure of the database
-        inspector = inspect(engine)
-        # Get a list of table names in the 'public' schema
-        table_names = inspector.get_table_names() 
+        engine = self.init_db_engine(file)
 
         # Connect to the database and use an SQL query to retrieve table names
         with engine.connect() as connection:
@@ -70,17 +129,282 @@ class DatabaseConnector:
         
         return unpacked_tuples_list
     
-    def upload_to_db(self, input_df, table_name, file):
+    def upload_to_db(self, input_df, table_name, file, if_exists='replace'):
         '''
         This function uploads a Pandas DataFrame to the specified table in the connected PostgreSQL database. 
+        PostgreSQL tables are bulk loaded with COPY, any other database falls back to pandas' INSERT path.
 
         Args:
             input_df (pandas.DataFrame): The DataFrame to be uploaded to the database.
             table_name (str): The name of the table to which the DataFrame should be uploaded.
             file (str): Path to the YAML file containing the database credentials.
-        
+            if_exists (str): 'replace' to recreate the table, 'append' to add rows to it, e.g. for later chunks of a streamed table,
+                or 'truncate' to empty a table created with its final types and load into it, which creates the table if it does not exist.
+
+        Returns:
+            float: The number of rows uploaded per second.
         '''  
         eng_con = self.init_db_engine(file)
-        # creates table
-        input_df.to_sql(table_name, eng_con, if_exists='replace', index=False)  
+        start_time = time.perf_counter()
+
+        if eng_con.dialect.name == 'postgresql':
+            self.copy_to_db(input_df, table_name, eng_con, if_exists)
+        else:
+            with eng_con.begin() as connection:
+                if_exists = self._truncate_table(connection, table_name) if if_exists == 'truncate' else if_exists
+                # creates table
+                input_df.to_sql(table_name, connection, if_exists=if_exists, index=False)  
+
+        elapsed_time = time.perf_counter() - start_time
+        rows_per_sec = len(input_df) / elapsed_time if elapsed_time else float('inf')
+        logger.info("Uploaded %d rows to %s in %.2fs (%.0f rows/sec)", len(input_df), table_name, elapsed_time, rows_per_sec)
+
+        return rows_per_sec
+
+    def copy_to_db(self, input_df, table_name, engine, if_exists='replace', batch_rows=100000):
+        '''
+        This function bulk loads a Pandas DataFrame into a PostgreSQL table with COPY FROM STDIN inside a single transaction.
+        The table is created from the DataFrame's dtypes first, then the rows are streamed in as CSV one batch at a time.
+
+        Args:
+            input_df (pandas.DataFrame): The DataFrame to be uploaded to the database.
+            table_name (str): The name of the table to which the DataFrame should be uploaded.
+            engine (sqlalchemy.engine.base.Engine): A SQLAlchemy engine connected to a PostgreSQL database.
+            if_exists (str): 'replace' to recreate the table, 'append' to add rows to it or 'truncate' to empty it and keep its column types.
+            batch_rows (int): The number of rows converted to CSV and sent per COPY.
+        '''
+        # engine.begin() commits once at the end, or rolls back everything if any batch fails
+        with engine.begin() as connection:
+            self._copy_frame(input_df, table_name, connection, if_exists, batch_rows)
+
+    def _copy_frame(self, input_df, table_name, connection, if_exists='replace', batch_rows=100000):
+        '''
+        This function creates the table on the given connection and streams the DataFrame into it with COPY, without committing.
+        '''
+        # imported here so the SQLite fallback works without psycopg2 installed
+        from psycopg2 import sql
+
+        copy_statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(table_name),
+            sql.SQL(', ').join(sql.Identifier(str(column)) for column in input_df.columns))
+
+        if if_exists == 'truncate':
+            if_exists = self._truncate_table(connection, table_name)
+        # an empty frame creates the table with the column types pandas maps from the dtypes, an existing table being appended to keeps its own
+        input_df.head(0).to_sql(table_name, connection, if_exists=if_exists, index=False)
+        cursor = connection.connection.cursor()
+        try:
+            for start_row in range(0, len(input_df), batch_rows):
+                csv_buffer = StringIO()
+                input_df.iloc[start_row:start_row + batch_rows].to_csv(csv_buffer, index=False, header=False)
+                csv_buffer.seek(0)
+                cursor.copy_expert(copy_statement, csv_buffer)
+        finally:
+            cursor.close()
+
+    def _truncate_table(self, connection, table_name):
+        '''
+        This function empties a table on the given connection, keeping its column types.
+        A table other tables' foreign keys point at is not emptied, as that would orphan their rows, so the tables have to be created again first.
+
+        Returns:
+            str: 'append' if the table was emptied, or 'replace' if it does not exist and has to be created.
+        '''
+        inspector = inspect(connection)
+        if not inspector.has_table(table_name):
+            return 'replace'
+        referencing_keys = [f"{referencing_table}.{foreign_key['name'] or foreign_key['constrained_columns'][0]}"
+                            for (_, referencing_table), foreign_keys in inspector.get_multi_foreign_keys().items()
+                            for foreign_key in foreign_keys if foreign_key['referred_table'] == table_name and referencing_table != table_name]
+        if referencing_keys:
+            raise ValueError(f"{table_name} cannot be emptied for a full load while the foreign keys {', '.join(sorted(referencing_keys))} reference it, "
+                             "run the create_tables stage first to create the tables again without keys, or load with --incremental")
+        quote = connection.dialect.identifier_preparer.quote
+        # SQLite has no TRUNCATE
+        statement = "TRUNCATE TABLE {}" if connection.dialect.name == 'postgresql' else "DELETE FROM {}"
+        connection.execute(text(statement.format(quote(table_name))))
+        return 'append'
+
+    def upsert_to_db(self, input_df, table_name, file, conflict_columns=None, watermark=None):
+        '''
+        This function adds new and changed rows to an existing table without dropping it, so the schema, keys and constraints stay in place.
+        The rows are staged in a scratch table and moved across with INSERT ... ON CONFLICT on the given key, cast to the destination column types.
+        Only columns that exist in the destination table are written. If the table does not exist yet it is created with upload_to_db.
+
+        Args:
+            input_df (pandas.DataFrame): The cleaned rows to add.
+            table_name (str): The name of the destination table.
+            file (str): Path to the YAML file containing the database credentials.
+            conflict_columns (list): The primary key columns used to update rows that already exist, or None to only insert.
+            watermark (tuple): Optional (source table, column, value) recorded in the watermark table in the same transaction.
+
+        Returns:
+            int: The number of rows written.
+        '''
+        engine = self.init_db_engine(file)
+        if not inspect(engine).has_table(table_name):
+            self.upload_to_db(input_df, table_name, file)
+            if watermark:
+                with engine.begin() as connection:
+                    self._write_watermark(connection, *watermark)
+            return len(input_df)
+
+        quote = engine.dialect.identifier_preparer.quote
+        staging_table = f"{table_name}_staging"
+
+        with engine.begin() as connection:
+            destination_types = self._column_types(connection, table_name)
+            columns = [column for column in input_df.columns if column in destination_types]
+            staged_df = input_df[columns]
+            # ON CONFLICT cannot update the same row twice in one statement, so keep the last copy of each key
+            if conflict_columns:
+                staged_df = staged_df.drop_duplicates(subset=conflict_columns, keep='last')
+
+            if engine.dialect.name == 'postgresql':
+                self._copy_frame(staged_df, staging_table, connection, if_exists='replace')
+                # staged columns have pandas' default types, so cast each one to the type the schema gave the destination
+                select_list = ', '.join(f"CAST({quote(column)} AS {destination_types[column]})" for column in columns)
+            else:
+                staged_df.to_sql(staging_table, connection, if_exists='replace', index=False)
+                select_list = ', '.join(quote(column) for column in columns)
+
+            column_list = ', '.join(quote(column) for column in columns)
+            # WHERE true stops SQLite reading ON CONFLICT as part of the SELECT
+            upsert_statement = f"INSERT INTO {quote(table_name)} ({column_list}) SELECT {select_list} FROM {quote(staging_table)} WHERE true"
+            if conflict_columns:
+                update_columns = [column for column in columns if column not in conflict_columns]
+                conflict_list = ', '.join(quote(column) for column in conflict_columns)
+                if update_columns:
+                    update_list = ', '.join(f"{quote(column)} = excluded.{quote(column)}" for column in update_columns)
+                    upsert_statement += f" ON CONFLICT ({conflict_list}) DO UPDATE SET {update_list}"
+                else:
+                    upsert_statement += f" ON CONFLICT ({conflict_list}) DO NOTHING"
+
+            connection.execute(text(upsert_statement))
+            connection.execute(text(f"DROP TABLE {quote(staging_table)}"))
+            if watermark:
+                self._write_watermark(connection, *watermark)
+
+        logger.info("Upserted %d rows into %s", len(staged_df), table_name)
+        return len(staged_df)
+
+    def changed_rows(self, input_df, table_name, file, key_columns):
+        '''
+        This function returns the rows of a DataFrame that are not in a table yet or differ from the row stored under the same key, for sources that are read in full
+        and have no column that only grows. New rows are found by an anti-join on the key columns, and changed rows by comparing a hash of each row with a hash of the stored row.
+        Values are compared as text, after dates and numbers have been read the same way on both sides, so the column types the database gave them do not matter.
+
+        Args:
+            input_df (pandas.DataFrame): The cleaned rows, with the destination table's column names.
+            table_name (str): The name of the destination table.
+            file (str): Path to the YAML file containing the database credentials.
+            key_columns (list): The primary key columns of the destination table.
+
+        Returns:
+            pandas.DataFrame: The new and changed rows of input_df, or all of them if the table does not exist yet.
+        '''
+        import pandas as pd
+
+        engine = self.init_db_engine(file)
+        if not inspect(engine).has_table(table_name):
+            return input_df
+
+        quote = engine.dialect.identifier_preparer.quote
+        with engine.connect() as connection:
+            stored_columns = self._column_types(connection, table_name)
+            columns = [column for column in input_df.columns if column in stored_columns]
+            stored_df = pd.read_sql_query(text(f"SELECT {', '.join(quote(column) for column in columns)} FROM {quote(table_name)}"), connection)
+
+        input_values = self._comparable_values(input_df[columns], input_df)
+        stored_values = self._comparable_values(stored_df, input_df)
+        # a new key is missing from the stored keys, and a changed row has a known key but a row hash none of the stored rows has
+        known_keys = pd.util.hash_pandas_object(input_values[key_columns], index=False).isin(pd.util.hash_pandas_object(stored_values[key_columns], index=False))
+        unchanged = pd.util.hash_pandas_object(input_values, index=False).isin(pd.util.hash_pandas_object(stored_values, index=False))
+        logger.info("%s: %d new and %d changed of %d rows", table_name, int((~known_keys).sum()), int((known_keys & ~unchanged).sum()), len(input_df))
+        return input_df[~unchanged.to_numpy()]
+
+    def _comparable_values(self, frame, like_df):
+        '''
+        This function returns a DataFrame's values as text, with the columns that are dates or numbers in like_df parsed as dates or numbers first.
+        '''
+        import pandas as pd
 
+        values = {}
+        for column in frame.columns:
+            if pd.api.types.is_datetime64_any_dtype(like_df[column]):
+                values[column] = pd.to_datetime(frame[column], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S')
+            elif pd.api.types.is_integer_dtype(like_df[column]):
+                # card numbers have more digits than a float holds exactly
+                values[column] = pd.to_numeric(frame[column], errors='coerce').astype('Int64')
+            elif pd.api.types.is_numeric_dtype(like_df[column]):
+                values[column] = pd.to_numeric(frame[column], errors='coerce').astype('Float64')
+            else:
+                values[column] = frame[column]
+        return pd.DataFrame(values).astype('string').fillna('')
+
+    def _column_types(self, connection, table_name):
+        '''
+        This function returns the column names of a table mapped to their SQL type names.
+        '''
+        if connection.dialect.name == 'postgresql':
+            result = connection.execute(text(
+                "SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+                "WHERE attrelid = CAST(:table_name AS regclass) AND attnum > 0 AND NOT attisdropped"), {'table_name': table_name})
+            return {column_name: type_name for column_name, type_name in result}
+        return {column['name']: str(column['type']) for column in inspect(connection).get_columns(table_name)}
+
+    def read_watermark(self, table_name, file):
+        '''
+        This function reads the high-water mark recorded for a source table by the last incremental load.
+
+        Args:
+            table_name (str): The name of the source table.
+            file (str): Path to the YAML file containing the sales_data database credentials.
+
+        Returns:
+            str: The watermark value as text, or None if the table has not been loaded incrementally yet.
+        '''
+        engine = self.init_db_engine(file)
+        with engine.begin() as connection:
+            self._create_watermark_table(connection)
+            row = connection.execute(text(f"SELECT watermark_value FROM {WATERMARK_TABLE} WHERE table_name = :table_name"), {'table_name': table_name}).first()
+
+        return None if row is None else row[0]
+
+    def write_watermark(self, table_name, watermark_column, watermark_value, file, connection=None):
+        '''
+        This function records the high-water mark for a source table, e.g. after a full load so the next incremental load starts from it.
+
+        Args:
+            table_name (str): The name of the source table.
+            watermark_column (str): The column the watermark is taken from.
+            watermark_value: The largest value of the column that has been loaded.
+            file (str): Path to the YAML file containing the sales_data database credentials.
+            connection (sqlalchemy.engine.Connection): An open connection to write on, so the watermark commits together with the work it records.
+        '''
+        if connection is not None:
+            self._write_watermark(connection, table_name, watermark_column, watermark_value)
+            return
+        engine = self.init_db_engine(file)
+        with engine.begin() as connection:
+            self._write_watermark(connection, table_name, watermark_column, watermark_value)
+
+    def _create_watermark_table(self, connection):
+        '''
+        This function creates the watermark table if it does not exist yet.
+        '''
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} ("
+            "table_name VARCHAR(255) PRIMARY KEY, watermark_column VARCHAR(255), watermark_value TEXT, updated_at TIMESTAMP)"))
+
+    def _write_watermark(self, connection, table_name, watermark_column, watermark_value):
+        '''
+        This function records the high-water mark for a source table on the given connection.
+        '''
+        self._create_watermark_table(connection)
+        connection.execute(text(
+            f"INSERT INTO {WATERMARK_TABLE} (table_name, watermark_column, watermark_value, updated_at) "
+            "VALUES (:table_name, :watermark_column, :watermark_value, CURRENT_TIMESTAMP) "
+            "ON CONFLICT (table_name) DO UPDATE SET watermark_column = excluded.watermark_column, "
+            "watermark_value = excluded.watermark_value, updated_at = excluded.updated_at"),
+            {'table_name': table_name, 'watermark_column': watermark_column, 'watermark_value': str(watermark_value)})
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import pandas as pd
+
+def parquet_ready(source_df):
+    '''
+    This function returns a shallow copy of a DataFrame that can be written to Parquet or Arrow.
+    Raw extractions can mix numbers and text in one object column, e.g. card numbers with '?' in some of them, which Arrow cannot store,
+    so those columns are cast to strings, and the column names are made strings.
+
+    Args:
+        source_df (pandas.DataFrame): The DataFrame to convert.
+
+    Returns:
+        pandas.DataFrame: The converted DataFrame.
+    '''
+    parquet_df = source_df.copy(deep=False)
+    for column in parquet_df.columns[parquet_df.dtypes == object]:
+        if pd.api.types.infer_dtype(parquet_df[column], skipna=True).startswith('mixed'):
+            parquet_df[column] = parquet_df[column].astype('string')
+    parquet_df.columns = [str(column) for column in parquet_df.columns]
+    return parquet_df
+
+class ExtractionCache:
+    '''
+    This class can be used to keep a local Parquet copy of each raw extraction, keyed by its source URL.
+    An entry is reused while its validator (an S3 or HTTP ETag/Last-Modified) still matches and it is younger than the TTL,
+    and the least recently used entries are evicted once the cache is larger than its size limit.
+
+    '''
+
+    def __init__(self, cache_dir='.extraction_cache', ttl=None, max_bytes=2 * 1024 ** 3):
+        '''
+        This function opens the cache directory, creating it and its manifest if needed.
+
+        Args:
+            cache_dir (str): The directory the Parquet files and manifest are kept in.
+            ttl (float): The default number of seconds an entry stays valid, or None for no time limit.
+            max_bytes (int): The total size of Parquet files to keep before evicting, or None for no limit.
+        '''
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        # pipeline stages share one cache across threads
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as manifest_file:
+                self.manifest = json.load(manifest_file)
+        else:
+            self.manifest = {}
+
+    def get(self, source, validator=None, ttl=None):
+        '''
+        This function returns the cached DataFrame for a source if it is still valid.
+
+        Args:
+            source (str): The URL the data was extracted from.
+            validator (str): The source's current ETag/Last-Modified, which must match the one saved with the entry.
+            ttl (float): Overrides the cache's default TTL for this source.
+
+        Returns:
+            pandas.DataFrame: The cached DataFrame, or None on a miss.
+        '''
+        key = self._key(source)
+        with self._lock:
+            entry = self._valid_entry(key, validator, ttl)
+            if entry is None:
+                return None
+            entry['last_used'] = time.time()
+            self._save_manifest()
+            path = entry['path']
+
+        return pd.read_parquet(path)
+
+    def saved_at(self, source, validator=None, ttl=None):
+        '''
+        This function returns when a source was cached, if its entry is still valid, without reading it.
+        The pipeline uses it as the version of sources that send no ETag, e.g. the store API.
+
+        Args:
+            source (str): The URL the data was extracted from.
+            validator (str): The source's current ETag/Last-Modified, which must match the one saved with the entry.
+            ttl (float): Overrides the cache's default TTL for this source.
+
+        Returns:
+            float: The time the entry was saved, or None on a miss.
+        '''
+        with self._lock:
+            entry = self._valid_entry(self._key(source), validator, ttl)
+            return None if entry is None else entry['saved_at']
+
+    def _valid_entry(self, key, validator, ttl):
+        '''
+        This function returns the manifest entry for a key if it is still valid, removing it if it has expired or its source has changed.
+        '''
+        ttl = self.ttl if ttl is None else ttl
+        entry = self.manifest.get(key)
+        if entry is None:
+            return None
+        expired = ttl is not None and time.time() - entry['saved_at'] > ttl
+        if expired or entry['validator'] != validator or not os.path.exists(entry['path']):
+            self._remove(key)
+            self._save_manifest()
+            return None
+        return entry
+
+    def put(self, source, source_df, validator=None):
+        '''
+        This function saves a raw extraction as Parquet and evicts the least recently used entries if the cache is over its size limit.
+
+        Args:
+            source (str): The URL the data was extracted from.
+            source_df (pandas.DataFrame): The raw extracted DataFrame.
+            validator (str): The source's ETag/Last-Modified at the time of extraction.
+        '''
+        key = self._key(source)
+        path = os.path.join(self.cache_dir, f"{key}.parquet")
+        parquet_ready(source_df).to_parquet(path)
+
+        with self._lock:
+            now = time.time()
+            self.manifest[key] = {'source': source, 'path': path, 'validator': validator, 'saved_at': now, 'last_used': now, 'size': os.path.getsize(path)}
+            self._evict()
+            self._save_manifest()
+
+    def _evict(self):
+        '''
+        This function removes the least recently used entries until the cache fits in max_bytes.
+        '''
+        if self.max_bytes is None:
+            return
+        total_size = sum(entry['size'] for entry in self.manifest.values())
+        for key in sorted(self.manifest, key=lambda key: self.manifest[key]['last_used']):
+            if total_size <= self.max_bytes:
+                break
+            total_size -= self.manifest[key]['size']
+            self._remove(key)
+
+    def _remove(self, key):
+        '''
+        This function deletes an entry and its Parquet file.
+        '''
+        entry = self.manifest.pop(key)
+        if os.path.exists(entry['path']):
+            os.remove(entry['path'])
+
+    def _save_manifest(self):
+        '''
+        This function writes the manifest to disk, replacing the old one in a single step.
+        '''
+        temporary_path = self.manifest_path + '.tmp'
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2)
+        os.replace(temporary_path, self.manifest_path)
+
+    def _key(self, source):
+        '''
+        This function turns a source URL into a short file-safe key.
+        '''
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()[:20]
@@ -0,0 +1,220 @@
+from dataclasses import dataclass, field
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import text
+
+from schema import TABLE_SCHEMAS
+
+''' Checks the foreign keys of a table in memory before it is uploaded, so adding the keys after a long load does not fail
+on an orphan, a row referencing a key its dimension table does not have. Each key column is hashed to 64-bit integers, and
+each foreign key is checked with a hashed anti-join: the hashes of the referencing column are looked up in a hash table
+of the referenced keys, built once and reused for every chunk, and the rows not found are the orphans. The orphans are
+counted and sampled for a report, and can be quarantined, loaded into <table>_quarantine instead of the table, or
+repaired, by adding a row holding just the missing key to the dimension table, as create_schema does for the web
+portal store.'''
+
+logger = logging.getLogger(__name__)
+
+ORPHAN_ACTIONS = ('report', 'quarantine', 'repair')
+
+@dataclass
+class OrphanReport:
+    '''
+    This class holds the orphans found for one foreign key.
+
+    Attributes:
+        foreign_key (ForeignKey): the foreign key checked.
+        rows_checked (int): the number of rows checked.
+        orphan_rows (int): the number of rows whose key is missing from the referenced table.
+        orphan_keys (set): the hashes of the distinct missing keys.
+        samples (list): the first few missing keys.
+    '''
+    foreign_key: object
+    rows_checked: int = 0
+    orphan_rows: int = 0
+    orphan_keys: set = field(default_factory=set)
+    samples: list = field(default_factory=list)
+
+@dataclass
+class CheckedChunk:
+    '''
+    This class holds the outcome of checking one chunk of a table.
+
+    Attributes:
+        rows (pandas.DataFrame): the rows to upload, without the orphans if they are quarantined.
+        orphans (pandas.DataFrame): the quarantined rows, with the foreign keys each one breaks in an orphan_keys column, or None unless quarantining.
+        missing_keys (dict): when repairing, a DataFrame of the keys to add to each referenced table, keyed by table name, leaving out keys added for an earlier chunk.
+    '''
+    rows: object
+    orphans: object = None
+    missing_keys: dict = field(default_factory=dict)
+
+def hash_keys(values, sql_type=None):
+    '''
+    This function hashes key values to 64-bit integers, in the form the database compares them in: as text, with UUIDs in lower case.
+
+    Args:
+        values (pandas.Series): the key values, without nulls.
+        sql_type (str): the type of the key column in the database.
+
+    Returns:
+        numpy.ndarray: the uint64 hash of each value.
+    '''
+    # the Arrow strings are lowered and hashed without the factorising hash_pandas_object does, which keys, being mostly distinct, gain nothing from
+    key_strings = pa.array(values.astype('string[pyarrow]'))
+    if sql_type == 'UUID':
+        key_strings = pc.ascii_lower(key_strings)
+    return pd.util.hash_array(key_strings.to_numpy(zero_copy_only=False), categorize=False)
+
+class ReferentialIntegrityChecker:
+    '''
+    This class can be used to check the foreign keys of a table, chunk by chunk, against the keys of the tables they reference before the table is uploaded.
+
+    '''
+
+    def __init__(self, table_name='orders_table', table_schemas=TABLE_SCHEMAS, action='report', sample_size=5):
+        '''
+        This function sets up the checker. The referenced keys are added with load_keys or add_keys before the first chunk is checked.
+
+        Args:
+            table_name (str): the table whose foreign keys are checked.
+            table_schemas (dict): the TableSchemas, keyed by table name.
+            action (str): what to do with the orphans, one of ORPHAN_ACTIONS: 'report' only counts them, 'quarantine' leaves them out of the upload
+                and 'repair' adds their missing keys to the referenced tables.
+            sample_size (int): the number of missing keys kept for the report of each foreign key.
+        '''
+        if action not in ORPHAN_ACTIONS:
+            raise ValueError(f"Unknown orphan action '{action}', choose from {', '.join(ORPHAN_ACTIONS)}")
+        self.table_schema = table_schemas[table_name]
+        self.table_schemas = table_schemas
+        self.action = action
+        self.sample_size = sample_size
+        self.reports = {foreign_key.name: OrphanReport(foreign_key) for foreign_key in self.table_schema.foreign_keys}
+        # (table, column) -> the hashes of the referenced keys added so far, and the hash table built from them
+        self._key_hashes = {}
+        self._key_indexes = {}
+
+    def _sql_type(self, table_name, column_name):
+        '''
+        This function returns the database type of a column in the schema.
+        '''
+        return next(column.sql_type for column in self.table_schemas[table_name].columns if column.name == column_name)
+
+    def add_keys(self, table_name, column_name, values):
+        '''
+        This function adds keys of a referenced table, e.g. from its cleaned DataFrame or read from the database.
+
+        Args:
+            table_name (str): the referenced table.
+            column_name (str): the referenced column.
+            values (pandas.Series): the key values.
+        '''
+        values = values[values.notna()]
+        self._key_hashes.setdefault((table_name, column_name), []).append(hash_keys(values, self._sql_type(table_name, column_name)))
+        self._key_indexes.pop((table_name, column_name), None)
+
+    def load_keys(self, engine, chunksize=500000):
+        '''
+        This function reads the keys of every referenced table from the database, a chunk at a time, along with the extra rows create_schema adds to them.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): the engine connected to the sales_data database, once the referenced tables are loaded.
+            chunksize (int): the number of keys read at a time.
+        '''
+        quote = engine.dialect.identifier_preparer.quote
+        for foreign_key in self.table_schema.foreign_keys:
+            table_name, column_name = foreign_key.references_table, foreign_key.references_column
+            # read as text, so UUIDs come back in the same form as the cleaned keys
+            query = f"SELECT CAST({quote(column_name)} AS TEXT) AS key FROM {quote(table_name)}"
+            with engine.connect() as connection:
+                for keys_df in pd.read_sql_query(text(query), connection, chunksize=chunksize):
+                    self.add_keys(table_name, column_name, keys_df['key'])
+            extra_keys = [row[column_name] for row in self.table_schemas[table_name].extra_rows]
+            if extra_keys:
+                self.add_keys(table_name, column_name, pd.Series(extra_keys, dtype=object))
+
+    def _key_index(self, foreign_key):
+        '''
+        This function returns the hash table of the keys a foreign key references, building it the first time it is needed.
+        The index keeps its hash table between chunks, so it is built once rather than for every chunk as a merge would.
+        '''
+        key = (foreign_key.references_table, foreign_key.references_column)
+        if key not in self._key_indexes:
+            hashes = self._key_hashes.get(key, [])
+            # pd.unique deduplicates with a hash table, without the sort np.unique does
+            self._key_indexes[key] = pd.Index(pd.unique(np.concatenate(hashes)) if hashes else np.array([], dtype=np.uint64))
+        return self._key_indexes[key]
+
+    def check(self, table_df):
+        '''
+        This function checks one chunk of the table against the referenced keys and adds its orphans to the reports.
+        Nulls are not orphans, as a foreign key allows them.
+
+        Args:
+            table_df (pandas.DataFrame): the chunk, mapped onto the table's columns with prepare_frame.
+
+        Returns:
+            CheckedChunk: the rows to upload, and the orphans to quarantine or the keys to add, depending on the action.
+        '''
+        orphan_mask = np.zeros(len(table_df), dtype=bool)
+        # the names of the foreign keys each row breaks, for the quarantine table
+        broken_keys = pd.Series('', index=table_df.index, dtype=object) if self.action == 'quarantine' else None
+        missing_keys = {}
+
+        for foreign_key in self.table_schema.foreign_keys:
+            report = self.reports[foreign_key.name]
+            key_values = table_df[foreign_key.column]
+            present = key_values.notna().to_numpy()
+            hashes = hash_keys(key_values[present], self._sql_type(self.table_schema.name, foreign_key.column))
+            # the anti-join: positions of the keys that are not in the hash table of referenced keys
+            missing = self._key_index(foreign_key).get_indexer(hashes) < 0
+            report.rows_checked += len(table_df)
+            if not missing.any():
+                continue
+
+            orphan_rows = np.flatnonzero(present)[missing]
+            orphan_mask[orphan_rows] = True
+            if broken_keys is not None:
+                broken_keys.iloc[orphan_rows] += foreign_key.name + ','
+            report.orphan_rows += len(orphan_rows)
+
+            # the first row of each distinct missing key, leaving out keys already seen in an earlier chunk
+            first_rows = pd.Series(key_values.to_numpy()[orphan_rows], index=hashes[missing])
+            first_rows = first_rows[~first_rows.index.duplicated()]
+            new_keys = first_rows[~first_rows.index.isin(list(report.orphan_keys))]
+            report.orphan_keys.update(new_keys.index.tolist())
+            report.samples += new_keys.iloc[:self.sample_size - len(report.samples)].tolist()
+            if self.action == 'repair' and len(new_keys):
+                missing_keys.setdefault(foreign_key.references_table, []).append(pd.DataFrame({foreign_key.references_column: new_keys.to_numpy()}))
+
+        if self.action == 'quarantine':
+            orphans_df = table_df[orphan_mask].assign(orphan_keys=broken_keys[orphan_mask].str.rstrip(','))
+            return CheckedChunk(rows=table_df[~orphan_mask], orphans=orphans_df)
+        if self.action == 'repair':
+            # two foreign keys may reference the same table, so its missing keys are put together and deduplicated
+            missing_keys = {table_name: pd.concat(frames).drop_duplicates() for table_name, frames in missing_keys.items()}
+        return CheckedChunk(rows=table_df, missing_keys=missing_keys)
+
+    @property
+    def orphan_rows(self):
+        '''
+        The number of rows checked so far that break at least one foreign key, counted once for each key they break.
+        '''
+        return sum(report.orphan_rows for report in self.reports.values())
+
+    def log_report(self):
+        '''
+        This function logs the number of orphans found for each foreign key, with a sample of the missing keys, as a warning where there are any.
+        '''
+        verb = {'report': 'found', 'quarantine': 'quarantined', 'repair': 'repaired'}[self.action]
+        for report in self.reports.values():
+            foreign_key = report.foreign_key
+            if not report.orphan_rows:
+                logger.info("Referential integrity of %s: %s has no orphans in %d rows", self.table_schema.name, foreign_key.name, report.rows_checked)
+                continue
+            logger.warning("Referential integrity of %s: %s orphans %s, %d of %d rows reference %d %s values missing from %s, e.g. %s",
+                           self.table_schema.name, foreign_key.name, verb, report.orphan_rows, report.rows_checked, len(report.orphan_keys),
+                           foreign_key.column, foreign_key.references_table, ', '.join(str(sample) for sample in report.samples))
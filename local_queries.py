@@ -0,0 +1,215 @@
+import argparse
+import os
+import time
+import duckdb
+import pandas as pd
+
+from query_runner import QueryResult, classify_statement, frames_match, print_results, split_statements
+from schema import TABLE_SCHEMAS, extra_row_statements, prepare_frame
+
+''' Answers the business queries in-process with DuckDB, without a database server. The destination tables are built
+from cleaned DataFrames, Parquet files or a copy of the sales_data tables, and business_queries.sql runs on them as it is,
+e.g. python3 local_queries.py --scale 100k for synthetic data, or python3 local_queries.py --creds my_creds.yaml --cross-check
+to check the answers against PostgreSQL.'''
+
+class LocalQueryEngine:
+    '''
+    This class can be used to load the destination tables into an in-process DuckDB database and run SQL scripts on them.
+
+    '''
+
+    def __init__(self, database=':memory:'):
+        '''
+        This function opens the DuckDB database.
+
+        Args:
+            database (str): Path to a DuckDB database file, or ':memory:' to keep the tables in memory.
+        '''
+        self.connection = duckdb.connect(database)
+
+    def load_frame(self, table_name, table_df, prepared=False):
+        '''
+        This function replaces a destination table with the rows of a DataFrame.
+
+        Args:
+            table_name (str): The destination table, a key of TABLE_SCHEMAS.
+            table_df (pandas.DataFrame): The cleaned DataFrame, or one already mapped onto the table's columns.
+            prepared (bool): The DataFrame already has exactly the table's columns, e.g. from prepare_frame or the database.
+        '''
+        table_schema = TABLE_SCHEMAS[table_name]
+        if not prepared:
+            table_df = prepare_frame(table_schema, table_df)
+        # cast to the table's SQL types, as the database has them, e.g. month is text there and an integer in the cleaned frame,
+        # and the queries' answers depend on the types
+        columns = ', '.join(f'CAST("{column.name}" AS {column.sql_type}) AS "{column.name}"' for column in table_schema.columns if column.name in table_df.columns)
+        # DuckDB reads the DataFrame's columns in place through the view
+        self.connection.register('table_df_view', table_df)
+        self.connection.execute(f'CREATE OR REPLACE TABLE "{table_name}" AS SELECT {columns} FROM table_df_view')
+        self.connection.unregister('table_df_view')
+
+    def load_parquet(self, directory, table_names=tuple(TABLE_SCHEMAS)):
+        '''
+        This function replaces the destination tables with the Parquet files written by save_parquet.
+
+        Args:
+            directory (str): The directory holding a <table_name>.parquet file for each table.
+            table_names (tuple): The tables to load.
+        '''
+        for table_name in table_names:
+            file_path = os.path.join(directory, f"{table_name}.parquet").replace("'", "''")
+            self.connection.execute(f"CREATE OR REPLACE TABLE \"{table_name}\" AS SELECT * FROM read_parquet('{file_path}')")
+
+    def load_from_database(self, engine, table_names=tuple(TABLE_SCHEMAS), chunksize=100000):
+        '''
+        This function copies the destination tables from the sales_data database, e.g. to check the local answers against it.
+        Only the columns in the schema are copied, leaving out any added by the queries, such as dim_store_details.location.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): The engine connected to the sales_data database.
+            table_names (tuple): The tables to copy.
+            chunksize (int): The number of rows read at a time.
+        '''
+        for table_name in table_names:
+            columns = ', '.join(f'"{column.name}"' for column in TABLE_SCHEMAS[table_name].columns)
+            chunks = pd.read_sql(f'SELECT {columns} FROM "{table_name}"', engine, chunksize=chunksize)
+            self.load_frame(table_name, pd.concat(chunks, ignore_index=True), prepared=True)
+
+    def add_extra_rows(self, table_names=tuple(TABLE_SCHEMAS)):
+        '''
+        This function inserts the rows the schema adds after the load, e.g. the web portal store, into tables built from cleaned data.
+        '''
+        for table_name in table_names:
+            for statement in extra_row_statements(TABLE_SCHEMAS[table_name]):
+                self.connection.execute(statement)
+
+    def save_parquet(self, directory, table_names=tuple(TABLE_SCHEMAS)):
+        '''
+        This function writes each destination table to <directory>/<table_name>.parquet, so later runs can start from the files.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        for table_name in table_names:
+            file_path = os.path.join(directory, f"{table_name}.parquet").replace("'", "''")
+            self.connection.execute(f"COPY \"{table_name}\" TO '{file_path}' (FORMAT PARQUET)")
+
+    def run_file(self, file_path):
+        '''
+        This function runs the statements of a SQL script one after another, which DuckDB parallelises internally.
+        A failed statement is recorded with its error and the rest still run.
+
+        Args:
+            file_path (str): Path to the SQL script.
+
+        Returns:
+            list: a QueryResult for each statement, in script order, with each read's rows as a DataFrame.
+        '''
+        with open(file_path, 'r') as sql_file:
+            statements = split_statements(sql_file.read())
+
+        results, query_number = [], 0
+        for statement_number, statement in enumerate(statements, start=1):
+            kind = classify_statement(statement)
+            if kind == 'read':
+                query_number += 1
+            result = QueryResult(statement_number, query_number if kind == 'read' else None, statement, kind)
+            start = time.perf_counter()
+            try:
+                if kind == 'read':
+                    result.data = self.connection.execute(statement).df()
+                    result.rows = len(result.data)
+                else:
+                    self.connection.execute(statement)
+                result.seconds = time.perf_counter() - start
+            except duckdb.Error as e:
+                result.error = str(e).splitlines()[0]
+            results.append(result)
+
+        return results
+
+    def close(self):
+        '''
+        This function closes the DuckDB database.
+        '''
+        self.connection.close()
+
+def cross_check(local_results, database_results, tolerance=0.01):
+    '''
+    This function checks that the local answers match the answers from the sales_data database, query by query.
+
+    Args:
+        local_results (list): The QueryResults from LocalQueryEngine.run_file.
+        database_results (list): The QueryResults from QueryRunner.run_file on the same tables.
+        tolerance (float): The largest difference allowed between two numbers.
+
+    Returns:
+        list: The numbers of the queries whose answers differ.
+    '''
+    local_reads = [result for result in local_results if result.kind == 'read']
+    database_reads = [result for result in database_results if result.kind == 'read']
+    if len(local_reads) != len(database_reads):
+        raise ValueError(f"The local run has {len(local_reads)} queries but the database run has {len(database_reads)}")
+
+    mismatches = []
+    for local_result, database_result in zip(local_reads, database_reads):
+        if local_result.error is not None or database_result.error is not None:
+            matches = False
+        else:
+            matches = frames_match(local_result.data, database_result.data, tolerance)
+        if not matches:
+            mismatches.append(local_result.query_number)
+        print(f"Query {local_result.query_number}: local answer {'matches' if matches else 'DOES NOT MATCH'} the database.")
+
+    return mismatches
+
+def parse_args():
+    '''
+    This function reads the command line options for the local run.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    '''
+    parser = argparse.ArgumentParser(description="Answer the business queries in-process with DuckDB.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--scale', help="generate, clean and load synthetic data at a benchmark scale factor, e.g. 100k")
+    source.add_argument('--parquet-dir', help="load the tables from the Parquet files written by --save-parquet")
+    source.add_argument('--creds', help="copy the tables from the sales_data database with these YAML credentials")
+    parser.add_argument('--queries', default='sql_files/essential_queries/business_queries.sql', help="the SQL script to run")
+    parser.add_argument('--save-parquet', help="write the loaded tables to Parquet files in this directory")
+    parser.add_argument('--cross-check', action='store_true', help="check the answers against the business queries run on the sales_data database (needs --creds)")
+    parser.add_argument('--database-queries', default='sql_files/essential_queries/business_queries_rollup.sql',
+                        help="the SQL script run on the sales_data database for --cross-check")
+    args = parser.parse_args()
+    if args.cross_check and args.creds is None:
+        parser.error("--cross-check needs --creds")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    local_engine = LocalQueryEngine()
+    start = time.perf_counter()
+    if args.scale is not None:
+        # imported here as only synthetic runs need the benchmark data
+        from benchmark import DESTINATION_TABLES, SCALE_FACTORS, clean_source_frame, make_source_frames
+        from data_cleaning import DatabaseCleaning
+        cleaner = DatabaseCleaning()
+        for source_name, source_df in make_source_frames(SCALE_FACTORS[args.scale]).items():
+            local_engine.load_frame(DESTINATION_TABLES[source_name], clean_source_frame(cleaner, source_name, source_df))
+        local_engine.add_extra_rows()
+    elif args.parquet_dir is not None:
+        local_engine.load_parquet(args.parquet_dir)
+    else:
+        from database_utils import DatabaseConnector
+        database_engine = DatabaseConnector().init_db_engine(args.creds)
+        local_engine.load_from_database(database_engine)
+    print(f"Loaded the tables in {time.perf_counter() - start:.2f}s.")
+    if args.save_parquet is not None:
+        local_engine.save_parquet(args.save_parquet)
+
+    local_results = local_engine.run_file(args.queries)
+    print_results(local_results)
+    print(f"Answered the queries in {sum(result.seconds or 0 for result in local_results):.2f}s.")
+
+    if args.cross_check:
+        from query_runner import QueryRunner
+        mismatches = cross_check(local_results, QueryRunner(database_engine).run_file(args.database_queries))
+        if mismatches:
+            raise SystemExit(f"The local answers differ from the database for queries {mismatches}")
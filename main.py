@@ -1,249 +1,648 @@
-import numpy as np
-import matplotlib.pyplot as plt
-import yaml
-import psycopg2
-from psycopg2 import sql
-from sqlalchemy import create_engine, text
+import argparse
+import logging
+import os
+import threading
 
-from database_utils import DatabaseConnector
-from data_cleaning import DatabaseCleaning
-from data_extraction import DataExtractor
+from pipeline import Pipeline
+from tracing import Tracer
+
+logger = logging.getLogger(__name__)
 
 ''' This is the script where I will use the three different classes (DatabaseConnector,
 DataExtractor and DatabaseCleaning) to retrive data from a variety of sources, clean 
 the data and upload to the sales_data database in the relational database management 
 system PostgreSQL. Finally, it will run two sql scripts which will create the database schema 
-and run business queries on it, visualising one query with a piechart.'''
+and run business queries on it, visualising one query with a piechart.
+
+Each part of the run is also a subcommand, e.g. python3 main.py query, and the heavy libraries (pandas, SQLAlchemy,
+boto3, tabula, matplotlib) are only imported by the functions that use them, so --help and the query path start quickly.'''
 
-def user_data():
+class PipelineContext:
     '''
-    This function retrieves, cleans, and uploads user data from an AWS RDS database to a new table in the sales_data database.
+    This class holds the connectors and configuration that are passed to every pipeline stage.
 
-    Returns:
-        pandas.DataFrame: A cleaned DataFrame containing user data, which has also been uploaded to the "dim_users" table.
     '''
-    # create instance of DataExtractor class 
-    extract_rds_data = DataExtractor()
-    # Get the users table name
-    legacy_users_table_name = get_table_names[1]
-    # Use it to read in/retrieve the data from the RDS table, which returns a dataframe
-    users_df = extract_rds_data.read_rds_table(database_connector, legacy_users_table_name, engine)
 
-    # Create an instance of DatabaseCleaning class
-    clean_user = DatabaseCleaning()
-    # use clean_user_data() method to clean the data
-    clean_user_df = clean_user.clean_user_data(users_df)
+    def __init__(self, database_connector, rds_creds='db_creds.yaml', sales_data_creds='my_creds.yaml', chunksize=100000, store_workers=16, incremental=False, extraction_cache=None, tracer=None,
+                 use_rollups=True, check_rollups=False, explain_queries=False, plan_check=False, plan_baseline='plan_baseline.json', compact_dtypes=False, clean_workers=1,
+                 checkpoints=None, integrity_check=None):
+        '''
+        This function stores the shared connector and the file paths, endpoints and tuning options used by the stages.
+
+        Args:
+            database_connector (DatabaseConnector): The connector shared by every stage, which caches one engine per credentials file.
+            rds_creds (str): Path to the YAML file with the AWS RDS credentials.
+            sales_data_creds (str): Path to the YAML file with the sales_data PostgreSQL credentials.
+            chunksize (int): The number of rows streamed at a time from the RDS tables.
+            store_workers (int): The number of store details requests sent to the API at once.
+            incremental (bool): Load only rows past each table's watermark and upsert them, instead of replacing the tables.
+            extraction_cache (ExtractionCache): The local cache of raw PDF, S3 and API extractions, or None to always download.
+            tracer (Tracer): Records spans for the extract, clean and upload steps of each stage, a new Tracer is used if not given.
+            use_rollups (bool): Answer the business queries from the sales rollup instead of the raw tables.
+            check_rollups (bool): Check that the rollup gives the same answers as the raw tables after refreshing it.
+            explain_queries (bool): Capture EXPLAIN (ANALYZE, BUFFERS) for each business query.
+            plan_check (bool): Check the business queries' plans for sequential scans of large tables and cost regressions before running them.
+            plan_baseline (str): Path to the JSON file of baseline query costs for the plan check.
+            compact_dtypes (bool): Clean to categoricals, Arrow strings and small integers, which hold the tables in less memory.
+            clean_workers (int): The number of processes large frames are cleaned on, 1 to clean in the stage's own thread.
+            checkpoints (CheckpointStore): Where the load stages keep their cleaned output for resumed runs, or None not to keep it.
+            integrity_check (str): Check the orders' foreign keys against the loaded dimension tables before uploading them, and 'report', 'quarantine' or 'repair' the orphans, or None not to check.
+        '''
+        self.database_connector = database_connector
+        self.rds_creds = rds_creds
+        self.sales_data_creds = sales_data_creds
+        self.chunksize = chunksize
+        self.store_workers = store_workers
+        self.incremental = incremental
+        self.extraction_cache = extraction_cache
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.use_rollups = use_rollups
+        self.check_rollups = check_rollups
+        self.explain_queries = explain_queries
+        self.plan_check = plan_check
+        self.plan_baseline = plan_baseline
+        self.compact_dtypes = compact_dtypes
+        self.clean_workers = clean_workers
+        self.checkpoints = checkpoints
+        self.integrity_check = integrity_check
+        # the orders' ReferentialIntegrityChecker, once the orders load has made it
+        self.integrity_checker = None
+        self._cleaner = None
+        self._cleaner_lock = threading.Lock()
+        # the RDS tables carry an increasing row number which the incremental loads use as their watermark
+        self.rds_watermark_column = 'index'
+        self.users_table_name = 'legacy_users'
+        self.orders_table_name = 'orders_table'
+        self.card_details_pdf = 'https://data-handling-public.s3.eu-west-1.amazonaws.com/card_details.pdf'
+        self.num_stores_endpoint = "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/number_stores"
+        self.store_endpoint = "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/store_details/" # number of stores will be added onto the end of this
+        self.api_key_file = 'api_key.yaml'
+        self.products_s3_file = 's3_url.yaml'
+        self.dates_s3_file = 'json_s3_url.yaml'
+        self.query_sql_file_path = 'sql_files/essential_queries/business_queries.sql'
+        self.rollup_query_sql_file_path = 'sql_files/essential_queries/business_queries_rollup.sql'
+
+    @property
+    def cleaner(self):
+        '''
+        The DatabaseCleaning shared by the stages, or a ParallelCleaner when clean_workers is more than 1, so its worker processes are started once for the whole run.
+        It is created when a stage first needs it, so runs that only query the database do not import the cleaning code.
+        '''
+        with self._cleaner_lock:
+            if self._cleaner is None:
+                if self.clean_workers > 1:
+                    from parallel_cleaning import ParallelCleaner
+                    self._cleaner = ParallelCleaner(max_workers=self.clean_workers, compact=self.compact_dtypes)
+                else:
+                    from data_cleaning import DatabaseCleaning
+                    self._cleaner = DatabaseCleaning(compact=self.compact_dtypes)
+            return self._cleaner
+
+    def close(self):
+        '''
+        This function shuts down the cleaning worker processes, if there are any.
+        '''
+        if self._cleaner is not None and self.clean_workers > 1:
+            self._cleaner.close()
+
+    @property
+    def rds_engine(self):
+        '''
+        The SQLAlchemy engine connected to the AWS RDS database.
+        '''
+        return self.database_connector.init_db_engine(self.rds_creds)
+
+    @property
+    def sales_data_engine(self):
+        '''
+        The SQLAlchemy engine connected to the sales_data database.
+        '''
+        return self.database_connector.init_db_engine(self.sales_data_creds)
+
+def read_rds_chunks(context, table_name, since=None):
+    '''
+    This function streams a table from the AWS RDS database in chunks of context.chunksize rows.
 
-    # Upload to a new table called dim_users in SQAlchemy sales_data database.
-    database_connector.upload_to_db(clean_user_df, "dim_users", 'my_creds.yaml')
-    return clean_user_df
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+        table_name (str): The name of the table in the RDS database.
+        since (tuple): (column, value) to read only the rows past a watermark, or None to read them all.
 
-def card_data():
+    Returns:
+        iterator: The chunks as DataFrames.
     '''
-    This function retrieves, cleans, and uploads card data from a PDF document in an AWS S3 bucket into a new table in the sales_data database.
+    from data_extraction import DataExtractor
+
+    extract_rds_data = DataExtractor()
+    return extract_rds_data.read_rds_table(context.database_connector, table_name, context.rds_engine, chunksize=context.chunksize, since=since)
+
+def extract_card_details(context):
+    '''
+    This function extracts the card details from the PDF document in the AWS S3 bucket.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
 
     Returns:
-        pandas.DataFrame: A cleaned DataFrame containing card data, which has also been uploaded to the "dim_card_details" table.
+        pandas.DataFrame: The raw card data.
     '''
+    from data_extraction import DataExtractor
+
     # Create instance of DBConnector class
-    extract_pdf_data = DataExtractor()
-    # takes in uncleaned df as arg, sets it to cleaned_df variable
-    card_details_df = extract_pdf_data.retrieve_pdf_data('https://data-handling-public.s3.eu-west-1.amazonaws.com/card_details.pdf')
-    
-    # Create Cleaning instanct
-    card_cleaning = DatabaseCleaning()
-    # Use clean_card_data method to clean df
-    clean_card_df = card_cleaning.clean_card_data(card_details_df)
-    
-    # upload to a new table called dim_card_details in SQAlchemy sales_data database
-    database_connector.upload_to_db(clean_card_df, "dim_card_details", 'my_creds.yaml')
-    
-    return clean_card_df
+    extract_pdf_data = DataExtractor(cache=context.extraction_cache)
+    return extract_pdf_data.retrieve_pdf_data(context.card_details_pdf)
 
-def stores_data():
+def extract_store_details(context):
     '''
-    This function retrieves, cleans, and uploads stores data using an API into a new table in the sales_data database.
+    This function extracts the details of every store from the store API.
+
+    The API has two GET methods. One will return the number of stores in the business and the other to retrieve a store given a store number.
+    The two endpoints for the API are as follows:
+    Retrieve a store: https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/store_details/{store_number}
+    Return the number of stores: https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/number_stores
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
 
     Returns:
-        pandas.DataFrame: A cleaned DataFrame containing store data, which has also been uploaded to the "dim_store_details" table.
+        pandas.DataFrame: The raw store data.
     '''
-    retrieve_store_endpoint = "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/store_details/" # number of stores will be added onto the end of this
+    from data_extraction import DataExtractor
+
+    # Use read_db_creds method to read yaml file with api key
+    api_header_details = context.database_connector.read_db_creds(context.api_key_file)
+    api_retrieval = DataExtractor(cache=context.extraction_cache)
+    # Use the list_number_of_stores method to get the number of total stores
+    total_stores = api_retrieval.list_number_of_stores(context.num_stores_endpoint, api_header_details)
     # Use retrieve_stores_data method to return the df
-    store_info_df = api_retrieval.retrieve_stores_data(retrieve_store_endpoint, total_stores, api_header_details)
+    return api_retrieval.retrieve_stores_data(context.store_endpoint, total_stores, api_header_details, max_workers=context.store_workers)
 
-    # clean stores_df
-    store_cleaning = DatabaseCleaning()
-    clean_store_df = store_cleaning.clean_store_data(store_info_df)
+def extract_products(context):
+    '''
+    This function extracts the product data from the csv file in the s3 bucket.
 
-    # Upload to a new table called dim_store_details in SQAlchemy sales_data database
-    database_connector.upload_to_db(clean_store_df, "dim_store_details", 'my_creds.yaml')
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
 
-    return clean_store_df
+    Returns:
+        pandas.DataFrame: The raw product data.
+    '''
+    from data_extraction import DataExtractor
 
-def product_data():
+    # S3 URI:
+    s3_products_address = context.database_connector.read_db_creds(context.products_s3_file)
+    # use the extract_from_s3 method to input the s3 address and return a dataframe
+    get_product_details = DataExtractor(cache=context.extraction_cache)
+    return get_product_details.extract_from_s3(s3_products_address)
+
+def extract_date_times(context):
     '''
-    This function retrieves, cleans, and uploads product data from a csv file in an s3 bucket into a new table in the sales_data database.
+    This function extracts the date events from the JSON file in the s3 bucket.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
 
     Returns:
-        pandas.DataFrame: A cleaned DataFrame containing product data, which has also been uploaded to the "dim_products" table.
+        pandas.DataFrame: The raw date data.
     '''
-    # S3 URI:
-    s3_products_address = database_connector.read_db_creds('s3_url.yaml')
+    from data_extraction import DataExtractor
 
-    # use the extract_from_s3 method to input the s3 address and return a dataframe
-    get_product_details = DataExtractor()
-    precleaned_product_df = get_product_details.extract_from_s3(s3_products_address)
-    
-    # Use convert_product_weights method to convert weights column to same unit (kg)
-    clean_product_data = DatabaseCleaning()
-    product_weight_kg_df = clean_product_data.convert_product_weights(precleaned_product_df)
+    # create a DataExtractor instance
+    extract_json_data = DataExtractor(cache=context.extraction_cache)
+    # Use read_db_creds method to get link to json object
+    json_s3_address = context.database_connector.read_db_creds(context.dates_s3_file)
+    # use extract_from_s3 method to get a dataframe
+    return extract_json_data.extract_from_s3(json_s3_address)
 
-    # Clean the rest of the dataframe
-    cleaned_product_df = clean_product_data.clean_products_data(product_weight_kg_df)
+# the raw sources, each with the function that extracts it, the RDS tables being streamed in chunks
+RDS_SOURCES = ('legacy_users', 'orders_table')
+SOURCE_EXTRACTORS = {'legacy_users': lambda context: read_rds_chunks(context, context.users_table_name), 'card_details': extract_card_details,
+                     'store_details': extract_store_details, 'products': extract_products,
+                     'orders_table': lambda context: read_rds_chunks(context, context.orders_table_name), 'date_times': extract_date_times}
 
-    # upload to sales_data database using upload_to_db method in a table named dim_products
-    database_connector.upload_to_db(cleaned_product_df, "dim_products", 'my_creds.yaml')
+def source_version(context, source_name):
+    '''
+    This function returns a cheap version of a raw source without extracting it, used to fingerprint the load stages so a resumed run can tell whether their sources changed.
+    The RDS tables give their row count and last row number, the PDF and the S3 objects their ETag and Last-Modified, and the store API when it was cached.
 
-    return cleaned_product_df
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+        source_name (str): The source, a key of SOURCE_EXTRACTORS.
 
-def orders_data():
+    Returns:
+        list: The source's version and the cleaning options, or None if the source cannot be checked without extracting it.
     '''
-    This function retrieves, cleans, and uploads orders data from an AWS RDS into a new table in the sales_data database.
+    from data_extraction import DataExtractor
+
+    extractor = DataExtractor(cache=context.extraction_cache)
+    if source_name in RDS_SOURCES:
+        table_name = context.users_table_name if source_name == 'legacy_users' else context.orders_table_name
+        version = extractor.rds_table_version(table_name, context.rds_engine, context.rds_watermark_column)
+    elif source_name == 'card_details':
+        version = extractor.pdf_version(context.card_details_pdf)
+    elif source_name == 'store_details':
+        api_header_details = context.database_connector.read_db_creds(context.api_key_file)
+        version = extractor.stores_version(context.store_endpoint, extractor.list_number_of_stores(context.num_stores_endpoint, api_header_details))
+    else:
+        s3_file = context.products_s3_file if source_name == 'products' else context.dates_s3_file
+        version = extractor.s3_version(context.database_connector.read_db_creds(s3_file))
+    # the compact dtypes change what is loaded, and the integrity check which orders are loaded, so they are part of the version
+    options = [context.compact_dtypes] + ([context.integrity_check] if source_name == 'orders_table' else [])
+    return None if version is None else [version] + options
+
+def schema_version(context):
+    '''
+    This function returns the statements that create the typed tables, so the tables are created again, and everything loaded again, when the schema changes.
+    '''
+    import schema
+
+    return [statement for table_schema in schema.TABLE_SCHEMAS.values() for statement in schema.create_table_statements(table_schema)]
+
+def checkpointed_clean(context, stage_name, extract_and_clean):
+    '''
+    This function returns the cleaned rows of a load stage. A resumed stage reuses the cleaned output it kept last time if its source has not changed,
+    e.g. when it failed while uploading, so the source is not extracted and cleaned again. Otherwise the source is extracted and cleaned, and the output is kept.
+    Incremental loads keep nothing, as they only read what is new and each upsert commits its own watermark.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+        stage_name (str): The name of the load stage.
+        extract_and_clean (callable): Extracts and cleans the stage's source, returning the cleaned DataFrame.
 
     Returns:
-        pandas.DataFrame: A cleaned DataFrame containing orders data, which has also been uploaded to the "orders_table" table.
+        pandas.DataFrame: The cleaned DataFrame.
     '''
-    # get table name associated with orders 
-    orders_table_name = get_table_names[2]
+    import pandas as pd
+
+    checkpoints = context.checkpoints
+    if checkpoints is None or context.incremental:
+        return extract_and_clean()
+    if checkpoints.reusable_artifact(stage_name) is not None:
+        with context.tracer.span('restore', table=stage_name) as span:
+            clean_df = pd.concat(list(checkpoints.read_parts(stage_name)))
+            span.set_attribute('rows_out', len(clean_df))
+        return clean_df
+
+    clean_df = extract_and_clean()
+    checkpoints.start_artifact(stage_name)
+    checkpoints.write_part(stage_name, 0, clean_df)
+    checkpoints.complete_artifact(stage_name, parts=1, rows=len(clean_df))
+    return clean_df
+
+def extract_sources(context, source_names, clean=False, output_dir=None):
+    '''
+    This function extracts raw sources, and cleans them if asked, without uploading anything, e.g. to fill the extraction cache or to check the cleaning.
+    With an output directory, each source is written to <output_dir>/<source_name>/ as numbered Parquet parts, one for each RDS chunk.
 
-    # create instance of DataExtractor class 
-    extract_rds_data = DataExtractor()
-    rds_orders_df = extract_rds_data.read_rds_table(database_connector, orders_table_name, engine)
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+        source_names (list): The sources to extract, keys of SOURCE_EXTRACTORS.
+        clean (bool): Clean each source with its DatabaseCleaning method.
+        output_dir (str): The directory to write the raw or cleaned data to, or None to only count the rows.
 
-    # use it to clean the df and return clean df
-    clean_orders_df = DatabaseCleaning()
-    orders_df = clean_orders_df.clean_orders_data(rds_orders_df)
+    Returns:
+        dict: The number of rows written, or counted, for each source.
+    '''
+    from data_cleaning import clean_source_frame
+    from extraction_cache import parquet_ready
+
+    rows = {}
+    for source_name in source_names:
+        source = SOURCE_EXTRACTORS[source_name](context)
+        source_chunks = source if source_name in RDS_SOURCES else [source]
+        rows_in = rows[source_name] = 0
+        for part_number, source_df in enumerate(context.tracer.iterate('extract', source_chunks, table=source_name)):
+            if source_df.empty:
+                continue
+            rows_in += len(source_df)
+            if clean:
+                with context.tracer.span('clean', table=source_name) as span:
+                    span.set_attribute('rows_in', len(source_df))
+                    source_df = clean_source_frame(context.cleaner, source_name, source_df)
+                    span.set_attribute('rows_out', len(source_df))
+            rows[source_name] += len(source_df)
+            if output_dir is not None:
+                os.makedirs(os.path.join(output_dir, source_name), exist_ok=True)
+                parquet_ready(source_df).to_parquet(os.path.join(output_dir, source_name, f"part-{part_number:05d}.parquet"))
+        logger.info("Extracted %d rows of %s%s", rows_in, source_name, f", {rows[source_name]} left after cleaning" if clean else "")
+
+    return rows
+
+def upload_checked(context, checker, table_df, first_chunk):
+    '''
+    This function checks a chunk's foreign keys before it is uploaded, and adds any missing keys to the dimension tables when repairing,
+    or loads the orphans into <table>_quarantine when quarantining, which a full load empties on its first chunk.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+        checker (ReferentialIntegrityChecker): The checker for the table, with the dimension tables' keys loaded.
+        table_df (pandas.DataFrame): The chunk, mapped onto the table's columns.
+        first_chunk (bool): Whether this is the first chunk of the load.
 
-    # Upload to sales_data database using upload_to_db method in a table named orders_table
-    database_connector.upload_to_db(orders_df, "orders_table", 'my_creds.yaml')
+    Returns:
+        pandas.DataFrame: The rows to upload.
+    '''
+    with context.tracer.span('check', table=checker.table_schema.name) as span:
+        checked = checker.check(table_df)
+        span.set_attributes(rows_in=len(table_df), rows_out=len(checked.rows))
+    # the missing keys go in first, as the foreign keys already exist when the load is incremental
+    for references_table, keys_df in checked.missing_keys.items():
+        context.database_connector.upload_to_db(keys_df, references_table, context.sales_data_creds, if_exists='append')
+    if checked.orphans is not None and (len(checked.orphans) or (first_chunk and not context.incremental)):
+        if_exists = 'replace' if first_chunk and not context.incremental else 'append'
+        context.database_connector.upload_to_db(checked.orphans, f"{checker.table_schema.name}_quarantine", context.sales_data_creds, if_exists=if_exists)
+    return checked.rows
+
+def stream_clean_upload(context, table_name, clean_method, destination_table, conflict_columns=None, stage_name=None, checker=None):
+    '''
+    This function streams a table from the AWS RDS database in chunks, cleans each chunk and uploads it to the sales_data database, so peak memory depends on the chunk size rather than the table size.
+    In incremental mode only rows past the table's watermark are read, and each chunk is upserted together with its new watermark. The watermark is the RDS tables'
+    increasing row number, so an incremental load picks up the rows appended since the last load but not rows changed in place, which need a full load.
+    A full load keeps each cleaned chunk in the checkpoints, and a resumed load uploads the chunks it kept last time if the table has not changed, see checkpointed_clean.
 
-    return orders_df
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+        table_name (str): The name of the table in the RDS database.
+        clean_method (callable): The DatabaseCleaning method used to clean each chunk.
+        destination_table (str): The name of the table to upload to in the sales_data database.
+        conflict_columns (list): The primary key of the destination table used by incremental upserts, or None to only insert.
+        stage_name (str): The pipeline stage the cleaned chunks are kept for, or None not to keep them.
+        checker (ReferentialIntegrityChecker): Checks each chunk's foreign keys before it is uploaded, see upload_checked, or None not to check them.
 
-def date_data():
+    Returns:
+        int: The number of cleaned rows uploaded.
     '''
-    This function retrieves, cleans, and uploads orders data from a JSON file in s3 bucket into a new table in the sales_data database.
+    from schema import TABLE_SCHEMAS, prepare_frame
+
+    database_connector = context.database_connector
+    watermark_column = context.rds_watermark_column
+    rows_cleaned = rows_uploaded = 0
+    watermark_value = None
+
+    since = None
+    if context.incremental:
+        last_watermark = database_connector.read_watermark(table_name, context.sales_data_creds)
+        since = (watermark_column, None if last_watermark is None else int(last_watermark))
+
+    def clean_chunks():
+        rds_chunks = read_rds_chunks(context, table_name, since=since)
+        # each chunk's extract, clean and upload is timed in its own span
+        for rds_chunk_df in context.tracer.iterate('extract', rds_chunks, table=table_name):
+            # pandas yields a single empty chunk when there are no new rows
+            if rds_chunk_df.empty:
+                continue
+            with context.tracer.span('clean', table=table_name) as span:
+                clean_chunk_df = clean_method(rds_chunk_df)
+                span.set_attributes(rows_in=len(rds_chunk_df), rows_out=len(clean_chunk_df))
+            # the watermark comes from the raw chunk, so rows the cleaner dropped are not read again
+            yield int(rds_chunk_df[watermark_column].max()), clean_chunk_df
+
+    checkpoints = context.checkpoints if stage_name is not None and not context.incremental else None
+    artifact = checkpoints.reusable_artifact(stage_name) if checkpoints is not None else None
+    if artifact is not None:
+        # the chunks cleaned last time, which all carry the watermark the table was read up to
+        chunks = ((artifact['watermark'], clean_chunk_df) for clean_chunk_df in context.tracer.iterate('restore', checkpoints.read_parts(stage_name), table=table_name))
+    else:
+        chunks = clean_chunks()
+        if checkpoints is not None:
+            checkpoints.start_artifact(stage_name)
+
+    chunk_number = -1
+    for chunk_number, (chunk_watermark, clean_chunk_df) in enumerate(chunks):
+        # a full load reads the table in no particular order, so the watermark is the highest seen in any chunk so far
+        watermark_value = chunk_watermark if watermark_value is None else max(watermark_value, chunk_watermark)
+        if checkpoints is not None and artifact is None:
+            checkpoints.write_part(stage_name, chunk_number, clean_chunk_df)
+        with context.tracer.span('upload', table=destination_table) as span:
+            span.set_attribute('rows_in', len(clean_chunk_df))
+            table_df = prepare_frame(TABLE_SCHEMAS[destination_table], clean_chunk_df)
+            if checker is not None:
+                table_df = upload_checked(context, checker, table_df, first_chunk=chunk_number == 0)
+            if context.incremental:
+                watermark = (table_name, watermark_column, watermark_value)
+                database_connector.upsert_to_db(table_df, destination_table, context.sales_data_creds, conflict_columns, watermark=watermark)
+            else:
+                # the first chunk empties the typed table and the rest are appended to it
+                if_exists = 'truncate' if chunk_number == 0 else 'append'
+                database_connector.upload_to_db(table_df, destination_table, context.sales_data_creds, if_exists=if_exists)
+        rows_cleaned += len(clean_chunk_df)
+        rows_uploaded += len(table_df)
+
+    if checkpoints is not None and artifact is None:
+        checkpoints.complete_artifact(stage_name, parts=chunk_number + 1, rows=rows_cleaned, watermark=watermark_value)
+
+    # a full load records where it got to, so the next incremental load starts from there
+    if not context.incremental and watermark_value is not None:
+        database_connector.write_watermark(table_name, watermark_column, watermark_value, context.sales_data_creds)
+
+    return rows_uploaded
+
+def user_data(context):
+    '''
+    This function retrieves, cleans, and uploads user data from an AWS RDS database to a new table in the sales_data database.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
 
     Returns:
-        pandas.DataFrame: A cleaned DataFrame containing date data, which has also been uploaded to the "dim_date_times" table.
+        int: The number of cleaned rows of user data uploaded to the "dim_users" table.
     '''
-    # create a DataExtractor instance
-    extract_json_data = DataExtractor()
+    # Get the users table name
+    legacy_users_table_name = context.users_table_name
 
-    # Use read_db_creds method to get link to json object
-    json_s3_address = database_connector.read_db_creds('json_s3_url.yaml')
+    # Use the run's DatabaseCleaning, or its ParallelCleaner when --clean-workers is more than 1
+    clean_user = context.cleaner
 
-    # use extract_from_s3 method to get a dataframe
-    date_time_details_df = extract_json_data.extract_from_s3(json_s3_address)
+    # Read the RDS table chunk by chunk, clean each chunk with clean_user_data() and upload it to dim_users
+    return stream_clean_upload(context, legacy_users_table_name, clean_user.clean_user_data, "dim_users", conflict_columns=["user_uuid"], stage_name='user_data')
 
-    # Clean the data using clean_date_data 
-    date_cleaning = DatabaseCleaning()
-    clean_date_df = date_cleaning.clean_date_data(date_time_details_df)
+def card_data(context):
+    '''
+    This function retrieves, cleans, and uploads card data from a PDF document in an AWS S3 bucket into a new table in the sales_data database.
 
-    # Upload to sales_data database using upload_to_db method in a table named dim_date_times
-    database_connector.upload_to_db(clean_date_df, "dim_date_times", 'my_creds.yaml')
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
 
-    return clean_date_df
+    Returns:
+        pandas.DataFrame: A cleaned DataFrame containing card data, which has also been uploaded to the "dim_card_details" table.
+    '''
+    from schema import TABLE_SCHEMAS, prepare_frame
+
+    def extract_and_clean():
+        # takes in uncleaned df as arg, sets it to cleaned_df variable
+        with context.tracer.span('extract', table='card_details') as span:
+            card_details_df = extract_card_details(context)
+            span.set_attribute('rows_out', len(card_details_df))
+
+        # Create Cleaning instanct
+        card_cleaning = context.cleaner
+        # Use clean_card_data method to clean df
+        with context.tracer.span('clean', table='card_details') as span:
+            clean_card_df = card_cleaning.clean_card_data(card_details_df)
+            span.set_attributes(rows_in=len(card_details_df), rows_out=len(clean_card_df))
+        return clean_card_df
+
+    # a resumed run reuses the cleaned cards it kept last time if the PDF has not changed
+    clean_card_df = checkpointed_clean(context, 'card_data', extract_and_clean)
+
+    with context.tracer.span('upload', table='dim_card_details') as span:
+        table_df = prepare_frame(TABLE_SCHEMAS["dim_card_details"], clean_card_df)
+        if context.incremental:
+            # the PDF is read in full every time and a card's confirmation date is not when it was added to it, so only the cards
+            # whose number is not loaded yet or whose details changed are upserted, keyed on card_number
+            table_df = context.database_connector.changed_rows(table_df, "dim_card_details", context.sales_data_creds, ["card_number"])
+            context.database_connector.upsert_to_db(table_df, "dim_card_details", context.sales_data_creds, ["card_number"])
+        else:
+            # upload to the dim_card_details table in SQAlchemy sales_data database
+            context.database_connector.upload_to_db(table_df, "dim_card_details", context.sales_data_creds, if_exists='truncate')
+        span.set_attribute('rows_in', len(clean_card_df))
+    
+    return clean_card_df
 
-def execute_schema_sql_file(creds, file_path):
+def stores_data(context):
     '''
-    This function takes the SQL script from the given file to create the database schema.
+    This function retrieves, cleans, and uploads stores data using an API into a new table in the sales_data database.
 
     Args:
-        creds (str): PostgreSQL connection string.
-        file_path (str): Path to the SQL script file.
+        context (PipelineContext): The connectors and configuration for the run.
 
     Returns:
-        None
+        pandas.DataFrame: A cleaned DataFrame containing store data, which has also been uploaded to the "dim_store_details" table.
     '''
-    with open(file_path, 'r') as sql_file:
-        sql_script = sql_file.read()
-    conn = psycopg2.connect(creds)
+    from schema import TABLE_SCHEMAS, prepare_frame
+
+    def extract_and_clean():
+        # The store data can be retrieved through the use of an API, see extract_store_details
+        with context.tracer.span('extract', table='store_details') as span:
+            store_info_df = extract_store_details(context)
+            span.set_attribute('rows_out', len(store_info_df))
 
-    try:
-        # Create a cursor object
-        cursor = conn.cursor()
-        # Execute the SQL script
-        cursor.execute(sql_script)
-        # Commit the changes
-        conn.commit()
-        print("SQL script 'create_schema' executed successfully.")
+        # clean stores_df
+        store_cleaning = context.cleaner
+        with context.tracer.span('clean', table='store_details') as span:
+            clean_store_df = store_cleaning.clean_store_data(store_info_df)
+            span.set_attributes(rows_in=len(store_info_df), rows_out=len(clean_store_df))
+        return clean_store_df
 
-    except Exception as e:
-        print(f"Error executing 'create_schema' SQL script: {e}")
+    clean_store_df = checkpointed_clean(context, 'stores_data', extract_and_clean)
 
-    finally:
-        # Close the cursor and connection
-        cursor.close()
-        conn.close()
+    # Upload to the dim_store_details table in SQAlchemy sales_data database
+    with context.tracer.span('upload', table='dim_store_details') as span:
+        span.set_attribute('rows_in', len(clean_store_df))
+        context.database_connector.upload_to_db(prepare_frame(TABLE_SCHEMAS["dim_store_details"], clean_store_df), "dim_store_details", context.sales_data_creds, if_exists='truncate')
+
+    return clean_store_df
 
-def execute_query_sql_file(creds, file_path):
+def product_data(context):
     '''
-    This function takes the SQL script from the given file and prints the results of the queries.
+    This function retrieves, cleans, and uploads product data from a csv file in an s3 bucket into a new table in the sales_data database.
 
     Args:
-        creds (str): PostgreSQL connection string.
-        file_path (str): Path to the SQL script file.
+        context (PipelineContext): The connectors and configuration for the run.
 
     Returns:
-        None
-    
+        pandas.DataFrame: A cleaned DataFrame containing product data, which has also been uploaded to the "dim_products" table.
     '''
-    # Open the SQL file to read mode
-    with open(file_path, 'r') as sql_file:
-        sql_script = sql_file.read()
-    
-    # Set up connection
-    conn = psycopg2.connect(creds)
-
-    try:
-        # Create a cursor object
-        cursor = conn.cursor()
-        # Split SQL script into individual statements
-        sql_commands = sql_script.split(';')
-        print("QUERIES: Q1. Returns the number of stores the business has in each country. Q2. Returns the top five locations which have the most stores. Q3. Returns the top 5 months that produced the largest number of sales. Q4. Returns the  amount made [0], number of products sold [1] for online and offline [3] purchases. Q5. Returns for each store type [0] the total sales [1] and percentage of sales [2] which came through. (Visualised with a pie chart too!) Q6. Returns the top 5 months [2] and years [1] in history that made the most amount is sales [0]. Q7. Returns staff headcount [0] by country [1]. Q8. Returns which 5 German [2] store types [1] have the highest total_sales [0]. Q9. The average time taken between each sale [1] grouped by year [0].")
-        query_number = 1
-
-        for command in sql_commands:
-            # Skip empty statements
-            if not command.strip():
-                continue
+    from schema import TABLE_SCHEMAS, prepare_frame
+
+    def extract_and_clean():
+        # use the extract_from_s3 method to input the s3 address and return a dataframe
+        with context.tracer.span('extract', table='products') as span:
+            precleaned_product_df = extract_products(context)
+            span.set_attribute('rows_out', len(precleaned_product_df))
+
+        clean_product_data = context.cleaner
+        with context.tracer.span('clean', table='products') as span:
+            # Use convert_product_weights method to convert weights column to same unit (kg)
+            product_weight_kg_df = clean_product_data.convert_product_weights(precleaned_product_df)
+
+            # Clean the rest of the dataframe
+            cleaned_product_df = clean_product_data.clean_products_data(product_weight_kg_df)
+            span.set_attributes(rows_in=len(precleaned_product_df), rows_out=len(cleaned_product_df))
+        return cleaned_product_df
 
-            try:
-                # Execute the SQL command
-                cursor.execute(command)
-                # Fetch results for sql statements regardless of case
-                if command.strip().upper().startswith("SELECT") or command.strip().upper().startswith("WITH"):
-                    data = cursor.fetchall()
-                    print(f"Query {query_number} result:")
-                    print(data)
-                    # Increase Q number
-                    query_number += 1
+    cleaned_product_df = checkpointed_clean(context, 'product_data', extract_and_clean)
 
-            except Exception as e:
-                print(f"Error executing SQL command: {e}")
+    # upload to sales_data database using upload_to_db method in a table named dim_products
+    with context.tracer.span('upload', table='dim_products') as span:
+        span.set_attribute('rows_in', len(cleaned_product_df))
+        product_table_df = prepare_frame(TABLE_SCHEMAS["dim_products"], cleaned_product_df)
+        if context.incremental:
+            # the orders' foreign key stops dim_products being emptied, so the products not loaded yet or changed since are upserted on product_code
+            product_table_df = context.database_connector.changed_rows(product_table_df, "dim_products", context.sales_data_creds, ["product_code"])
+            context.database_connector.upsert_to_db(product_table_df, "dim_products", context.sales_data_creds, ["product_code"])
+        else:
+            context.database_connector.upload_to_db(product_table_df, "dim_products", context.sales_data_creds, if_exists='truncate')
+
+    return cleaned_product_df
+
+def orders_data(context):
+    '''
+    This function retrieves, cleans, and uploads orders data from an AWS RDS into a new table in the sales_data database.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+
+    Returns:
+        int: The number of cleaned rows of orders data uploaded to the "orders_table" table.
+    '''
+    # get table name associated with orders 
+    orders_table_name = context.orders_table_name
 
-        # Commit the changes
-        conn.commit()
+    # use it to clean the df and return clean df
+    clean_orders_df = context.cleaner
+
+    # with --integrity-check, each chunk's foreign keys are checked against the dimension tables, which this stage then waits for
+    checker = None
+    if context.integrity_check is not None:
+        from integrity import ReferentialIntegrityChecker
+        checker = context.integrity_checker = ReferentialIntegrityChecker('orders_table', action=context.integrity_check)
+        checker.load_keys(context.sales_data_engine)
+
+    # Stream the orders table through clean_orders_data and upload it chunk by chunk to a table named orders_table
+    rows_uploaded = stream_clean_upload(context, orders_table_name, clean_orders_df.clean_orders_data, "orders_table", stage_name='orders_data', checker=checker)
+    if checker is not None:
+        checker.log_report()
+    return rows_uploaded
+
+def date_data(context):
+    '''
+    This function retrieves, cleans, and uploads orders data from a JSON file in s3 bucket into a new table in the sales_data database.
 
-        print("SQL script 'business_queries' executed successfully.")
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
 
-    except Exception as e:
-        print(f"Error executing 'business_queries' SQL script: {e}")
+    Returns:
+        pandas.DataFrame: A cleaned DataFrame containing date data, which has also been uploaded to the "dim_date_times" table.
+    '''
+    from schema import TABLE_SCHEMAS, prepare_frame
+
+    def extract_and_clean():
+        # use extract_from_s3 method to get a dataframe
+        with context.tracer.span('extract', table='date_times') as span:
+            date_time_details_df = extract_date_times(context)
+            span.set_attribute('rows_out', len(date_time_details_df))
+
+        # Clean the data using clean_date_data
+        date_cleaning = context.cleaner
+        with context.tracer.span('clean', table='date_times') as span:
+            clean_date_df = date_cleaning.clean_date_data(date_time_details_df)
+            span.set_attributes(rows_in=len(date_time_details_df), rows_out=len(clean_date_df))
+        return clean_date_df
+
+    clean_date_df = checkpointed_clean(context, 'date_data', extract_and_clean)
+
+    with context.tracer.span('upload', table='dim_date_times') as span:
+        span.set_attribute('rows_in', len(clean_date_df))
+        date_table_df = prepare_frame(TABLE_SCHEMAS["dim_date_times"], clean_date_df)
+        if context.incremental:
+            # the date events have no ordering column, so upsert on date_uuid and events already loaded are updated rather than duplicated
+            context.database_connector.upsert_to_db(date_table_df, "dim_date_times", context.sales_data_creds, ["date_uuid"])
+        else:
+            # Upload to sales_data database using upload_to_db method in a table named dim_date_times
+            context.database_connector.upload_to_db(date_table_df, "dim_date_times", context.sales_data_creds, if_exists='truncate')
 
-    finally:
-        # Close the cursor and connection
-        cursor.close()
-        conn.close()
+    return clean_date_df
 
 def storetype_sales_piechart():
     '''
@@ -256,6 +655,9 @@ def storetype_sales_piechart():
     Returns:
         None
     '''
+    import matplotlib.pyplot as plt
+    import numpy as np
+
     fig = plt.figure()
     # Add figure axes
     ax = fig.add_axes([0,0,1,1])
@@ -272,64 +674,259 @@ def storetype_sales_piechart():
     plt.show()
 
 
-if __name__ == "__main__":
-    ### 1. Creating a connection to the AWS database
-
-    # Create an instance of DatabaseConnector class
-    database_connector = DatabaseConnector()
-    # Use read_db_creds mehtod to return yaml credentials in useable format
-    yaml_creds = database_connector.read_db_creds('db_creds.yaml')
-    # Use these credentials to create an SQLAlchemy database engire to connect to the RDS
-    engine = database_connector.init_db_engine('db_creds.yaml')
-    # List the table names that are in the AWS RDS database
-    get_table_names = database_connector.list_db_tables('db_creds.yaml')
-    #print(get_table_names) # ['legacy_store_details', 'legacy_users', 'orders_table']
-
-    ### 2. Retrive, clean and upload the user data from an AWS database in the cloud.
-    user_data()
-    ### 3. Retrive, clean and upload the card data from a PDF document in an AWS S3 bucket
-    card_data()
-    ### 4. Extract, clean and upload store details using an API
-    '''The store data can be retrieved through the use of an API.
-    The API has two GET methods. One will return the number of stores in the business and the other to retrieve a store given a store number.
+def create_tables(context):
+    '''
+    This function creates the destination tables with their final column types from the schema in schema.py, so the data is loaded already typed.
 
-    The two endpoints for the API are as follows:
-    Retrieve a store: https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/store_details/{store_number}
-    Return the number of stores: https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/number_stores'''
-    # Use read_db_creds method to read yaml file with api key
-    api_header_details = database_connector.read_db_creds('api_key.yaml')
-    num_of_stores_endpoint = "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/number_stores"
-    api_retrieval = DataExtractor()
-    # Use the list_number_of_stores method to get the number of total stores
-    total_stores = api_retrieval.list_number_of_stores(num_of_stores_endpoint, api_header_details)
-    #print(total_stores) # 451
-    stores_data()
-    ### 5. Extract, edit, clean and upload data from product details from csv file in s3 bucket
-    product_data()
-    ### 6. Retrieve orders table from AWS RDS
-    orders_data()
-    ### 7. Retrieve, clean and upload date events data from JSON file in s3 bucket.
-    date_data()   
-
-    ### 8. Create the Database Schema
-    # This will be run using the create_schema.sql file and includes casting column datatypes, adding descriptive columns, assigning primary and foreign keys.
-
-    # Create connection to postgresql
-    postgres_creds = database_connector.read_db_creds('my_creds.yaml')
-    connection_str = f"host={postgres_creds['HOST']} dbname={postgres_creds['DATABASE']} user={postgres_creds['USER']} password={postgres_creds['PASSWORD']}"
-
-    # Specify SQL file
-    schema_sql_file_path = 'sql_files/essential_queries/create_schema.sql'
-    # Run function to create the schema
-    execute_schema_sql_file(connection_str, schema_sql_file_path)
-
-    ### 9. Query the Database  
-    # Answering business questions about sales 
-
-    # Specify SQL file
-    query_sql_file_path = 'sql_files/essential_queries/business_queries_copy.sql'
-    # Run function to query the database
-    execute_query_sql_file(connection_str, query_sql_file_path)
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+    '''
+    import schema
+
+    schema.create_tables(context.sales_data_engine)
+
+def create_schema(context):
+    '''
+    This function completes the database schema once the tables are loaded, adding the web portal store, the primary keys and the foreign keys.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+    '''
+    import schema
+
+    # orphans the orders load only reported would make the foreign keys fail, so stop before adding any of the keys
+    checker = context.integrity_checker
+    if checker is not None and checker.action == 'report' and checker.orphan_rows:
+        broken = [name for name, report in checker.reports.items() if report.orphan_rows]
+        raise ValueError(f"orders_table has orphans for {', '.join(broken)}, run again with --integrity-check quarantine or repair")
+
+    schema.add_constraints(context.sales_data_engine)
+
+def create_indexes(context):
+    '''
+    This function builds the indexes the business queries need once the tables are loaded, in parallel, and updates the planner statistics.
+    A full run builds them on the freshly loaded tables, while an incremental run only builds missing ones, without blocking writes.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+    '''
+    import schema
+
+    schema.create_indexes(context.sales_data_engine, concurrently=context.incremental)
+
+def build_rollups(context):
+    '''
+    This function refreshes the sales rollup the business queries are answered from, rebuilding it after a full load and adding the new orders after an incremental one.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+
+    Returns:
+        int: The number of orders added to the rollup.
+    '''
+    from rollups import check_rollups, refresh_rollups
+
+    with context.tracer.span('refresh', table='sales_rollup') as span:
+        orders_added = refresh_rollups(context.database_connector, context.sales_data_creds, full=not context.incremental)
+        span.set_attribute('rows_in', orders_added)
+
+    if context.check_rollups:
+        mismatches = check_rollups(context.sales_data_engine, context.query_sql_file_path, context.rollup_query_sql_file_path)
+        if mismatches:
+            raise ValueError(f"The sales rollup does not match the raw tables for queries {mismatches}")
+
+    return orders_added
+
+# what each business query answers, the numbers in brackets are column positions
+QUERY_DESCRIPTIONS = "QUERIES: Q1. Returns the number of stores the business has in each country. Q2. Returns the top five locations which have the most stores. Q3. Returns the top 5 months that produced the largest number of sales. Q4. Returns the  amount made [0], number of products sold [1] for online and offline [3] purchases. Q5. Returns for each store type [0] the total sales [1] and percentage of sales [2] which came through. (Visualised with a pie chart too!) Q6. Returns the top 5 months [2] and years [1] in history that made the most amount is sales [0]. Q7. Returns staff headcount [0] by country [1]. Q8. Returns which 5 German [2] store types [1] have the highest total_sales [0]. Q9. The average time taken between each sale [1] grouped by year [0]."
+
+def business_queries(context):
+    '''
+    This function answers the business questions about sales by running the business_queries_rollup.sql file, or business_queries.sql on the raw tables.
+    The independent queries run in parallel, and each query's rows, row count and time taken are printed.
+
+    Args:
+        context (PipelineContext): The connectors and configuration for the run.
+
+    Returns:
+        list: A QueryResult for each statement, holding its rows as a DataFrame.
+    '''
+    from query_runner import QueryRunner, print_results
+
+    query_sql_file_path = context.rollup_query_sql_file_path if context.use_rollups else context.query_sql_file_path
+    if context.plan_check:
+        from plan_check import check_plans
+        failed_checks = [check.query_number for check in check_plans(context.sales_data_engine, query_sql_file_path, context.plan_baseline) if check.problems]
+        if failed_checks:
+            raise ValueError(f"The plans of queries {failed_checks} failed the plan check")
+    runner = QueryRunner(context.sales_data_engine, explain=context.explain_queries, tracer=context.tracer)
+    results = runner.run_file(query_sql_file_path)
+    print(QUERY_DESCRIPTIONS)
+    print_results(results)
+
+    return results
+
+# stages left out of incremental runs: the store and product tables are small and are referenced by foreign keys,
+# so they are only reloaded by a full run, and the tables are only recreated and given their keys by a full run
+INCREMENTAL_SKIP = ['create_tables', 'stores_data', 'product_data', 'create_schema']
+
+# the extract, clean and upload stages, each with the raw source it loads, the orders last as they may wait for the others
+LOAD_STAGES = {'user_data': (user_data, 'legacy_users'), 'card_data': (card_data, 'card_details'), 'stores_data': (stores_data, 'store_details'),
+               'product_data': (product_data, 'products'), 'date_data': (date_data, 'date_times'), 'orders_data': (orders_data, 'orders_table')}
+
+# the stages loading the tables orders_table references, which the orders load waits for when its foreign keys are checked
+DIMENSION_STAGES = ('user_data', 'card_data', 'stores_data', 'product_data', 'date_data')
+
+def build_pipeline(max_workers=4, integrity_check=False):
+    '''
+    This function declares the stages of the ETL run and their dependencies.
+    The typed tables are created first, the six extract, clean and upload stages share no inputs so they can run in parallel,
+    and the keys are added and the indexes built once all of them have loaded. The sales rollup is then refreshed from the loaded orders and the business queries are answered from it.
+    Each load stage is fingerprinted by the version of its source, so a resumed run only loads the sources that changed, and the stages after them.
+
+    Args:
+        max_workers (int): The number of stages that may run at the same time.
+        integrity_check (bool): Load the orders after the dimension tables, so their foreign keys can be checked against them before they are uploaded.
+
+    Returns:
+        Pipeline: The pipeline of ETL stages.
+    '''
+    pipeline = Pipeline(max_workers=max_workers)
+    pipeline.add_stage('create_tables', create_tables, fingerprint=schema_version)
+    for name, (function, source_name) in LOAD_STAGES.items():
+        depends_on = ('create_tables',) + (DIMENSION_STAGES if integrity_check and name == 'orders_data' else ())
+        pipeline.add_stage(name, function, depends_on=depends_on, fingerprint=lambda context, source_name=source_name: source_version(context, source_name))
+    load_stages = tuple(LOAD_STAGES)
+    # a load after the keys have been added needs the tables created again, as the keyed tables cannot be truncated
+    pipeline.add_stage('create_schema', create_schema, depends_on=load_stages, resets=('create_tables',))
+    pipeline.add_stage('create_indexes', create_indexes, depends_on=load_stages + ('create_schema',))
+    pipeline.add_stage('build_rollups', build_rollups, depends_on=load_stages + ('create_schema',))
+    pipeline.add_stage('business_queries', business_queries, depends_on=('create_schema', 'create_indexes', 'build_rollups'))
+
+    return pipeline
+
+# the names of the stages build_pipeline declares, in order, which --only and --skip choose from before the pipeline is built
+STAGE_NAMES = ['create_tables', *LOAD_STAGES, 'create_schema', 'create_indexes', 'build_rollups', 'business_queries']
+
+# the stages each subcommand runs, running the whole pipeline if no subcommand is given
+COMMAND_STAGES = {'load': ['create_tables', 'user_data', 'card_data', 'stores_data', 'product_data', 'orders_data', 'date_data'],
+                  'schema': ['create_schema', 'create_indexes', 'build_rollups'],
+                  'query': ['business_queries']}
+
+def parse_args(stage_names, args=None):
+    '''
+    This function reads the command line options for the ETL run. The options before the subcommand apply to all of them.
+
+    Args:
+        stage_names (list): The names of the stages that can be selected.
+        args (list): The arguments to parse, sys.argv[1:] if None.
+
+    Returns:
+        argparse.Namespace: The parsed options, with command None when no subcommand is given.
+    '''
+    parser = argparse.ArgumentParser(description="Extract, clean and upload the retail data to the sales_data database, then create the schema and query it.")
+    parser.add_argument('--only', nargs='+', choices=stage_names, help="run just these stages")
+    parser.add_argument('--skip', nargs='+', choices=stage_names, help="stages not to run")
+    parser.add_argument('--workers', type=int, default=4, help="number of stages to run at the same time")
+    parser.add_argument('--no-chart', action='store_true', help="do not show the store type pie chart")
+    parser.add_argument('--incremental', action='store_true', help="load only rows added since the last run and upsert them into the existing tables")
+    parser.add_argument('--cache-dir', default='.extraction_cache', help="directory for the local Parquet cache of raw PDF, S3 and API extractions")
+    parser.add_argument('--no-cache', action='store_true', help="always download the sources instead of using the local cache")
+    parser.add_argument('--raw-queries', action='store_true', help="answer the business queries from the raw tables instead of the sales rollup")
+    parser.add_argument('--check-rollups', action='store_true', help="check that the sales rollup gives the same answers as the raw tables")
+    parser.add_argument('--explain', action='store_true', help="capture EXPLAIN (ANALYZE, BUFFERS) for each business query")
+    parser.add_argument('--plan-check', action='store_true', help="fail if a business query's plan sequentially scans a large table or has regressed")
+    parser.add_argument('--plan-baseline', default='plan_baseline.json', help="JSON file of baseline query costs for --plan-check")
+    parser.add_argument('--compact-dtypes', action='store_true', help="clean to categoricals, Arrow strings and small integers to use less memory")
+    parser.add_argument('--clean-workers', type=int, default=1, help="number of processes large frames are cleaned on")
+    parser.add_argument('--integrity-check', choices=['report', 'quarantine', 'repair'],
+                        help="check the orders' foreign keys against the loaded dimension tables before uploading them, and report the orphans, load them into orders_table_quarantine instead, or add their missing keys to the dimension tables")
+    parser.add_argument('--resume', action='store_true', help="skip the stages that finished last time on unchanged inputs and restart from the first one that failed")
+    parser.add_argument('--checkpoint-dir', default='.checkpoints', help="directory for the run's checkpoint manifest and the cleaned output kept for --resume")
+    parser.add_argument('--no-checkpoints', action='store_true', help="do not record the run's checkpoints")
+    parser.add_argument('--sales-data-creds', default='my_creds.yaml', help="YAML credentials for the sales_data database")
+    parser.add_argument('--trace-file', help="JSON lines file the run's spans are appended to")
+    parser.add_argument('--prometheus-file', help="Prometheus textfile the run's per-step metrics are written to")
+
+    commands = parser.add_subparsers(dest='command', metavar='command', help="the part of the run to do, all of it if not given")
+    commands.add_parser('run', help="extract, clean and load every source, then create the schema and answer the business queries")
+    for name, verb in (('extract', "extract"), ('clean', "extract and clean")):
+        command = commands.add_parser(name, help=f"{verb} the sources without uploading them")
+        command.add_argument('--sources', nargs='+', choices=list(SOURCE_EXTRACTORS), default=list(SOURCE_EXTRACTORS), help="the sources to " + verb)
+        command.add_argument('--output-dir', help="write each source to Parquet files in this directory")
+    commands.add_parser('load', help="extract, clean and upload the sources to the typed tables")
+    commands.add_parser('schema', help="add the keys and indexes and refresh the sales rollup")
+    commands.add_parser('query', help="answer the business queries")
+    commands.add_parser('chart', help="show the store type pie chart")
+
+    parsed_args = parser.parse_args(args)
+    if parsed_args.resume and parsed_args.no_checkpoints:
+        parser.error("--resume needs the checkpoints of the last run, so it cannot be used with --no-checkpoints")
+    return parsed_args
+
+def select_stages(args):
+    '''
+    This function works out the --only and --skip lists for the pipeline from the subcommand and the options.
+    An incremental run also skips the stages in INCREMENTAL_SKIP, unless they were asked for with --only.
+
+    Args:
+        args (argparse.Namespace): The parsed options.
+
+    Returns:
+        tuple: The only and skip lists.
+    '''
+    only = args.only
+    if args.command in COMMAND_STAGES:
+        only = [name for name in COMMAND_STAGES[args.command] if not args.only or name in args.only]
+    skip = args.skip or []
+    if args.incremental:
+        skip = skip + [name for name in INCREMENTAL_SKIP if name not in skip and not (args.only and name in args.only)]
+    return only, skip
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args(STAGE_NAMES)
+    pipeline = build_pipeline(max_workers=args.workers, integrity_check=args.integrity_check is not None)
+
+    if args.command == 'chart':
+        storetype_sales_piechart()
+        raise SystemExit(0)
+
+    # imported here, so --help and the chart do not load the database drivers
+    from database_utils import DatabaseConnector
+
+    ### 1. Creating the connectors, engines are created when a stage first needs them and reused after that
+    with DatabaseConnector() as database_connector:
+        extraction_cache = None
+        if not args.no_cache and args.command not in ('schema', 'query'):
+            from extraction_cache import ExtractionCache
+            extraction_cache = ExtractionCache(args.cache_dir)
+        checkpoints = None
+        if not args.no_checkpoints and args.command not in ('extract', 'clean'):
+            from checkpoints import CheckpointStore
+            checkpoints = CheckpointStore(args.checkpoint_dir)
+        context = PipelineContext(database_connector, sales_data_creds=args.sales_data_creds, incremental=args.incremental, extraction_cache=extraction_cache, tracer=pipeline.tracer,
+                                  use_rollups=not args.raw_queries, check_rollups=args.check_rollups, explain_queries=args.explain,
+                                  plan_check=args.plan_check, plan_baseline=args.plan_baseline, compact_dtypes=args.compact_dtypes, clean_workers=args.clean_workers,
+                                  checkpoints=checkpoints, integrity_check=args.integrity_check)
+        only, skip = select_stages(args)
+
+        ### 2. Retrieve, clean and upload the user, card, store, product, orders and date data in parallel,
+        ### then create the database schema and query the database
+        try:
+            if args.command in ('extract', 'clean'):
+                extract_sources(context, args.sources, clean=args.command == 'clean', output_dir=args.output_dir)
+            else:
+                pipeline.run(context, only=only, skip=skip, checkpoints=checkpoints, resume=args.resume)
+        finally:
+            context.close()
+            # the spans are kept even if a stage failed, to see where the run went wrong
+            pipeline.tracer.print_summary()
+            if args.trace_file:
+                pipeline.tracer.export_json_lines(args.trace_file)
+            if args.prometheus_file:
+                pipeline.tracer.write_prometheus(args.prometheus_file)
 
     # Here's a visual representation of the result of queary 5: What percentage of sales come through each type of store?
-    storetype_sales_piechart()
+    if args.command not in ('extract', 'clean') and 'business_queries' in pipeline.select_stages(only, skip) and not args.no_chart:
+        storetype_sales_piechart()
@@ -0,0 +1,273 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import threading
+import pandas as pd
+import pyarrow as pa
+
+from data_cleaning import DatabaseCleaning
+from extraction_cache import parquet_ready
+from tracing import Tracer, current_span
+
+''' Runs the DatabaseCleaning methods on several cores. A large frame is split into row partitions, each partition is
+cleaned by a worker process and the cleaned partitions are put back together in their original order. The partitions
+travel to and from the workers as Arrow IPC streams in shared memory, so they are not pickled. The weight imputation
+of the products, which needs the mean of every row, is done in two phases: each worker returns the sum and count of
+its weights with its partition, and the missing weights are filled once all the partial totals have been added up.'''
+
+# the cleaner each worker process builds for itself, keyed by compact
+_worker_cleaners = {}
+
+def _write_shared(frame_df):
+    '''
+    This function writes a DataFrame, with its index, as an Arrow IPC stream into a new block of shared memory.
+
+    Returns:
+        tuple: the name of the block and the size of the stream in bytes. The reader unlinks the block.
+    '''
+    table = pa.Table.from_pandas(parquet_ready(frame_df), preserve_index=True)
+    # measure the stream first, so the block is made the right size
+    counter = pa.MockOutputStream()
+    with pa.ipc.new_stream(counter, table.schema) as stream:
+        stream.write_table(table)
+    size = counter.size()
+
+    shared_block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        buffer = pa.py_buffer(shared_block.buf)
+        writer = pa.FixedSizeBufferWriter(buffer)
+        with pa.ipc.new_stream(writer, table.schema) as stream:
+            stream.write_table(table)
+        writer.close()
+        # the block cannot be closed while Arrow still holds a view of it
+        del stream, writer, buffer
+    except BaseException:
+        shared_block.close()
+        shared_block.unlink()
+        raise
+    shared_block.close()
+    return shared_block.name, size
+
+def _read_shared(name, size):
+    '''
+    This function reads a DataFrame written by _write_shared and unlinks its block of shared memory.
+    '''
+    shared_block = shared_memory.SharedMemory(name=name)
+    try:
+        # one copy out of the block, so the DataFrame does not depend on memory that is about to be freed
+        stream_bytes = bytes(shared_block.buf[:size])
+    finally:
+        shared_block.close()
+        shared_block.unlink()
+    table = pa.ipc.open_stream(pa.py_buffer(stream_bytes)).read_all()
+    frame_df = table.to_pandas()
+    # Arrow gives object columns holding numbers back as numbers, so they are made object columns again
+    object_columns = [column['name'] for column in table.schema.pandas_metadata['columns']
+                      if column['numpy_type'] == 'object' and column['name'] in frame_df.columns and frame_df[column['name']].dtype != object]
+    return frame_df.astype({column: object for column in object_columns}) if object_columns else frame_df
+
+def _discard_shared(name):
+    '''
+    This function unlinks a block of shared memory that will not be read, e.g. after another partition failed.
+    '''
+    try:
+        shared_block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shared_block.close()
+    shared_block.unlink()
+
+def _clean_partition(method_name, compact, name, size, totals_method=None):
+    '''
+    This function runs in a worker process. It cleans one partition with a DatabaseCleaning method and writes the result back to shared memory.
+
+    Args:
+        method_name (str): the DatabaseCleaning method, e.g. 'clean_user_data'.
+        compact (bool): clean to the compact dtypes.
+        name (str): the shared memory block holding the partition.
+        size (int): the size of the partition's IPC stream.
+        totals_method (str): a DatabaseCleaning method returning the partition's partial totals, if the table has a whole-frame step.
+
+    Returns:
+        tuple: the name and size of the block holding the cleaned partition, its partial totals or None, and the rows each cleaning mask dropped.
+    '''
+    if compact not in _worker_cleaners:
+        _worker_cleaners[compact] = DatabaseCleaning(compact=compact)
+    cleaner = _worker_cleaners[compact]
+
+    # the cleaning plans record the rows they drop on the current span, which in a worker is this one, so they are sent back with the partition
+    with Tracer().span('clean_partition') as span:
+        clean_df = getattr(cleaner, method_name)(_read_shared(name, size))
+    rows_dropped = {key: value for key, value in span.attributes.items() if key.startswith('rows_dropped_by_')}
+    totals = getattr(cleaner, totals_method)(clean_df) if totals_method is not None else None
+    return _write_shared(clean_df), totals, rows_dropped
+
+def _concat_partitions(partitions):
+    '''
+    This function puts cleaned partitions back together in order. Categorical columns get the union of every partition's categories,
+    as pandas would otherwise fall back to object columns where the partitions saw different values.
+    '''
+    for column in partitions[0].columns:
+        dtypes = [partition[column].dtype for partition in partitions]
+        if isinstance(dtypes[0], pd.CategoricalDtype) and any(dtype != dtypes[0] for dtype in dtypes):
+            # sorted, as astype('category') would have sorted them on the whole frame
+            categories = pd.api.types.union_categoricals([partition[column] for partition in partitions], sort_categories=True).categories
+            for partition in partitions:
+                partition[column] = partition[column].cat.set_categories(categories)
+    return pd.concat(partitions)
+
+class ParallelCleaner:
+    '''
+    This class can be used in place of DatabaseCleaning to clean large frames on several cores.
+    Frames with fewer than min_rows rows are cleaned in the calling process, where starting the workers would cost more than it saves.
+
+    '''
+
+    def __init__(self, max_workers=None, compact=False, partition_rows=None, min_rows=50000):
+        '''
+        This function sets up the cleaner. The worker processes are started when a frame first needs them and reused after that.
+
+        Args:
+            max_workers (int): the number of worker processes, one per core if None.
+            compact (bool): clean to the compact dtypes.
+            partition_rows (int): the number of rows in each partition, by default the frame is split evenly between the workers.
+            min_rows (int): the number of rows from which a frame is cleaned in parallel.
+        '''
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.compact = compact
+        self.partition_rows = partition_rows
+        self.min_rows = min_rows
+        self.local_cleaner = DatabaseCleaning(compact=compact)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        This function shuts down the worker processes.
+        '''
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _worker_pool(self):
+        '''
+        This function returns the worker processes, starting them the first time. The pipeline stages clean on several threads at once, so only one of them starts the pool.
+        '''
+        with self._executor_lock:
+            if self._executor is None:
+                # a forked worker would copy the locks the stage threads hold at that moment, so the workers are started from a clean process
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context(start_method))
+            return self._executor
+
+    def _partitions(self, input_df):
+        '''
+        This function splits a frame into contiguous row partitions.
+        '''
+        partition_rows = self.partition_rows or -(-len(input_df) // self.max_workers)
+        return [input_df.iloc[start:start + partition_rows] for start in range(0, len(input_df), partition_rows)]
+
+    def clean(self, method_name, input_df, totals_method=None):
+        '''
+        This function cleans a frame with a DatabaseCleaning method, one partition per worker, and merges the results in order.
+
+        Args:
+            method_name (str): the DatabaseCleaning method to run on each partition, which must only look at one row at a time.
+            input_df (pandas.DataFrame): the frame to clean. It is not modified.
+            totals_method (str): a DatabaseCleaning method returning each partition's partial totals, which are added up.
+
+        Returns:
+            tuple: the cleaned DataFrame, and the totals over every partition or None.
+        '''
+        if len(input_df) < self.min_rows or self.max_workers == 1:
+            clean_df = getattr(self.local_cleaner, method_name)(input_df)
+            return clean_df, getattr(self.local_cleaner, totals_method)(clean_df) if totals_method is not None else None
+
+        executor = self._worker_pool()
+        blocks, futures = [], []
+        try:
+            for partition_df in self._partitions(input_df):
+                blocks.append(_write_shared(partition_df))
+                futures.append(executor.submit(_clean_partition, method_name, self.compact, *blocks[-1], totals_method))
+        except BaseException:
+            for name, _ in blocks:
+                _discard_shared(name)
+            raise
+
+        # wait for every partition, so none is left in shared memory if one of them failed
+        outcomes, error = [], None
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            for name, _ in blocks:
+                _discard_shared(name)
+            for (name, _), _, _ in outcomes:
+                _discard_shared(name)
+            raise error
+
+        clean_df = _concat_partitions([_read_shared(*block) for block, _, _ in outcomes])
+        # the rows each mask dropped in every partition are added up on the calling thread's span, as the cleaner records them when run in process
+        rows_dropped = {}
+        for _, _, partition_rows_dropped in outcomes:
+            for key, value in partition_rows_dropped.items():
+                rows_dropped[key] = rows_dropped.get(key, 0) + value
+        current_span().set_attributes(**rows_dropped)
+        if totals_method is None:
+            return clean_df, None
+        # the partial totals are added up position by position, e.g. the sums and the counts
+        return clean_df, tuple(map(sum, zip(*(totals for _, totals, _ in outcomes))))
+
+    def clean_user_data(self, user_df):
+        '''
+        This function cleans the user dataframe in parallel, see DatabaseCleaning.clean_user_data.
+        '''
+        return self.clean('clean_user_data', user_df)[0]
+
+    def clean_card_data(self, card_df):
+        '''
+        This function cleans the card dataframe in parallel, see DatabaseCleaning.clean_card_data.
+        '''
+        return self.clean('clean_card_data', card_df)[0]
+
+    def clean_store_data(self, store_df):
+        '''
+        This function cleans the store dataframe in parallel, see DatabaseCleaning.clean_store_data.
+        '''
+        return self.clean('clean_store_data', store_df)[0]
+
+    def convert_product_weights(self, product_df):
+        '''
+        This function converts the product weights to kg in parallel, see DatabaseCleaning.convert_product_weights.
+        '''
+        return self.clean('convert_product_weights', product_df)[0]
+
+    def clean_products_data(self, product_df):
+        '''
+        This function cleans the product dataframe in parallel, see DatabaseCleaning.clean_products_data.
+        The mean weight used for the missing weights is found in two phases, from the sum and count of the weights in each partition.
+        '''
+        clean_df, totals = self.clean('clean_products_partition', product_df, totals_method='weight_totals')
+        return self.local_cleaner.impute_weights(clean_df, totals)
+
+    def clean_orders_data(self, orders_df):
+        '''
+        This function cleans the orders dataframe in parallel, see DatabaseCleaning.clean_orders_data.
+        '''
+        return self.clean('clean_orders_data', orders_df)[0]
+
+    def clean_date_data(self, date_df):
+        '''
+        This function cleans the date dataframe in parallel, see DatabaseCleaning.clean_date_data.
+        '''
+        return self.clean('clean_date_data', date_df)[0]
@@ -0,0 +1,233 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import time
+
+from tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+class Pipeline:
+    '''
+    This class can be used to declare the stages of the ETL run and their dependencies, and run independent stages in parallel.
+
+    '''
+
+    def __init__(self, max_workers=4, tracer=None):
+        '''
+        This function creates an empty pipeline.
+
+        Args:
+            max_workers (int): The number of stages that may run at the same time.
+            tracer (Tracer): Records a span for the run and one for each stage, a new Tracer is used if not given.
+        '''
+        self.max_workers = max_workers
+        self.tracer = tracer if tracer is not None else Tracer()
+        # stage name -> (function, names of the stages it depends on), in the order they were added
+        self.stages = {}
+        # stage name -> (fingerprint function, names of the stages it resets), for resumed runs
+        self.checkpoint_options = {}
+        self.timings = {}
+
+    def add_stage(self, name, function, depends_on=(), fingerprint=None, resets=()):
+        '''
+        This function adds a stage to the pipeline.
+
+        Args:
+            name (str): The name of the stage, used for --only/--skip and in the logs.
+            function (callable): The function run for the stage, called with the pipeline context as its only argument.
+            depends_on (tuple): The names of the stages that must finish before this one starts.
+            fingerprint (callable): Called with the pipeline context, returns a cheap version of the stage's own inputs, e.g. its source's ETag,
+                or None if there is no way to tell whether they changed. A resumed run skips the stage while this and its dependencies are unchanged.
+            resets (tuple): Stages that must run again before this stage's dependencies can be run again once it has finished,
+                e.g. the tables have to be created again to drop the keys that were added to them.
+        '''
+        for dependency in tuple(depends_on) + tuple(resets):
+            if dependency not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'")
+        self.stages[name] = (function, tuple(depends_on))
+        self.checkpoint_options[name] = (fingerprint, tuple(resets))
+
+    def select_stages(self, only=None, skip=None):
+        '''
+        This function works out which stages to run from the --only and --skip lists.
+
+        Args:
+            only (list): If given, run just these stages.
+            skip (list): Stages not to run.
+
+        Returns:
+            list: The names of the selected stages, in the order they were added.
+        '''
+        for name in (only or []) + (skip or []):
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}', choose from {', '.join(self.stages)}")
+        return [name for name in self.stages if (not only or name in only) and name not in (skip or [])]
+
+    def run(self, context, only=None, skip=None, checkpoints=None, resume=False):
+        '''
+        This function runs the selected stages on a thread pool, starting each one as soon as the stages it depends on have finished.
+        Dependencies that were not selected are treated as already done. If a stage fails, the stages that depend on it are not run.
+        With checkpoints, the outcome of each stage is recorded, and a resumed run skips the stages that finished last time on the same inputs,
+        so it restarts from the first stage that failed or whose inputs changed.
+
+        Args:
+            context (object): The connectors and configuration passed to every stage.
+            only (list): If given, run just these stages.
+            skip (list): Stages not to run.
+            checkpoints (CheckpointStore): Where each stage's fingerprint and outcome are recorded, or None not to record them.
+            resume (bool): Skip the stages the checkpoints show are done and unchanged.
+
+        Returns:
+            dict: The return value of each stage that ran, keyed by stage name.
+        '''
+        selected = self.select_stages(only, skip)
+        fingerprints = {}
+        unchanged = []
+        if checkpoints is not None:
+            fingerprints = self.fingerprints(context, selected, checkpoints)
+            if resume:
+                unchanged = [name for name in selected if name not in self.stages_to_rerun(selected, fingerprints, checkpoints)]
+                for name in unchanged:
+                    logger.info("Stage %s skipped, it finished last time and its inputs have not changed", name)
+        pending = [name for name in selected if name not in unchanged]
+        if checkpoints is not None:
+            # stages downstream of the ones about to run no longer match what they produced, so a later resume runs them again
+            checkpoints.invalidate([name for name in self.downstream(pending) if name not in pending])
+        results = {}
+        failed = []
+        running = {}
+        self.timings = {}
+
+        with self.tracer.span('etl_run', stages=','.join(pending)) as run_span, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in list(pending):
+                    _, depends_on = self.stages[name]
+                    waiting_on = [dependency for dependency in depends_on if dependency in selected and dependency not in results and dependency not in unchanged]
+                    if any(dependency in failed for dependency in waiting_on):
+                        logger.error("Stage %s not run because a stage it depends on failed", name)
+                        failed.append(name)
+                        pending.remove(name)
+                    elif not waiting_on:
+                        running[executor.submit(self._run_stage, name, context, run_span, checkpoints, fingerprints.get(name), resume)] = name
+                        pending.remove(name)
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        logger.exception("Stage %s failed", name)
+                        failed.append(name)
+
+        if failed:
+            raise RuntimeError(f"Pipeline stages failed: {', '.join(failed)}")
+
+        return results
+
+    def fingerprints(self, context, selected, checkpoints):
+        '''
+        This function works out the fingerprint of each selected stage from the version of its own inputs and the fingerprints of the stages it depends on,
+        so a change to a source also changes the fingerprint of every stage downstream of it.
+        The versions are looked up on the thread pool, as each may be a request to a different source.
+
+        Args:
+            context (object): The connectors and configuration passed to every stage.
+            selected (list): The names of the selected stages, in the order they were added.
+            checkpoints (CheckpointStore): Gives the fingerprints that stages which were not selected last ran with.
+
+        Returns:
+            dict: The fingerprint of each selected stage.
+        '''
+        def stage_version(name):
+            fingerprint_function, _ = self.checkpoint_options[name]
+            # a stage without inputs of its own only changes when its dependencies do
+            if fingerprint_function is None:
+                return ''
+            version = fingerprint_function(context)
+            # None means the inputs cannot be checked, so a unique version makes the stage run again
+            return version if version is not None else f"unknown {time.time()}"
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            versions = dict(zip(selected, executor.map(stage_version, selected)))
+
+        fingerprints = {}
+        for name in selected:
+            _, depends_on = self.stages[name]
+            dependency_fingerprints = [fingerprints[dependency] if dependency in fingerprints else checkpoints.previous_fingerprint(dependency) for dependency in depends_on]
+            fingerprints[name] = checkpoints.fingerprint(name, versions[name], dependency_fingerprints)
+        return fingerprints
+
+    def stages_to_rerun(self, selected, fingerprints, checkpoints):
+        '''
+        This function works out which selected stages a resumed run has to run: those that did not finish last time or whose inputs changed,
+        every stage downstream of them, and the stages reset by a stage that finished but whose dependencies run again.
+
+        Returns:
+            set: The names of the stages to run.
+        '''
+        rerun = {name for name in selected if not checkpoints.is_done(name, fingerprints[name])}
+        while True:
+            for name in selected:
+                _, depends_on = self.stages[name]
+                if any(dependency in rerun for dependency in depends_on):
+                    rerun.add(name)
+            resets = {reset for name in self.stages if checkpoints.is_done(name) for reset in self.checkpoint_options[name][1]
+                      if reset in selected and any(dependency in rerun for dependency in self.stages[name][1])}
+            if resets <= rerun:
+                return rerun
+            rerun |= resets
+
+    def downstream(self, names):
+        '''
+        This function returns the stages that depend, directly or through other stages, on any of the given stages.
+
+        Args:
+            names (list): The names of the stages.
+
+        Returns:
+            list: The names of the stages downstream of them, in the order they were added.
+        '''
+        affected = set(names)
+        found = []
+        for name, (_, depends_on) in self.stages.items():
+            if any(dependency in affected for dependency in depends_on):
+                affected.add(name)
+                found.append(name)
+        return found
+
+    def _run_stage(self, name, context, run_span=None, checkpoints=None, fingerprint=None, resume=False):
+        '''
+        This function runs a single stage in its own span and records its wall time, and its outcome in the checkpoints if there are any.
+        A resumed stage may reuse the cleaned output it kept last time, if its inputs have not changed.
+        '''
+        function, _ = self.stages[name]
+        logger.info("Stage %s started", name)
+        if checkpoints is not None:
+            checkpoints.start(name, fingerprint, keep_artifact=resume)
+        start_time = time.perf_counter()
+        try:
+            with self.tracer.span(name, parent=run_span):
+                result = function(context)
+        except Exception as e:
+            if checkpoints is not None:
+                checkpoints.fail(name, time.perf_counter() - start_time, e)
+            raise
+        finally:
+            self.timings[name] = time.perf_counter() - start_time
+            logger.info("Stage %s finished in %.2fs", name, self.timings[name])
+        if checkpoints is not None:
+            checkpoints.finish(name, self.timings[name], rows=self._row_count(result))
+        return result
+
+    def _row_count(self, result):
+        '''
+        This function returns the number of rows a stage produced, from the DataFrame or row count it returned, or None for other results.
+        '''
+        if hasattr(result, 'columns'):
+            return len(result)
+        if isinstance(result, int) and not isinstance(result, bool):
+            return result
+        return None
@@ -0,0 +1,176 @@
+import argparse
+from dataclasses import dataclass, field
+import json
+import os
+import sys
+
+from query_runner import classify_statement, split_statements, statement_keyword
+
+''' Checks the query plans of the business queries, so a missing index or a planner change is caught before it slows
+the queries down. Each query is EXPLAINed on PostgreSQL, and the check fails when a plan reads a large table with a
+sequential scan or costs much more than the baseline recorded for the same query, e.g.
+python3 plan_check.py --creds my_creds.yaml --baseline plan_baseline.json'''
+
+SEQ_SCAN_NODES = ('Seq Scan', 'Parallel Seq Scan')
+# the fact table grows with every order, while the dimension tables are read whole by some queries, e.g. the store counts
+LARGE_TABLES = ('orders_table',)
+DDL_KEYWORDS = ('CREATE', 'ALTER', 'DROP')
+
+@dataclass
+class PlanCheck:
+    '''
+    This class holds the plan of one query and any problems found in it.
+
+    Attributes:
+        query_number (int): the position of the query among the reads of the script, from 1.
+        sql (str): the query.
+        total_cost (float): the planner's estimated total cost.
+        seq_scans (list): the tables read with a sequential scan.
+        baseline_cost (float): the total cost recorded in the baseline, if there is one.
+        problems (list): why the plan failed the check, empty if it passed.
+    '''
+    query_number: int
+    sql: str
+    total_cost: float
+    seq_scans: list
+    baseline_cost: float = None
+    problems: list = field(default_factory=list)
+
+def _plan_nodes(plan):
+    '''
+    This function yields every node of an EXPLAIN (FORMAT JSON) plan tree.
+    '''
+    yield plan
+    for child_plan in plan.get('Plans', []):
+        yield from _plan_nodes(child_plan)
+
+def explain_queries(engine, file_path):
+    '''
+    This function EXPLAINs each read of a SQL script without running it. Schema changes are run so the reads after them can be planned,
+    e.g. a column added by ALTER TABLE, but in a transaction that is rolled back. Other writes are left out, as even a rolled back
+    UPDATE leaves dead rows behind which raise the costs of later checks.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): the engine connected to the PostgreSQL sales_data database.
+        file_path (str): path to the SQL script.
+
+    Returns:
+        list: (query number, statement, plan) for each read, the plan being the root node of its JSON plan.
+    '''
+    with open(file_path, 'r') as sql_file:
+        statements = split_statements(sql_file.read())
+
+    plans, query_number = [], 0
+    # a plain DB-API cursor runs the script as written, without treating % as a parameter marker
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement in statements:
+            if classify_statement(statement) == 'write':
+                if statement_keyword(statement) in DDL_KEYWORDS:
+                    cursor.execute(statement)
+                continue
+            query_number += 1
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + statement)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            plans.append((query_number, statement, plan[0]['Plan']))
+    finally:
+        connection.rollback()
+        connection.close()
+
+    return plans
+
+def find_large_tables(engine, min_rows):
+    '''
+    This function lists the tables the planner estimates to hold at least min_rows rows.
+    The estimates come from the statistics ANALYZE keeps.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): the engine connected to the PostgreSQL sales_data database.
+        min_rows (int): the number of rows from which a table counts as large.
+
+    Returns:
+        set: the names of the large tables.
+    '''
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT relname FROM pg_class WHERE relkind = 'r' AND relnamespace = current_schema()::regnamespace AND reltuples >= %s", (min_rows,))
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        connection.close()
+
+def check_plans(engine, file_path, baseline_path=None, large_tables=LARGE_TABLES, min_rows=None, tolerance=0.5, update_baseline=False):
+    '''
+    This function checks the plan of each business query for sequential scans of large tables and for cost regressions.
+    The baseline holds the total cost of each query, keyed by its SQL, so a query that has been edited starts a new baseline.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): the engine connected to the PostgreSQL sales_data database.
+        file_path (str): path to the business queries SQL script.
+        baseline_path (str): path to the JSON file of baseline costs, no cost check if None.
+        large_tables (tuple): tables that must not be sequentially scanned.
+        min_rows (int): also count the tables estimated to hold at least this many rows as large, if given.
+        tolerance (float): how much a query's cost may grow over its baseline, e.g. 0.5 for 50%.
+        update_baseline (bool): record the current costs as the new baseline.
+
+    Returns:
+        list: a PlanCheck for each query.
+    '''
+    if engine.dialect.name != 'postgresql':
+        raise ValueError(f"Plan checks need PostgreSQL, not {engine.dialect.name}")
+
+    large_tables = set(large_tables)
+    if min_rows is not None:
+        large_tables |= find_large_tables(engine, min_rows)
+    baseline = {}
+    if baseline_path is not None and os.path.exists(baseline_path):
+        with open(baseline_path, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    checks = []
+    for query_number, statement, plan in explain_queries(engine, file_path):
+        key = ' '.join(statement.split())
+        check = PlanCheck(query_number, statement, plan['Total Cost'],
+                          sorted({node['Relation Name'] for node in _plan_nodes(plan) if node['Node Type'] in SEQ_SCAN_NODES}),
+                          baseline.get(key))
+        for table_name in check.seq_scans:
+            if table_name in large_tables:
+                check.problems.append(f"sequential scan on {table_name}")
+        if check.baseline_cost and check.total_cost > check.baseline_cost * (1 + tolerance):
+            check.problems.append(f"cost {check.total_cost:.0f} is {check.total_cost / check.baseline_cost - 1:.0%} over the baseline {check.baseline_cost:.0f}")
+        checks.append(check)
+        print(f"Query {query_number}: cost {check.total_cost:.0f}" + (f", FAILED: {'; '.join(check.problems)}" if check.problems else ", ok"))
+
+    if update_baseline and baseline_path is not None:
+        baseline.update({' '.join(check.sql.split()): check.total_cost for check in checks})
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+
+    return checks
+
+def parse_args():
+    '''
+    This function reads the command line options for the plan check.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    '''
+    parser = argparse.ArgumentParser(description="Check the query plans of the business queries.")
+    parser.add_argument('--creds', default='my_creds.yaml', help="YAML credentials for the sales_data database")
+    parser.add_argument('--queries', default='sql_files/essential_queries/business_queries_rollup.sql', help="the SQL script to check")
+    parser.add_argument('--baseline', default='plan_baseline.json', help="JSON file of baseline query costs")
+    parser.add_argument('--update-baseline', action='store_true', help="record the current costs as the baseline")
+    parser.add_argument('--large-tables', nargs='+', default=list(LARGE_TABLES), help="tables that must not be sequentially scanned")
+    parser.add_argument('--min-rows', type=int, help="also forbid sequential scans of tables estimated to hold at least this many rows")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="how much a query's cost may grow over its baseline")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    from database_utils import DatabaseConnector
+
+    args = parse_args()
+    engine = DatabaseConnector().init_db_engine(args.creds)
+    checks = check_plans(engine, args.queries, args.baseline, args.large_tables, args.min_rows, tolerance=args.tolerance, update_baseline=args.update_baseline)
+    sys.exit(1 if any(check.problems for check in checks) else 0)
@@ -0,0 +1,309 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import numbers
+import re
+import time
+import numpy as np
+import pandas as pd
+
+from tracing import Span, current_span
+
+''' Runs SQL scripts such as the business queries. The script is split into statements by a scanner that knows about
+quoted strings, identifiers, dollar quoting and comments, and each statement is classed as a read or a write.
+Writes run one at a time in script order and act as barriers: the reads between two writes run concurrently,
+each on its own pooled connection. Every statement is timed, and its rows come back as a DataFrame.'''
+
+# statements starting with these keywords only read, as long as they contain none of WRITE_KEYWORDS
+READ_KEYWORDS = ('SELECT', 'WITH', 'VALUES', 'TABLE', 'SHOW')
+# a WITH query can contain a data-modifying statement, and SELECT ... INTO creates a table
+WRITE_KEYWORDS = ('INSERT', 'UPDATE', 'DELETE', 'MERGE', 'INTO', 'TRUNCATE', 'CREATE', 'ALTER', 'DROP')
+
+_WORD = re.compile(r'[A-Za-z_][A-Za-z_0-9$]*')
+_DOLLAR_QUOTE = re.compile(r'\$([A-Za-z_][A-Za-z_0-9]*)?\$')
+
+@dataclass
+class QueryResult:
+    '''
+    This class holds the outcome of one statement of a SQL script.
+
+    Attributes:
+        statement_number (int): the position of the statement in the script, from 1.
+        query_number (int): the position among the reads, from 1, or None for a write.
+        sql (str): the statement.
+        kind (str): 'read' or 'write'.
+        seconds (float): how long the statement took, including fetching its rows.
+        rows (int): the number of rows returned by a read or changed by a write, None if the database does not say.
+        data (pandas.DataFrame): the rows returned by a read.
+        plan (str): the EXPLAIN (ANALYZE, BUFFERS) output of a read, when asked for.
+        error (str): the error raised by the statement, if it failed.
+    '''
+    statement_number: int
+    query_number: int
+    sql: str
+    kind: str
+    seconds: float = None
+    rows: int = None
+    data: pd.DataFrame = None
+    plan: str = None
+    error: str = None
+
+def _scan(sql_script):
+    '''
+    This function walks through a SQL script and yields (position, character) for every character outside quoted strings,
+    quoted identifiers and comments, so callers can look for semicolons and keywords without being misled by them.
+    The characters inside are yielded as spaces, which keeps keywords on either side apart.
+    '''
+    position, length = 0, len(sql_script)
+    while position < length:
+        character = sql_script[position]
+        end = None
+        if sql_script.startswith('--', position):
+            end = sql_script.find('\n', position)
+        elif sql_script.startswith('/*', position):
+            # PostgreSQL block comments nest
+            depth, end = 1, position + 2
+            while depth and end < length:
+                if sql_script.startswith('/*', end):
+                    depth, end = depth + 1, end + 2
+                elif sql_script.startswith('*/', end):
+                    depth, end = depth - 1, end + 2
+                else:
+                    end += 1
+            end -= 1
+        elif character in ("'", '"'):
+            # a doubled quote inside a string or identifier stands for the quote itself
+            end = position + 1
+            while True:
+                end = sql_script.find(character, end)
+                if end == -1 or not sql_script.startswith(character * 2, end):
+                    break
+                end += 2
+        elif character == '$':
+            dollar_quote = _DOLLAR_QUOTE.match(sql_script, position)
+            if dollar_quote and (position == 0 or not (sql_script[position - 1].isalnum() or sql_script[position - 1] == '_')):
+                end = sql_script.find(dollar_quote.group(), dollar_quote.end())
+                end = end + len(dollar_quote.group()) - 1 if end != -1 else -1
+        if end is None:
+            yield position, character
+            position += 1
+            continue
+        end = length - 1 if end == -1 else end
+        yield position, ' '
+        position = end + 1
+
+def split_statements(sql_script):
+    '''
+    This function splits a SQL script into its statements on the semicolons outside strings and comments.
+
+    Args:
+        sql_script (str): the SQL script.
+
+    Returns:
+        list: the statements, without their semicolons, leaving out any that only hold whitespace or comments.
+    '''
+    statements, start, code = [], 0, []
+    for position, character in _scan(sql_script):
+        if character == ';':
+            statements.append((sql_script[start:position].strip(), ''.join(code)))
+            start, code = position + 1, []
+        else:
+            code.append(character)
+    statements.append((sql_script[start:].strip(), ''.join(code)))
+    return [statement for statement, code in statements if code.strip()]
+
+def _code_words(statement):
+    '''
+    This function returns the upper-cased words of a statement outside its strings and comments.
+    '''
+    return [word.upper() for word in _WORD.findall(''.join(character for position, character in _scan(statement)))]
+
+def statement_keyword(statement):
+    '''
+    This function returns the keyword a statement starts with, e.g. 'SELECT' or 'ALTER', skipping any leading comments.
+
+    Args:
+        statement (str): a single SQL statement.
+
+    Returns:
+        str: the upper-cased first keyword, or '' if there is none.
+    '''
+    words = _code_words(statement)
+    return words[0] if words else ''
+
+def classify_statement(statement):
+    '''
+    This function classes a statement as a 'read', which can run alongside other reads, or a 'write', which changes the database.
+
+    Args:
+        statement (str): a single SQL statement.
+
+    Returns:
+        str: 'read' or 'write'.
+    '''
+    words = _code_words(statement)
+    if words and words[0] in READ_KEYWORDS and not any(word in WRITE_KEYWORDS for word in words):
+        return 'read'
+    return 'write'
+
+class QueryRunner:
+    '''
+    This class can be used to run the statements of a SQL script against a database, with the reads between writes run in parallel.
+
+    '''
+
+    def __init__(self, engine, max_workers=4, explain=False, tracer=None):
+        '''
+        This function sets up the runner.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): the engine connected to the database, whose pool provides a connection for each concurrent read.
+            max_workers (int): the number of reads that may run at the same time.
+            explain (bool): capture EXPLAIN (ANALYZE, BUFFERS) for each read on PostgreSQL, which runs each read a second time.
+            tracer (Tracer): records a span for each statement, under the calling thread's current span.
+        '''
+        self.engine = engine
+        self.max_workers = max_workers
+        self.explain = explain
+        self.tracer = tracer
+
+    def run_file(self, file_path):
+        '''
+        This function runs the statements of a SQL script file.
+
+        Args:
+            file_path (str): path to the SQL script.
+
+        Returns:
+            list: a QueryResult for each statement, in script order.
+        '''
+        with open(file_path, 'r') as sql_file:
+            return self.run(sql_file.read())
+
+    def run(self, sql_script):
+        '''
+        This function runs the statements of a SQL script. Each write runs on its own once the reads before it have finished
+        and is committed before the reads after it start. A failed statement is recorded with its error and the rest still run.
+
+        Args:
+            sql_script (str): the SQL script.
+
+        Returns:
+            list: a QueryResult for each statement, in script order.
+        '''
+        results, query_number = [], 0
+        for statement_number, statement in enumerate(split_statements(sql_script), start=1):
+            kind = classify_statement(statement)
+            if kind == 'read':
+                query_number += 1
+            results.append(QueryResult(statement_number, query_number if kind == 'read' else None, statement, kind))
+
+        # the reads run on worker threads, so their spans are attached to the caller's span explicitly
+        parent = current_span() if isinstance(current_span(), Span) else None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            batch = []
+            for result in results + [None]:
+                if result is not None and result.kind == 'read':
+                    batch.append(result)
+                    continue
+                # a write, or the end of the script, waits for the reads before it
+                list(executor.map(lambda read: self._run_statement(read, parent), batch))
+                batch = []
+                if result is not None:
+                    self._run_statement(result, parent)
+
+        return results
+
+    def _run_statement(self, result, parent=None):
+        '''
+        This function runs one statement on a pooled connection and fills in its QueryResult.
+        '''
+        if self.tracer is None:
+            self._execute(result)
+            return
+        with self.tracer.span('query', parent=parent, statement=result.statement_number, kind=result.kind) as span:
+            self._execute(result)
+            span.set_attributes(rows_out=result.rows or 0)
+            if result.error is not None:
+                span.status = 'ERROR'
+                span.set_attribute('error', result.error)
+
+    def _execute(self, result):
+        '''
+        This function runs a statement, reading its rows into a DataFrame, and commits it if it is a write.
+        '''
+        start = time.perf_counter()
+        # a plain DB-API cursor runs the script as written, without treating % as a parameter marker
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(result.sql)
+            if cursor.description is not None:
+                result.data = pd.DataFrame(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+                result.rows = len(result.data)
+            elif cursor.rowcount >= 0:
+                result.rows = cursor.rowcount
+            result.seconds = time.perf_counter() - start
+            if result.kind == 'read' and self.explain and self.engine.dialect.name == 'postgresql':
+                cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + result.sql)
+                result.plan = '\n'.join(row[0] for row in cursor.fetchall())
+            if result.kind == 'write':
+                connection.commit()
+            else:
+                connection.rollback()
+        except Exception as e:
+            connection.rollback()
+            result.error = str(e).splitlines()[0]
+        finally:
+            connection.close()
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, (bool, np.bool_))
+
+def frames_match(left_df, right_df, tolerance=0.01):
+    '''
+    This function checks whether two query results hold the same rows, e.g. the same query answered by two databases or two ways.
+    Rows are matched on their text columns, since tied rows may come back in any order, and numbers may differ by the tolerance
+    since databases add up floats in different orders and round decimals differently. Missing values match each other.
+
+    Args:
+        left_df (pandas.DataFrame): one result.
+        right_df (pandas.DataFrame): the other result.
+        tolerance (float): the largest difference allowed between two numbers.
+
+    Returns:
+        bool: True if the results match.
+    '''
+    if list(left_df.columns) != list(right_df.columns) or len(left_df) != len(right_df):
+        return False
+
+    def sorted_rows(result_df):
+        return sorted(result_df.itertuples(index=False), key=lambda row: tuple('' if _is_number(value) else str(value) for value in row))
+
+    for left_row, right_row in zip(sorted_rows(left_df), sorted_rows(right_df)):
+        for left_value, right_value in zip(left_row, right_row):
+            if pd.isna(left_value) and pd.isna(right_value):
+                continue
+            if _is_number(left_value) and _is_number(right_value):
+                if abs(float(left_value) - float(right_value)) > tolerance:
+                    return False
+            elif left_value != right_value:
+                return False
+    return True
+
+def print_results(results):
+    '''
+    This function prints the results of a script run: each read's rows, and the time taken and rows of every statement.
+
+    Args:
+        results (list): the QueryResults returned by QueryRunner.run.
+    '''
+    for result in results:
+        label = f"Query {result.query_number}" if result.kind == 'read' else f"Statement {result.statement_number}"
+        if result.error is not None:
+            print(f"{label} failed: {result.error}")
+            continue
+        print(f"{label} ({'' if result.rows is None else f'{result.rows} rows, '}{result.seconds:.3f}s):")
+        if result.data is not None:
+            print(result.data.to_string(index=False))
+        if result.plan is not None:
+            print(result.plan)
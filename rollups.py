@@ -0,0 +1,191 @@
+import logging
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from query_runner import frames_match, split_statements
+
+''' Pre-aggregated sales for the business queries. sales_rollup holds the number of sales, the quantity sold and the
+total sales of the orders for each store type, country, location, year and month, so the queries add up a few hundred
+rollup rows instead of joining every order to the products, dates and stores. A full load rebuilds the rollup and an
+incremental load adds only the orders loaded since the last refresh, found from orders_table.order_id, and aggregates
+again the orders whose store, product or date was missing last time, in case it has been loaded since.'''
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = 'sales_rollup'
+# the orders in the rollup whose store, product or date was not found, which each refresh aggregates again
+UNMATCHED_TABLE = 'sales_rollup_unmatched'
+
+# the group columns of the rollup. Each raw query inner joins the orders to only some of the stores, products and dates, so
+# whether each was found is kept with the group and the queries filter on the same matches. Missing values stay NULL, as in the raw queries
+GROUP_COLUMNS = ('store_matched', 'product_matched', 'date_matched', 'store_type', 'country_code', 'location', 'year', 'month')
+
+CREATE_ROLLUP_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+    store_matched BOOLEAN NOT NULL,
+    product_matched BOOLEAN NOT NULL,
+    date_matched BOOLEAN NOT NULL,
+    store_type VARCHAR(255),
+    country_code VARCHAR(2),
+    location VARCHAR(7),
+    year VARCHAR(4),
+    month VARCHAR(2),
+    number_of_sales BIGINT NOT NULL,
+    product_quantity_count BIGINT,
+    total_sales NUMERIC
+)"""
+
+CREATE_UNMATCHED_TABLE = f"CREATE TABLE IF NOT EXISTS {UNMATCHED_TABLE} (order_id BIGINT PRIMARY KEY)"
+
+# the orders a refresh aggregates: the new ones, with order_id in (low, high], and the ones that were unmatched last time
+REFRESHED_ORDERS = f"(orders_table.order_id > :low AND orders_table.order_id <= :high OR orders_table.order_id IN (SELECT order_id FROM {UNMATCHED_TABLE}))"
+
+ORDER_JOINS = """LEFT JOIN dim_products ON dim_products.product_code = orders_table.product_code
+    LEFT JOIN dim_date_times ON dim_date_times.date_uuid = orders_table.date_uuid
+    LEFT JOIN dim_store_details ON dim_store_details.store_code = orders_table.store_code"""
+
+# aggregates the refreshed orders into the rollup. A unique key cannot match NULL group values, so the rollup, a few hundred rows,
+# is taken out and grouped again with the refreshed orders, as GROUP BY treats NULLs as equal. The groups of unmatched orders are
+# left out, as those orders are all aggregated again. The statements in a WITH query share one snapshot, so the DELETE only removes
+# the rows that were there before
+REFRESH_ROLLUP = f"""
+WITH previous_rollup AS (
+    DELETE FROM {ROLLUP_TABLE} RETURNING *
+),
+refreshed_orders AS (
+    SELECT dim_store_details.store_code IS NOT NULL AS store_matched,
+           dim_products.product_code IS NOT NULL AS product_matched,
+           dim_date_times.date_uuid IS NOT NULL AS date_matched,
+           dim_store_details.store_type,
+           dim_store_details.country_code,
+           CASE
+                WHEN dim_store_details.store_type IN ('Local', 'Super Store', 'Mall Kiosk', 'Outlet') THEN 'Offline'
+                WHEN dim_store_details.store_type = 'Web Portal' THEN 'Web'
+           END AS location,
+           dim_date_times.year,
+           dim_date_times.month,
+           COUNT(orders_table.product_quantity) AS number_of_sales,
+           SUM(orders_table.product_quantity) AS product_quantity_count,
+           SUM(CAST(dim_products.product_price_sterling * orders_table.product_quantity AS numeric)) AS total_sales
+    FROM orders_table
+    {ORDER_JOINS}
+    WHERE {REFRESHED_ORDERS}
+    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+)
+INSERT INTO {ROLLUP_TABLE} ({', '.join(GROUP_COLUMNS)}, number_of_sales, product_quantity_count, total_sales)
+SELECT {', '.join(GROUP_COLUMNS)}, SUM(number_of_sales), SUM(product_quantity_count), SUM(total_sales)
+FROM (SELECT * FROM previous_rollup WHERE store_matched AND product_matched AND date_matched
+      UNION ALL SELECT * FROM refreshed_orders) AS partial_rollups
+GROUP BY {', '.join(GROUP_COLUMNS)}"""
+
+# keeps the refreshed orders that are still missing a store, product or date for the next refresh, run after REFRESH_ROLLUP has read the last ones
+REFRESH_UNMATCHED = [
+    f"""DELETE FROM {UNMATCHED_TABLE} WHERE order_id IN (
+    SELECT orders_table.order_id FROM orders_table JOIN {UNMATCHED_TABLE} ON {UNMATCHED_TABLE}.order_id = orders_table.order_id
+    {ORDER_JOINS}
+    WHERE dim_store_details.store_code IS NOT NULL AND dim_products.product_code IS NOT NULL AND dim_date_times.date_uuid IS NOT NULL)""",
+    f"""INSERT INTO {UNMATCHED_TABLE} (order_id)
+    SELECT orders_table.order_id FROM orders_table
+    {ORDER_JOINS}
+    WHERE orders_table.order_id > :low AND orders_table.order_id <= :high
+    AND (dim_store_details.store_code IS NULL OR dim_products.product_code IS NULL OR dim_date_times.date_uuid IS NULL)""",
+]
+
+def refresh_rollups(database_connector, file, full=False):
+    '''
+    This function brings sales_rollup up to date with orders_table. The orders up to the current largest order_id are added
+    and that order_id is recorded as the rollup's watermark in the same transaction, so a failed refresh leaves the rollup as it was.
+    It is run after the loads have finished, so no order with a smaller order_id can still be uncommitted. The orders whose store,
+    product or date was missing are aggregated again by every refresh, so they move to their groups once the missing row is loaded.
+    A store, product or date that is changed or removed after its orders were added needs a full refresh.
+
+    Args:
+        database_connector (DatabaseConnector): The connector used for the sales_data database and its watermarks.
+        file (str): Path to the YAML file containing the sales_data database credentials.
+        full (bool): Rebuild the rollup from every order, e.g. after a full load has recreated orders_table and restarted its order_id.
+
+    Returns:
+        int: The number of orders added to the rollup.
+    '''
+    engine = database_connector.init_db_engine(file)
+    last_order_id = None if full else database_connector.read_watermark(ROLLUP_TABLE, file)
+
+    with engine.begin() as connection:
+        # a rollup made before the product and date matches or the unmatched orders were kept is rebuilt in full
+        inspector = inspect(connection)
+        if inspector.has_table(ROLLUP_TABLE) and ('date_matched' not in {column['name'] for column in inspector.get_columns(ROLLUP_TABLE)}
+                                                  or not inspector.has_table(UNMATCHED_TABLE)):
+            connection.execute(text(f"DROP TABLE {ROLLUP_TABLE}"))
+            last_order_id = None
+        connection.execute(text(CREATE_ROLLUP_TABLE))
+        connection.execute(text(CREATE_UNMATCHED_TABLE))
+        if last_order_id is None:
+            connection.execute(text(f"DELETE FROM {ROLLUP_TABLE}"))
+            connection.execute(text(f"DELETE FROM {UNMATCHED_TABLE}"))
+            last_order_id = 0
+        low, high = int(last_order_id), connection.execute(text("SELECT MAX(order_id) FROM orders_table")).scalar()
+        high = max(high or 0, low)
+        unmatched_orders = connection.execute(text(f"SELECT COUNT(*) FROM {UNMATCHED_TABLE}")).scalar()
+        if high == low and not unmatched_orders:
+            logger.info("%s is up to date", ROLLUP_TABLE)
+            return 0
+        connection.execute(text(REFRESH_ROLLUP), {'low': low, 'high': high})
+        for statement in REFRESH_UNMATCHED:
+            connection.execute(text(statement), {'low': low, 'high': high})
+        database_connector.write_watermark(ROLLUP_TABLE, 'order_id', high, file, connection=connection)
+
+    logger.info("Added orders %d to %d to %s and aggregated %d unmatched orders again", low + 1, high, ROLLUP_TABLE, unmatched_orders)
+    return high - low
+
+def _select_results(engine, file_path):
+    '''
+    This function runs a SQL script in a transaction that is rolled back afterwards, so scripts that alter tables leave no trace,
+    and returns each SELECT with its result as a DataFrame.
+    '''
+    with open(file_path, 'r') as sql_file:
+        statements = split_statements(sql_file.read())
+
+    results = []
+    # a plain DB-API cursor runs the script as written, without treating % as a parameter marker
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+            if cursor.description is not None:
+                results.append((' '.join(statement.split()), pd.DataFrame(cursor.fetchall(), columns=[column[0] for column in cursor.description])))
+    finally:
+        connection.rollback()
+        connection.close()
+
+    return results
+
+def check_rollups(engine, raw_query_file_path, rollup_query_file_path, tolerance=0.01):
+    '''
+    This function runs the business queries both on the raw tables and on sales_rollup and checks that they give the same answers.
+    Queries that are the same in both files do not use the rollup and are not compared, as a LIMIT may pick between tied rows differently.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine connected to the sales_data database.
+        raw_query_file_path (str): Path to the business queries on the raw tables.
+        rollup_query_file_path (str): Path to the business queries on sales_rollup.
+        tolerance (float): The largest difference allowed between two numbers.
+
+    Returns:
+        list: The numbers of the queries whose results differ.
+    '''
+    raw_results = _select_results(engine, raw_query_file_path)
+    rollup_results = _select_results(engine, rollup_query_file_path)
+    if len(raw_results) != len(rollup_results):
+        raise ValueError(f"{raw_query_file_path} has {len(raw_results)} queries but {rollup_query_file_path} has {len(rollup_results)}")
+
+    mismatches = []
+    for query_number, ((raw_statement, raw_df), (rollup_statement, rollup_df)) in enumerate(zip(raw_results, rollup_results), start=1):
+        if raw_statement == rollup_statement:
+            continue
+        matches = frames_match(raw_df, rollup_df, tolerance)
+        if not matches:
+            mismatches.append(query_number)
+        logger.log(logging.INFO if matches else logging.ERROR, "Query %d: rollup result %s the raw tables", query_number, 'matches' if matches else 'DOES NOT MATCH')
+
+    return mismatches
@@ -0,0 +1,321 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+''' The schema of the sales_data database, declared once. The pipeline creates each table with its final column types
+before loading, maps the cleaned DataFrames onto those columns, adds the primary keys and foreign keys after the
+bulk load, and then builds the indexes the business queries need. create_schema.sql is generated from these definitions with: python3 schema.py'''
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Column:
+    '''
+    This class describes one column of a destination table.
+
+    Attributes:
+        name (str): the column name in the database.
+        sql_type (str): the PostgreSQL type of the column.
+        source (str): the cleaned DataFrame column the values come from, if it has a different name.
+        convert (callable): a function applied to the source column, for columns derived from another one.
+        generated (bool): the database fills the column in itself, so it is not loaded from the DataFrame.
+    '''
+    name: str
+    sql_type: str
+    source: str = None
+    convert: object = None
+    generated: bool = False
+
+@dataclass(frozen=True)
+class ForeignKey:
+    '''
+    This class describes a foreign key from a destination table to another one.
+    '''
+    name: str
+    column: str
+    references_table: str
+    references_column: str
+
+@dataclass(frozen=True)
+class TableSchema:
+    '''
+    This class describes a destination table and the constraints added once it has been loaded.
+
+    Attributes:
+        name (str): the table name.
+        columns (tuple): the Columns of the table, in order.
+        primary_key (str): the primary key column.
+        foreign_keys (tuple): the ForeignKeys of the table.
+        indexes (tuple): columns indexed after the load, e.g. the foreign key and join columns of the fact table.
+        extra_rows (tuple): rows inserted after the load, as dictionaries of column values.
+    '''
+    name: str
+    columns: tuple
+    primary_key: str = None
+    foreign_keys: tuple = ()
+    indexes: tuple = ()
+    extra_rows: tuple = ()
+
+def weight_class(weight_kg):
+    '''
+    This function groups product weights into the classes used for delivery.
+
+    Args:
+        weight_kg (pandas.Series): product weights in kg.
+
+    Returns:
+        pandas.Series: 'Light', 'Mid_Sized', 'Heavy' or 'Truck_Required', NULL for missing or negative weights.
+    '''
+    classes = pd.cut(weight_kg, [0, 2, 40, 140, np.inf], right=False, labels=['Light', 'Mid_Sized', 'Heavy', 'Truck_Required'])
+    return classes.astype('string')
+
+def is_still_available(removed):
+    '''
+    This function turns the removed column into a boolean which is TRUE for products still available.
+    '''
+    return (removed == 'Still_available').fillna(False).astype(bool)
+
+TABLE_SCHEMAS = {
+    'dim_users': TableSchema(
+        name='dim_users',
+        columns=(Column('first_name', 'VARCHAR(255)'), Column('last_name', 'VARCHAR(255)'), Column('date_of_birth', 'DATE'),
+                 Column('company', 'TEXT'), Column('email_address', 'TEXT'), Column('address', 'TEXT'), Column('country', 'TEXT'),
+                 Column('country_code', 'VARCHAR(3)'), Column('phone_number', 'TEXT'), Column('join_date', 'DATE'), Column('user_uuid', 'UUID')),
+        primary_key='user_uuid',
+    ),
+    'dim_card_details': TableSchema(
+        name='dim_card_details',
+        columns=(Column('card_number', 'VARCHAR(19)'), Column('expiry_date', 'VARCHAR(5)'), Column('card_provider', 'TEXT'),
+                 Column('date_payment_confirmed', 'DATE')),
+        primary_key='card_number',
+    ),
+    'dim_store_details': TableSchema(
+        name='dim_store_details',
+        columns=(Column('address', 'TEXT'), Column('longitude', 'FLOAT'), Column('locality', 'VARCHAR(255)'), Column('store_code', 'VARCHAR(12)'),
+                 Column('staff_numbers', 'SMALLINT'), Column('opening_date', 'DATE'), Column('store_type', 'VARCHAR(255)'),
+                 Column('latitude', 'FLOAT'), Column('country_code', 'VARCHAR(2)'), Column('continent', 'VARCHAR(255)')),
+        primary_key='store_code',
+        # the web portal has no coordinates, so the cleaner drops it and it is entered here
+        extra_rows=({'address': None, 'longitude': None, 'locality': None, 'store_code': 'WEB-1388012W', 'staff_numbers': 325,
+                     'opening_date': '2010-06-12', 'store_type': 'Web Portal', 'latitude': None, 'country_code': 'GB', 'continent': 'Europe'},),
+    ),
+    'dim_products': TableSchema(
+        name='dim_products',
+        columns=(Column('product_name', 'TEXT'), Column('category', 'TEXT'), Column('EAN', 'VARCHAR(17)'), Column('date_added', 'DATE'),
+                 Column('uuid', 'UUID'), Column('still_available', 'BOOLEAN', source='removed', convert=is_still_available),
+                 Column('product_code', 'VARCHAR(11)'), Column('weight_kg', 'FLOAT'), Column('product_price_sterling', 'FLOAT'),
+                 Column('weight_class', 'VARCHAR(14)', source='weight_kg', convert=weight_class)),
+        primary_key='product_code',
+    ),
+    'dim_date_times': TableSchema(
+        name='dim_date_times',
+        columns=(Column('timestamp', 'TEXT'), Column('month', 'VARCHAR(2)'), Column('year', 'VARCHAR(4)'), Column('day', 'VARCHAR(2)'),
+                 Column('time_period', 'VARCHAR(10)'), Column('date_uuid', 'UUID'), Column('purchase_date', 'TIMESTAMP'),
+                 Column('purchase_datetime', 'TIMESTAMP')),
+        primary_key='date_uuid',
+    ),
+    'orders_table': TableSchema(
+        name='orders_table',
+        # order_id numbers the orders as they are loaded, so the sales rollups can be refreshed from the new ones
+        columns=(Column('order_id', 'BIGINT GENERATED ALWAYS AS IDENTITY', generated=True), Column('date_uuid', 'UUID'), Column('user_uuid', 'UUID'),
+                 Column('card_number', 'VARCHAR(19)'), Column('store_code', 'VARCHAR(12)'), Column('product_code', 'VARCHAR(11)'),
+                 Column('product_quantity', 'SMALLINT')),
+        foreign_keys=(ForeignKey('fk_orders_users', 'user_uuid', 'dim_users', 'user_uuid'),
+                      ForeignKey('fk_orders_card', 'card_number', 'dim_card_details', 'card_number'),
+                      ForeignKey('fk_orders_product', 'product_code', 'dim_products', 'product_code'),
+                      ForeignKey('fk_orders_date', 'date_uuid', 'dim_date_times', 'date_uuid')),
+        # the business queries join the orders to the dimension tables on these columns, and PostgreSQL does not index the referencing side of a foreign key
+        indexes=('date_uuid', 'user_uuid', 'card_number', 'store_code', 'product_code'),
+    ),
+}
+
+def prepare_frame(table_schema, clean_df):
+    '''
+    This function maps a cleaned DataFrame onto a destination table's columns: other columns are left out,
+    renamed and derived columns are filled in, and the columns are put in the table's order. Generated columns are left to the database.
+
+    Args:
+        table_schema (TableSchema): the destination table.
+        clean_df (pandas.DataFrame): the cleaned DataFrame.
+
+    Returns:
+        pandas.DataFrame: a DataFrame with exactly the table's columns.
+    '''
+    columns = {}
+    for column in table_schema.columns:
+        if column.generated:
+            continue
+        values = clean_df[column.source or column.name]
+        columns[column.name] = column.convert(values) if column.convert is not None else values
+
+    return pd.DataFrame(columns, index=clean_df.index, copy=False)
+
+def _quote(name):
+    '''
+    This function quotes an identifier for PostgreSQL, used when no engine is at hand.
+    '''
+    return '"' + name.replace('"', '""') + '"'
+
+def _literal(value):
+    '''
+    This function writes a Python value as a SQL literal for the extra rows.
+    '''
+    if value is None:
+        return 'NULL'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+def create_table_statements(table_schema, quote=_quote, postgresql=True):
+    '''
+    This function returns the statements that drop and recreate a table with its final column types and no constraints.
+    SQLite has no DROP ... CASCADE, and no foreign keys to cascade to, and numbers generated columns with INTEGER PRIMARY KEY instead of an identity.
+    '''
+    column_list = ', '.join(f"{quote(column.name)} {column.sql_type if postgresql or not column.generated else 'INTEGER PRIMARY KEY'}" for column in table_schema.columns)
+    return [f"DROP TABLE IF EXISTS {quote(table_schema.name)}" + (" CASCADE" if postgresql else ""),
+            f"CREATE TABLE {quote(table_schema.name)} ({column_list})"]
+
+def extra_row_statements(table_schema, quote=_quote):
+    '''
+    This function returns the statements that insert a table's extra rows.
+    '''
+    table = quote(table_schema.name)
+    return [f"INSERT INTO {table} ({', '.join(quote(column) for column in row)}) VALUES ({', '.join(_literal(value) for value in row.values())})"
+            for row in table_schema.extra_rows]
+
+def constraint_statements(table_schema, quote=_quote, postgresql=True):
+    '''
+    This function returns the statements run after a table has been loaded, split into the extra rows and primary key,
+    and the foreign keys. SQLite cannot add constraints to an existing table, so there the primary key becomes a unique index
+    and the foreign keys are left out.
+
+    Returns:
+        tuple: the list of statements for the table itself and the list of foreign key statements.
+    '''
+    table = quote(table_schema.name)
+    statements = extra_row_statements(table_schema, quote)
+    if table_schema.primary_key and postgresql:
+        statements.append(f"ALTER TABLE {table} ADD PRIMARY KEY ({quote(table_schema.primary_key)})")
+    elif table_schema.primary_key:
+        statements.append(f"CREATE UNIQUE INDEX {quote(f'pk_{table_schema.name}')} ON {table} ({quote(table_schema.primary_key)})")
+
+    foreign_key_statements = []
+    if postgresql:
+        for foreign_key in table_schema.foreign_keys:
+            foreign_key_statements.append(f"ALTER TABLE {table} ADD CONSTRAINT {quote(foreign_key.name)} FOREIGN KEY ({quote(foreign_key.column)}) "
+                                          f"REFERENCES {quote(foreign_key.references_table)} ({quote(foreign_key.references_column)})")
+    return statements, foreign_key_statements
+
+def index_name(table_schema, column):
+    '''
+    This function returns the name of the index on a column of a table.
+    '''
+    return f'ix_{table_schema.name}_{column}'
+
+def index_statements(table_schema, quote=_quote, concurrently=False):
+    '''
+    This function returns the statements that build the indexes of a table, skipping any that already exist.
+    CONCURRENTLY builds an index without blocking writes to the table, but PostgreSQL only allows it outside a transaction.
+    '''
+    return [f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {quote(index_name(table_schema, column))} "
+            f"ON {quote(table_schema.name)} ({quote(column)})" for column in table_schema.indexes]
+
+def create_tables(engine, table_schemas=TABLE_SCHEMAS):
+    '''
+    This function drops and recreates the destination tables with their final column types, ready to be bulk loaded.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): the engine connected to the sales_data database.
+        table_schemas (dict): the TableSchemas to create, keyed by table name.
+    '''
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as connection:
+        for table_schema in table_schemas.values():
+            for statement in create_table_statements(table_schema, quote, engine.dialect.name == 'postgresql'):
+                connection.execute(text(statement))
+    logger.info("Created tables %s", ', '.join(table_schemas))
+
+def add_constraints(engine, table_schemas=TABLE_SCHEMAS):
+    '''
+    This function adds the extra rows, primary keys and foreign keys once the tables have been loaded, in one transaction.
+    Every primary key is added before any foreign key so the referenced tables are ready.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): the engine connected to the sales_data database.
+        table_schemas (dict): the loaded TableSchemas, keyed by table name.
+    '''
+    quote = engine.dialect.identifier_preparer.quote
+    statements, foreign_key_statements = [], []
+    for table_schema in table_schemas.values():
+        table_statements, table_foreign_key_statements = constraint_statements(table_schema, quote, engine.dialect.name == 'postgresql')
+        statements += table_statements
+        foreign_key_statements += table_foreign_key_statements
+
+    with engine.begin() as connection:
+        for statement in statements + foreign_key_statements:
+            connection.execute(text(statement))
+    logger.info("Added keys to %s", ', '.join(table_schemas))
+
+def create_indexes(engine, table_schemas=TABLE_SCHEMAS, concurrently=False, max_workers=4):
+    '''
+    This function builds any missing indexes once the tables have been loaded, and then updates the planner statistics of the tables.
+    On PostgreSQL the indexes are built in parallel, each on its own connection: plain CREATE INDEX after a full load,
+    when nothing else is writing and builds on the same table can share it, or CREATE INDEX CONCURRENTLY on tables that are in use.
+    An index left invalid by a failed concurrent build is dropped and built again.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): the engine connected to the sales_data database.
+        table_schemas (dict): the TableSchemas whose indexes to build, keyed by table name.
+        concurrently (bool): build the indexes without blocking writes, e.g. during an incremental run.
+        max_workers (int): the number of indexes built at the same time.
+    '''
+    quote = engine.dialect.identifier_preparer.quote
+    postgresql = engine.dialect.name == 'postgresql'
+    indexed_schemas = [table_schema for table_schema in table_schemas.values() if table_schema.indexes]
+    statements = [statement for table_schema in indexed_schemas for statement in index_statements(table_schema, quote, concurrently and postgresql)]
+
+    def execute(statement):
+        # each statement commits on its own, which CREATE INDEX CONCURRENTLY requires
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text(statement))
+
+    if postgresql:
+        names = [index_name(table_schema, column) for table_schema in indexed_schemas for column in table_schema.indexes]
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            invalid_indexes = connection.execute(text("SELECT class.relname FROM pg_index JOIN pg_class class ON class.oid = pg_index.indexrelid "
+                                                      "WHERE NOT pg_index.indisvalid AND class.relname = ANY(:names)"), {'names': names}).scalars().all()
+        for name in invalid_indexes:
+            execute(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {quote(name)}")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(execute, statements))
+    else:
+        # SQLite has a single writer, so the indexes are built one after another
+        for statement in statements:
+            execute(statement)
+
+    for table_schema in table_schemas.values():
+        execute(f"ANALYZE {quote(table_schema.name)}")
+    logger.info("Built indexes on %s", ', '.join(table_schema.name for table_schema in indexed_schemas))
+
+if __name__ == "__main__":
+    # print the DDL, which is kept in sql_files/essential_queries/create_schema.sql
+    print("-- Generated by python3 schema.py from the definitions the pipeline uses, do not edit by hand.")
+    print("-- 1. The tables are created with their final types before the load.")
+    for table_schema in TABLE_SCHEMAS.values():
+        print(';\n'.join(create_table_statements(table_schema)) + ';\n')
+    print("-- 2. The extra rows and primary keys are added after the load, then the foreign keys.")
+    all_foreign_key_statements = []
+    for table_schema in TABLE_SCHEMAS.values():
+        statements, foreign_key_statements = constraint_statements(table_schema)
+        if statements:
+            print(';\n'.join(statements) + ';\n')
+        all_foreign_key_statements += foreign_key_statements
+    print(';\n'.join(all_foreign_key_statements) + ';\n')
+    print("-- 3. The indexes are built last, in parallel, and the planner statistics updated.")
+    for table_schema in TABLE_SCHEMAS.values():
+        if table_schema.indexes:
+            print(';\n'.join(index_statements(table_schema)) + ';')
+    print(';\n'.join(f"ANALYZE {_quote(table_schema.name)}" for table_schema in TABLE_SCHEMAS.values()) + ';')
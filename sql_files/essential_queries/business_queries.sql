@@ -103,10 +103,10 @@ purchase_time_difference_cte AS (
 )
 SELECT year,
 CONCAT(
-	'"hours": ', FLOOR(AVG(purchase_time_difference) / 3600), ', ',
-	'"minutes": ', FLOOR((AVG(purchase_time_difference) % 3600) / 60), ', ',
-	'"seconds": ', ROUND(AVG(purchase_time_difference) % 60), ', ',
-	'"milliseconds": ', ROUND((AVG(purchase_time_difference)*1000)%1000)
+	'"hours": ', CAST(FLOOR(AVG(purchase_time_difference) / 3600) AS INTEGER), ', ',
+	'"minutes": ', CAST(FLOOR((AVG(purchase_time_difference) % 3600) / 60) AS INTEGER), ', ',
+	'"seconds": ', CAST(ROUND(AVG(purchase_time_difference) % 60) AS INTEGER), ', ',
+	'"milliseconds": ', CAST(ROUND((AVG(purchase_time_difference)*1000)%1000) AS INTEGER)
 ) 
 AS actual_time_taken
 FROM purchase_time_difference_cte
@@ -0,0 +1,97 @@
+SELECT country_code AS country,
+COUNT(country_code) AS total_num_stores
+FROM dim_store_details
+GROUP BY country
+ORDER BY total_num_stores DESC;
+
+SELECT locality,
+COUNT(locality) AS total_no_stores
+FROM dim_store_details
+GROUP BY locality
+ORDER BY total_no_stores DESC
+LIMIT 5;
+
+SELECT ROUND(SUM(total_sales), 2) AS total_sales,
+month
+FROM sales_rollup
+WHERE date_matched AND product_matched
+GROUP BY month
+ORDER BY total_sales DESC
+LIMIT 5;
+
+SELECT SUM(number_of_sales) AS number_of_sales,
+SUM(product_quantity_count) AS product_quantity_count,
+location
+FROM sales_rollup
+WHERE store_matched
+GROUP BY location;
+
+SELECT store_type,
+ROUND(SUM(total_sales), 2) AS total_sales,
+ROUND(SUM(total_sales) / SUM(SUM(total_sales)) OVER () * 100, 2) AS percentage_total
+FROM sales_rollup
+WHERE store_matched AND product_matched
+GROUP BY store_type
+ORDER BY total_sales DESC;
+
+SELECT ROUND(SUM(total_sales), 2) AS total_sales,
+year,
+month
+FROM sales_rollup
+WHERE date_matched AND product_matched
+GROUP BY month, year
+ORDER BY total_sales DESC
+LIMIT 5;
+
+SELECT SUM(staff_numbers) AS total_staff_numbers,
+country_code
+FROM dim_store_details
+GROUP BY country_code
+ORDER BY total_staff_numbers DESC;
+
+SELECT ROUND(SUM(total_sales), 2) AS total_sales,
+store_type,
+country_code
+FROM sales_rollup
+WHERE store_matched AND product_matched AND country_code LIKE 'DE'
+GROUP BY store_type, country_code
+ORDER BY total_sales DESC
+LIMIT 5;
+
+WITH
+purchase_time_cte AS(
+		SELECT year,
+				month,
+				day,
+				timestamp,
+		CAST(CONCAT(year, '-', month, '-', day, ' ', timestamp) AS TIMESTAMP) AS purchase_time
+		FROM dim_date_times
+		ORDER BY year, month, day, timestamp
+	),
+next_purchase_time_cte AS(
+	SELECT year,
+			purchase_time,
+			LEAD(purchase_time) OVER (PARTITION BY year ORDER BY purchase_time) AS next_purchase_time
+	FROM purchase_time_cte
+	ORDER BY year, purchase_time
+	),
+purchase_time_difference_cte AS (
+	SELECT year,
+			purchase_time,
+			next_purchase_time,
+	EXTRACT(EPOCH FROM(next_purchase_time - purchase_time)) AS purchase_time_difference
+	FROM next_purchase_time_cte
+	ORDER BY year, purchase_time, next_purchase_time
+)
+SELECT year,
+CONCAT(
+	'"hours": ', CAST(FLOOR(AVG(purchase_time_difference) / 3600) AS INTEGER), ', ',
+	'"minutes": ', CAST(FLOOR((AVG(purchase_time_difference) % 3600) / 60) AS INTEGER), ', ',
+	'"seconds": ', CAST(ROUND(AVG(purchase_time_difference) % 60) AS INTEGER), ', ',
+	'"milliseconds": ', CAST(ROUND((AVG(purchase_time_difference)*1000)%1000) AS INTEGER)
+)
+AS actual_time_taken
+FROM purchase_time_difference_cte
+GROUP BY year
+ORDER BY AVG(purchase_time_difference) DESC
+LIMIT 5;
@@ -1,113 +1,49 @@
-ALTER TABLE orders_table
-DROP COLUMN level_0,
-DROP COLUMN index;
+-- Generated by python3 schema.py from the definitions the pipeline uses, do not edit by hand.
+-- 1. The tables are created with their final types before the load.
+DROP TABLE IF EXISTS "dim_users" CASCADE;
+CREATE TABLE "dim_users" ("first_name" VARCHAR(255), "last_name" VARCHAR(255), "date_of_birth" DATE, "company" TEXT, "email_address" TEXT, "address" TEXT, "country" TEXT, "country_code" VARCHAR(3), "phone_number" TEXT, "join_date" DATE, "user_uuid" UUID);
 
-ALTER TABLE orders_table
-ALTER COLUMN date_uuid TYPE UUID USING date_uuid::uuid,
-ALTER COLUMN user_uuid TYPE UUID USING user_uuid::uuid,
-ALTER COLUMN card_number TYPE VARCHAR(19),
-ALTER COLUMN store_code TYPE VARCHAR(12),
-ALTER COLUMN product_code TYPE VARCHAR(11),
-ALTER COLUMN product_quantity TYPE SMALLINT;
+DROP TABLE IF EXISTS "dim_card_details" CASCADE;
+CREATE TABLE "dim_card_details" ("card_number" VARCHAR(19), "expiry_date" VARCHAR(5), "card_provider" TEXT, "date_payment_confirmed" DATE);
 
-ALTER TABLE dim_users
-ALTER COLUMN first_name TYPE VARCHAR(255),
-ALTER COLUMN last_name TYPE VARCHAR(255),
-ALTER COLUMN date_of_birth TYPE DATE,
-ALTER COLUMN country_code TYPE VARCHAR(3),
-ALTER COLUMN user_uuid TYPE UUID USING user_uuid::uuid,
-ALTER COLUMN join_date TYPE DATE;
+DROP TABLE IF EXISTS "dim_store_details" CASCADE;
+CREATE TABLE "dim_store_details" ("address" TEXT, "longitude" FLOAT, "locality" VARCHAR(255), "store_code" VARCHAR(12), "staff_numbers" SMALLINT, "opening_date" DATE, "store_type" VARCHAR(255), "latitude" FLOAT, "country_code" VARCHAR(2), "continent" VARCHAR(255));
 
-ALTER TABLE dim_store_details
-DROP COLUMN index;
+DROP TABLE IF EXISTS "dim_products" CASCADE;
+CREATE TABLE "dim_products" ("product_name" TEXT, "category" TEXT, "EAN" VARCHAR(17), "date_added" DATE, "uuid" UUID, "still_available" BOOLEAN, "product_code" VARCHAR(11), "weight_kg" FLOAT, "product_price_sterling" FLOAT, "weight_class" VARCHAR(14));
 
-ALTER TABLE dim_store_details
-ALTER COLUMN longitude TYPE FLOAT,
-ALTER COLUMN locality TYPE VARCHAR(255),
-ALTER COLUMN store_code TYPE VARCHAR(11),
-ALTER COLUMN staff_numbers TYPE SMALLINT,
-ALTER COLUMN opening_date TYPE DATE,
-ALTER COLUMN store_type TYPE VARCHAR(255),
-ALTER COLUMN latitude TYPE FLOAT,
-ALTER COLUMN country_code TYPE VARCHAR(2),
-ALTER COLUMN continent TYPE VARCHAR(255);
+DROP TABLE IF EXISTS "dim_date_times" CASCADE;
+CREATE TABLE "dim_date_times" ("timestamp" TEXT, "month" VARCHAR(2), "year" VARCHAR(4), "day" VARCHAR(2), "time_period" VARCHAR(10), "date_uuid" UUID, "purchase_date" TIMESTAMP, "purchase_datetime" TIMESTAMP);
 
-ALTER TABLE dim_products
-ADD COLUMN weight_class VARCHAR(14);
+DROP TABLE IF EXISTS "orders_table" CASCADE;
+CREATE TABLE "orders_table" ("order_id" BIGINT GENERATED ALWAYS AS IDENTITY, "date_uuid" UUID, "user_uuid" UUID, "card_number" VARCHAR(19), "store_code" VARCHAR(12), "product_code" VARCHAR(11), "product_quantity" SMALLINT);
 
-UPDATE dim_products
-SET weight_class = 
-  CASE 
-    WHEN weight_kg >= 0 AND weight_kg < 2 THEN 'Light'
-    WHEN weight_kg >= 2 AND weight_kg < 40 THEN 'Mid_Sized'
-    WHEN weight_kg >= 40 AND weight_kg < 140 THEN 'Heavy'
-    WHEN weight_kg >= 140 THEN 'Truck_Required'
-  END;
+-- 2. The extra rows and primary keys are added after the load, then the foreign keys.
+ALTER TABLE "dim_users" ADD PRIMARY KEY ("user_uuid");
 
-ALTER TABLE dim_products
-DROP COLUMN "Unnamed: 0";
+ALTER TABLE "dim_card_details" ADD PRIMARY KEY ("card_number");
 
-ALTER TABLE dim_products
-RENAME COLUMN removed TO still_available;
+INSERT INTO "dim_store_details" ("address", "longitude", "locality", "store_code", "staff_numbers", "opening_date", "store_type", "latitude", "country_code", "continent") VALUES (NULL, NULL, NULL, 'WEB-1388012W', 325, '2010-06-12', 'Web Portal', NULL, 'GB', 'Europe');
+ALTER TABLE "dim_store_details" ADD PRIMARY KEY ("store_code");
 
-ALTER TABLE dim_products
-ALTER COLUMN product_price_sterling TYPE FLOAT,
-ALTER COLUMN weight_kg TYPE FLOAT,
-ALTER COLUMN "EAN" TYPE VARCHAR(17),
-ALTER COLUMN product_code TYPE VARCHAR(11),
-ALTER COLUMN date_added TYPE DATE,
-ALTER COLUMN uuid TYPE UUID USING uuid::uuid,
-ALTER COLUMN weight_class TYPE VARCHAR(14); 
+ALTER TABLE "dim_products" ADD PRIMARY KEY ("product_code");
 
-ALTER TABLE dim_products
-ALTER COLUMN still_available TYPE BOOLEAN USING 
-  CASE WHEN still_available = 'Still_available' THEN TRUE ELSE FALSE END;
+ALTER TABLE "dim_date_times" ADD PRIMARY KEY ("date_uuid");
 
-ALTER TABLE dim_date_times
-ALTER COLUMN month TYPE VARCHAR(2),
-ALTER COLUMN year TYPE VARCHAR(4),
-ALTER COLUMN day TYPE VARCHAR(2),
-ALTER COLUMN time_period TYPE VARCHAR(10),
-ALTER COLUMN date_uuid TYPE UUID USING date_uuid::uuid; 
+ALTER TABLE "orders_table" ADD CONSTRAINT "fk_orders_users" FOREIGN KEY ("user_uuid") REFERENCES "dim_users" ("user_uuid");
+ALTER TABLE "orders_table" ADD CONSTRAINT "fk_orders_card" FOREIGN KEY ("card_number") REFERENCES "dim_card_details" ("card_number");
+ALTER TABLE "orders_table" ADD CONSTRAINT "fk_orders_product" FOREIGN KEY ("product_code") REFERENCES "dim_products" ("product_code");
+ALTER TABLE "orders_table" ADD CONSTRAINT "fk_orders_date" FOREIGN KEY ("date_uuid") REFERENCES "dim_date_times" ("date_uuid");
 
-ALTER TABLE dim_card_details
-ALTER COLUMN card_number TYPE VARCHAR(19),
-ALTER COLUMN expiry_date TYPE VARCHAR(5),
-ALTER COLUMN date_payment_confirmed TYPE DATE USING date_payment_confirmed::date;
-
-ALTER TABLE dim_store_details
-ADD PRIMARY KEY (store_code);
-
-ALTER TABLE dim_products
-ADD PRIMARY KEY (product_code);
-
-ALTER TABLE dim_date_times
-ADD PRIMARY KEY (date_uuid);
-
-ALTER TABLE dim_card_details
-ADD PRIMARY KEY (card_number);
-
-ALTER TABLE dim_users
-ADD PRIMARY KEY (user_uuid);
-
-ALTER TABLE orders_table
-ADD CONSTRAINT fk_orders_users
-FOREIGN KEY (user_uuid) REFERENCES dim_users(user_uuid);
-
-ALTER TABLE orders_table
-ADD CONSTRAINT fk_orders_card
-FOREIGN KEY (card_number) REFERENCES dim_card_details(card_number);
-
-ALTER TABLE dim_store_details
-ALTER COLUMN store_code TYPE VARCHAR(12);
-
-INSERT INTO dim_store_details (address, longitude, locality, store_code, staff_numbers, opening_date, store_type, latitude, country_code, continent)
-VALUES (NULL, NULL, NULL, 'WEB-1388012W', 325,'2010-06-12', 'Web Portal', NULL, 'GB', 'Europe');
-
-ALTER TABLE orders_table
-ADD CONSTRAINT fk_orders_product
-FOREIGN KEY (product_code) REFERENCES dim_products(product_code);
-
-ALTER TABLE orders_table
-ADD CONSTRAINT fk_orders_date
-FOREIGN KEY (date_uuid) REFERENCES dim_date_times(date_uuid);
+-- 3. The indexes are built last, in parallel, and the planner statistics updated.
+CREATE INDEX IF NOT EXISTS "ix_orders_table_date_uuid" ON "orders_table" ("date_uuid");
+CREATE INDEX IF NOT EXISTS "ix_orders_table_user_uuid" ON "orders_table" ("user_uuid");
+CREATE INDEX IF NOT EXISTS "ix_orders_table_card_number" ON "orders_table" ("card_number");
+CREATE INDEX IF NOT EXISTS "ix_orders_table_store_code" ON "orders_table" ("store_code");
+CREATE INDEX IF NOT EXISTS "ix_orders_table_product_code" ON "orders_table" ("product_code");
+ANALYZE "dim_users";
+ANALYZE "dim_card_details";
+ANALYZE "dim_store_details";
+ANALYZE "dim_products";
+ANALYZE "dim_date_times";
+ANALYZE "orders_table";
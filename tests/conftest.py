@@ -0,0 +1,41 @@
+import os
+import sys
+import uuid
+import pytest
+
+# the modules are flat files at the top of the repository, so the tests import them from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def sqlite_creds(tmp_path):
+    '''
+    The credentials file of an empty SQLite sales_data database, in the URL form DatabaseConnector reads.
+    '''
+    creds_path = tmp_path / 'sales_data_creds.yaml'
+    creds_path.write_text(f"URL: sqlite:///{tmp_path / 'sales_data.db'}\n")
+    return str(creds_path)
+
+@pytest.fixture
+def postgres_creds(tmp_path):
+    '''
+    The credentials file of an empty schema in the PostgreSQL database at TEST_POSTGRES_URL, which is dropped afterwards.
+    The tests that need PostgreSQL's own behaviour are skipped when it is not set.
+    '''
+    postgres_url = os.environ.get('TEST_POSTGRES_URL')
+    if not postgres_url:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.engine import make_url
+
+    schema_name = f"test_{uuid.uuid4().hex[:12]}"
+    admin_engine = create_engine(postgres_url)
+    with admin_engine.begin() as connection:
+        connection.execute(text(f"CREATE SCHEMA {schema_name}"))
+    # every connection made from the credentials file works in the new schema
+    schema_url = make_url(postgres_url).update_query_dict({'options': f'-csearch_path={schema_name}'})
+    creds_path = tmp_path / 'postgres_creds.yaml'
+    creds_path.write_text(f"URL: '{schema_url.render_as_string(hide_password=False)}'\n")
+    yield str(creds_path)
+    with admin_engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA {schema_name} CASCADE"))
+    admin_engine.dispose()
@@ -0,0 +1,92 @@
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from checkpoints import CheckpointStore
+from database_utils import DatabaseConnector
+import main
+from main import PipelineContext
+from pipeline import Pipeline
+
+def make_pipeline(calls, versions, failing=()):
+    def stage(name):
+        def run(context):
+            calls.append(name)
+            if name in failing:
+                raise RuntimeError(f"{name} failed")
+            return 1
+        return run
+
+    pipeline = Pipeline(max_workers=2)
+    pipeline.add_stage('extract', stage('extract'), fingerprint=lambda context: versions['extract'])
+    pipeline.add_stage('load', stage('load'), depends_on=('extract',))
+    pipeline.add_stage('report', stage('report'), depends_on=('load',))
+    return pipeline
+
+def test_resumed_run_restarts_from_the_failed_stage(tmp_path):
+    calls, versions = [], {'extract': 'v1'}
+    with pytest.raises(RuntimeError, match='load'):
+        make_pipeline(calls, versions, failing=('load',)).run(None, checkpoints=CheckpointStore(str(tmp_path)))
+    assert calls == ['extract', 'load']
+
+    checkpoints = CheckpointStore(str(tmp_path))
+    assert checkpoints.manifest['extract']['status'] == 'done' and checkpoints.manifest['load']['status'] == 'failed'
+    assert 'RuntimeError: load failed' in checkpoints.manifest['load']['error']
+
+    calls.clear()
+    make_pipeline(calls, versions).run(None, checkpoints=checkpoints, resume=True)
+    assert calls == ['load', 'report']
+
+    # a run with nothing left to do skips every stage
+    calls.clear()
+    make_pipeline(calls, versions).run(None, checkpoints=CheckpointStore(str(tmp_path)), resume=True)
+    assert calls == []
+
+def test_changed_source_runs_its_stage_and_everything_downstream_again(tmp_path):
+    calls, versions = [], {'extract': 'v1'}
+    make_pipeline(calls, versions).run(None, checkpoints=CheckpointStore(str(tmp_path)))
+
+    calls.clear()
+    versions['extract'] = 'v2'
+    make_pipeline(calls, versions).run(None, checkpoints=CheckpointStore(str(tmp_path)), resume=True)
+    assert calls == ['extract', 'load', 'report']
+
+def test_resumed_load_stage_uploads_the_cleaned_output_it_kept(tmp_path, sqlite_creds, monkeypatch):
+    extractions = []
+    raw_cards_df = pd.DataFrame({'card_number': ['4000000000000001', '4000000000000002'], 'expiry_date': ['01/30', '02/30'],
+                                 'card_provider': ['VISA 16 digit', 'Mastercard'], 'date_payment_confirmed': ['2022-05-01', '2022-05-02']})
+    monkeypatch.setattr(main, 'extract_card_details', lambda context: extractions.append(1) or raw_cards_df)
+
+    with DatabaseConnector() as connector:
+        upload_to_db = connector.upload_to_db
+        def failing_upload(*args, **kwargs):
+            raise ConnectionError('the database went away')
+
+        pipeline = Pipeline()
+        pipeline.add_stage('card_data', main.card_data, fingerprint=lambda context: 'the same PDF')
+        monkeypatch.setattr(connector, 'upload_to_db', failing_upload)
+        checkpoints = CheckpointStore(str(tmp_path / 'checkpoints'))
+        with pytest.raises(RuntimeError):
+            pipeline.run(PipelineContext(connector, sales_data_creds=sqlite_creds, checkpoints=checkpoints), checkpoints=checkpoints)
+
+        monkeypatch.setattr(connector, 'upload_to_db', upload_to_db)
+        checkpoints = CheckpointStore(str(tmp_path / 'checkpoints'))
+        pipeline.run(PipelineContext(connector, sales_data_creds=sqlite_creds, checkpoints=checkpoints), checkpoints=checkpoints, resume=True)
+
+        # the PDF was extracted and cleaned once, and the resumed stage uploaded what was kept
+        assert len(extractions) == 1
+        assert checkpoints.manifest['card_data']['status'] == 'done' and checkpoints.manifest['card_data']['rows'] == 2
+        with connector.init_db_engine(sqlite_creds).connect() as connection:
+            assert connection.execute(text("SELECT COUNT(*) FROM dim_card_details")).scalar() == 2
+
+def test_artifact_parts_are_read_back_in_order(tmp_path):
+    checkpoints = CheckpointStore(str(tmp_path))
+    checkpoints.start('orders_data', 'fingerprint')
+    checkpoints.start_artifact('orders_data')
+    for part_number in range(3):
+        checkpoints.write_part('orders_data', part_number, pd.DataFrame({'order': [part_number * 2, part_number * 2 + 1]}))
+    assert checkpoints.reusable_artifact('orders_data') is None
+    checkpoints.complete_artifact('orders_data', parts=3, rows=6, watermark=5)
+
+    assert checkpoints.reusable_artifact('orders_data') == {'parts': 3, 'rows': 6, 'watermark': 5}
+    assert pd.concat(checkpoints.read_parts('orders_data'))['order'].tolist() == list(range(6))
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+from benchmark import benchmark_cleaning_memory, make_source_frames
+from data_cleaning import DatabaseCleaning, clean_source_frame
+
+NUM_ROWS = 20000
+
+@pytest.fixture(scope='module')
+def memory_results():
+    return benchmark_cleaning_memory(num_rows=NUM_ROWS)
+
+@pytest.mark.parametrize('table_name', ['legacy_users', 'card_details', 'store_details', 'products', 'orders_table', 'date_times'])
+def test_cleaning_peak_stays_under_a_copy_of_the_input(memory_results, table_name):
+    result = memory_results[table_name]
+    # the cleaners build the output in one pass, so at their peak they hold less than a second copy of the input
+    assert result['peak_allocated_mb'] < result['input_mb'], \
+        f"{table_name} allocated {result['peak_allocated_mb']:.1f}MB while cleaning {result['input_mb']:.1f}MB of input"
+
+def test_cleaning_leaves_the_input_unchanged():
+    cleaner = DatabaseCleaning()
+    for table_name, source_df in make_source_frames(2000).items():
+        original_df = source_df.copy(deep=True)
+        clean_source_frame(cleaner, table_name, source_df)
+        pd.testing.assert_frame_equal(source_df, original_df, obj=table_name)
+
+@pytest.mark.parametrize('table_name', ['legacy_users', 'card_details', 'store_details', 'products', 'orders_table', 'date_times'])
+def test_compact_mode_keeps_the_values_in_less_memory(table_name):
+    source_df = make_source_frames(2000)[table_name]
+    clean_df = clean_source_frame(DatabaseCleaning(), table_name, source_df)
+    compact_df = clean_source_frame(DatabaseCleaning(compact=True), table_name, source_df)
+
+    assert compact_df.memory_usage(deep=True).sum() < clean_df.memory_usage(deep=True).sum()
+    # only the dtypes differ, so the two frames upload the same rows, with a missing value as NaN in a categorical and NA in a string column
+    as_values = lambda frame_df: frame_df.astype(object).where(frame_df.notna(), None)
+    pd.testing.assert_frame_equal(as_values(compact_df), as_values(clean_df), check_dtype=False, obj=table_name)
@@ -0,0 +1,76 @@
+import pandas as pd
+
+from data_cleaning import DatabaseCleaning
+
+def test_users_keep_valid_countries_and_use_index_as_the_index():
+    users_df = pd.DataFrame({'index': [10, 11, 12], 'first_name': ['Sigfried', 'NULL', 'Guy'], 'country': ['Germany', 'NULL', 'United Kingdom'],
+                             'date_of_birth': ['1990-01-01', None, 'July 1961 14'], 'join_date': ['2020/01/02', None, '2018 October 10'],
+                             'user_uuid': ['a', 'b', 'c']})
+    clean_df = DatabaseCleaning().clean_user_data(users_df)
+
+    assert clean_df.index.tolist() == [10, 12] and clean_df.index.name == 'index'
+    assert clean_df['first_name'].dtype == 'string'
+    assert clean_df['date_of_birth'].tolist() == [pd.Timestamp('1990-01-01'), pd.Timestamp('1961-07-14')]
+    assert clean_df['join_date'].tolist() == [pd.Timestamp('2020-01-02'), pd.Timestamp('2018-10-10')]
+
+def test_cards_lose_their_question_marks_and_invalid_providers():
+    cards_df = pd.DataFrame({'card_number': ['??4000000000000001', 4000000000000002, 'NULL'], 'expiry_date': ['01/30', '02/30', 'NULL'],
+                             'card_provider': ['VISA 16 digit', 'Mastercard', 'NULL'], 'date_payment_confirmed': ['2022-05-01', 'May 2021 03', 'NULL']})
+    clean_df = DatabaseCleaning().clean_card_data(cards_df)
+
+    assert clean_df['card_number'].tolist() == [4000000000000001, 4000000000000002]
+    assert clean_df['date_payment_confirmed'].tolist() == [pd.Timestamp('2022-05-01'), pd.Timestamp('2021-05-03')]
+
+def test_stores_fix_staff_numbers_and_drop_the_web_portal_row_and_lat():
+    stores_df = pd.DataFrame({'address': [None, '1 High Street', '2 Low Road', 'x'], 'longitude': ['N/A', '1.5', '2.5', None], 'lat': None,
+                              'locality': [None, 'Belper', 'Exeter', None], 'store_code': ['WEB-1388012W', 'BL-1', 'EX-2', 'XX'],
+                              'staff_numbers': ['325', 'J78', '30e', None], 'opening_date': ['2010-06-12', '2012-01-01', '2013-01-01', None],
+                              'store_type': ['Web Portal', 'Local', 'Outlet', 'QZ6'], 'latitude': ['N/A', '50.1', '51.2', None],
+                              'country_code': ['GB', 'GB', 'GB', None], 'continent': ['Europe', 'Europe', 'eeEurope', None]})
+    clean_df = DatabaseCleaning().clean_store_data(stores_df)
+
+    assert clean_df['store_code'].tolist() == ['BL-1', 'EX-2']
+    assert clean_df['staff_numbers'].tolist() == [78, 30]
+    assert 'lat' not in clean_df.columns
+    assert clean_df['longitude'].tolist() == [1.5, 2.5]
+
+def test_products_fix_the_removed_spelling_price_and_code_case():
+    products_df = pd.DataFrame({'product_name': ['Puppy', 'Kite', 'Bad'], 'product_price': ['£9.99', '£1.50', 'XX'], 'weight_kg': [1.0, None, 2.0],
+                                'category': ['toys-and-games', 'sports-and-leisure', 'XX'], 'EAN': ['1', '2', '3'],
+                                'date_added': ['2005-12-02', '2006 January 01', 'XX'], 'uuid': ['a', 'b', 'c'],
+                                'removed': ['Still_avaliable', 'Removed', 'XX'], 'product_code': ['a1-1234567b', 'b2-7654321c', 'XX']})
+    clean_df = DatabaseCleaning().clean_products_data(products_df)
+
+    assert clean_df['removed'].tolist() == ['Still_available', 'Removed']
+    assert clean_df['product_code'].tolist() == ['A1-1234567B', 'B2-7654321C']
+    # the renamed price goes after the other columns
+    assert list(clean_df.columns)[-1] == 'product_price_sterling' and clean_df['product_price_sterling'].tolist() == [9.99, 1.5]
+    # the missing weight is the mean of the known ones
+    assert clean_df['weight_kg'].tolist() == [1.0, 1.0]
+
+def test_orders_drop_the_personal_columns():
+    orders_df = pd.DataFrame({'level_0': [0], 'index': [0], 'date_uuid': ['d'], 'first_name': [None], 'last_name': [None], 'user_uuid': ['u'],
+                              'card_number': ['4000000000000001'], 'store_code': ['BL-1'], 'product_code': ['a1-1234567b'], 'product_quantity': [3], '1': [None]})
+    clean_df = DatabaseCleaning().clean_orders_data(orders_df)
+
+    assert {'first_name', 'last_name', '1'}.isdisjoint(clean_df.columns)
+    assert clean_df['product_code'].tolist() == ['A1-1234567B']
+
+def test_dates_keep_valid_time_periods_and_build_the_purchase_datetime():
+    dates_df = pd.DataFrame({'timestamp': ['22:00:06', '09:00:00', 'XX'], 'month': ['9', '2', 'XX'], 'year': ['2012', '1997', 'XX'],
+                             'day': ['19', '28', 'XX'], 'time_period': ['Evening', 'Morning', 'XX'], 'date_uuid': ['d1', 'd2', 'XX']})
+    clean_df = DatabaseCleaning().clean_date_data(dates_df)
+
+    assert clean_df['date_uuid'].tolist() == ['d1', 'd2']
+    assert clean_df['purchase_datetime'].tolist() == [pd.Timestamp('2012-09-19 22:00:06'), pd.Timestamp('1997-02-28 09:00:00')]
+
+def test_one_plan_cleans_every_chunk_to_the_same_dtypes():
+    cleaner = DatabaseCleaning(compact=True)
+    chunks = [pd.DataFrame({'timestamp': ['22:00:06'], 'month': ['9'], 'year': ['2012'], 'day': ['19'], 'time_period': [time_period], 'date_uuid': ['d1']})
+              for time_period in ('Evening', 'Morning')]
+    first_df, second_df = (cleaner.clean_date_data(chunk_df) for chunk_df in chunks)
+
+    assert cleaner.cleaning_plan('date_times') is cleaner.cleaning_plan('date_times')
+    # the filter column's categories are its valid values, whatever each chunk holds
+    assert first_df['time_period'].dtype == second_df['time_period'].dtype
+    assert list(first_df['time_period'].cat.categories) == ['Evening', 'Morning', 'Late_Hours', 'Midday']
@@ -0,0 +1,21 @@
+import pandas as pd
+
+from data_cleaning import DatabaseCleaning
+
+def test_mixed_date_formats_are_parsed_and_unreadable_dates_are_nat():
+    dates = pd.Series(['2005-12-02', '2006/01/31', 'October 2012 08', 'July 1961 14', ' 1997 November 01 ', '22 March 2001', 'Aug 3rd, 2019', 'not a date', None],
+                      index=list('abcdefghi'))
+    parsed = DatabaseCleaning().parse_date_column(dates)
+
+    assert parsed.index.tolist() == list('abcdefghi')
+    assert parsed.iloc[:7].tolist() == [pd.Timestamp(date) for date in ('2005-12-02', '2006-01-31', '2012-10-08', '1961-07-14', '1997-11-01', '2001-03-22', '2019-08-03')]
+    assert parsed.iloc[7:].isna().all()
+
+def test_weights_in_mixed_units_and_multipacks_are_converted_to_kg():
+    weights = pd.Series(['1.6kg', '12 x 100g', '16oz', '500ml', '2', '77g .', '1kg', 'XX', None, '1.6kg'], name='weight')
+    weights_kg = DatabaseCleaning().parse_weight_column(weights)
+
+    assert weights_kg.name == 'weight' and weights_kg.index.equals(weights.index)
+    assert weights_kg.iloc[:7].round(6).tolist() == [1.6, 1.2, 0.453592, 0.5, 2.0, 0.077, 1.0]
+    # an unreadable or missing weight is NaN, and a repeated weight gets the same value
+    assert weights_kg.iloc[7:9].isna().all() and weights_kg.iloc[9] == 1.6
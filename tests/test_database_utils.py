@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+import importlib
+import sys
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from database_utils import DatabaseConnector
+
+def test_engine_is_created_once_per_credentials_file(sqlite_creds):
+    with DatabaseConnector() as connector:
+        engine = connector.init_db_engine(sqlite_creds)
+        assert connector.init_db_engine(sqlite_creds) is engine
+        # threads asking for the engine at the same time all get the cached one
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert set(executor.map(lambda _: id(connector.init_db_engine(sqlite_creds)), range(32))) == {id(engine)}
+
+def test_repeated_uploads_reuse_one_connection(sqlite_creds):
+    orders_df = pd.DataFrame({'order_id': range(100), 'product_quantity': 1})
+    with DatabaseConnector() as connector:
+        for chunk_number in range(10):
+            connector.upload_to_db(orders_df, 'orders_table', sqlite_creds, if_exists='replace' if chunk_number == 0 else 'append')
+        connector.upsert_to_db(orders_df, 'orders_table', sqlite_creds)
+        engine = connector.init_db_engine(sqlite_creds)
+
+        assert connector.connection_counts[sqlite_creds] == 1
+        # every connection went back to the pool
+        assert engine.pool.checkedout() == 0
+        with engine.connect() as connection:
+            assert connection.execute(text("SELECT COUNT(*) FROM orders_table")).scalar() == 1100
+
+def test_dispose_closes_the_cached_engines(sqlite_creds):
+    connector = DatabaseConnector()
+    engine = connector.init_db_engine(sqlite_creds)
+    connector.upload_to_db(pd.DataFrame({'order_id': [1]}), 'orders_table', sqlite_creds)
+    connector.dispose()
+
+    assert engine.pool.checkedin() == 0
+    # a new engine is created after dispose, and counts its own connections
+    assert connector.init_db_engine(sqlite_creds) is not engine
+    assert connector.connection_counts[sqlite_creds] == 0
+
+def test_sqlite_uploads_without_psycopg2(sqlite_creds, monkeypatch, capsys):
+    # a None entry in sys.modules makes importing psycopg2 fail, as if it were not installed
+    monkeypatch.setitem(sys.modules, 'psycopg2', None)
+    monkeypatch.delitem(sys.modules, 'database_utils')
+    database_utils = importlib.import_module('database_utils')
+
+    with database_utils.DatabaseConnector() as connector:
+        rows_per_sec = connector.upload_to_db(pd.DataFrame({'order_id': range(10)}), 'orders_table', sqlite_creds)
+    assert rows_per_sec > 0
+    # the rate is returned and logged, not printed
+    assert capsys.readouterr().out == ''
+
+@pytest.mark.parametrize('creds_fixture', ['sqlite_creds', 'postgres_creds'])
+def test_full_load_does_not_empty_a_table_foreign_keys_reference(request, creds_fixture):
+    creds = request.getfixturevalue(creds_fixture)
+    with DatabaseConnector() as connector:
+        with connector.init_db_engine(creds).begin() as connection:
+            connection.execute(text("CREATE TABLE dim_card_details (card_number VARCHAR(19) PRIMARY KEY)"))
+            connection.execute(text("CREATE TABLE orders_table (card_number VARCHAR(19) CONSTRAINT fk_orders_card REFERENCES dim_card_details (card_number))"))
+            connection.execute(text("INSERT INTO dim_card_details VALUES ('4000000000000001')"))
+            connection.execute(text("INSERT INTO orders_table VALUES ('4000000000000001')"))
+
+        # after create_schema has added the foreign keys, reloading a dimension table in full needs create_tables to run first
+        with pytest.raises(ValueError, match='orders_table.*create_tables'):
+            connector.upload_to_db(pd.DataFrame({'card_number': ['4000000000000002']}), 'dim_card_details', creds, if_exists='truncate')
+
+        with connector.init_db_engine(creds).connect() as connection:
+            assert connection.execute(text("SELECT card_number FROM dim_card_details")).scalars().all() == ['4000000000000001']
+        # a table nothing references is still emptied and reloaded
+        connector.upload_to_db(pd.DataFrame({'card_number': ['4000000000000001']}), 'orders_table', creds, if_exists='truncate')
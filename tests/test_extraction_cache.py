@@ -0,0 +1,68 @@
+import os
+import pandas as pd
+
+from data_extraction import DataExtractor
+from extraction_cache import ExtractionCache
+
+PRODUCTS = 's3://data-handling-public/products.csv'
+DATES = 's3://data-handling-public/date_details.json'
+
+def test_entry_is_reused_while_its_validator_matches(tmp_path):
+    cache = ExtractionCache(str(tmp_path))
+    # a mixed column, like the card numbers with '?' in some of them
+    products_df = pd.DataFrame({'product_code': ['A1-1234567B', 'B2-7654321C'], 'EAN': [1234567890123, '??123']})
+    cache.put(PRODUCTS, products_df, validator='"etag-1"')
+
+    pd.testing.assert_frame_equal(cache.get(PRODUCTS, '"etag-1"'), products_df.astype({'EAN': 'string'}))
+    # the manifest is kept on disk, so a new run finds the entry
+    assert ExtractionCache(str(tmp_path)).get(PRODUCTS, '"etag-1"') is not None
+
+def test_entry_is_dropped_when_its_source_changes_or_it_expires(tmp_path, monkeypatch):
+    cache = ExtractionCache(str(tmp_path), ttl=60)
+    cache.put(PRODUCTS, pd.DataFrame({'product_code': ['A1-1234567B']}), validator='"etag-1"')
+    path = cache.manifest[cache._key(PRODUCTS)]['path']
+
+    assert cache.get(PRODUCTS, '"etag-2"') is None
+    assert not os.path.exists(path) and cache.manifest == {}
+    # a miss for a changed source does not bring the old entry back
+    assert cache.get(PRODUCTS, '"etag-1"') is None
+
+    cache.put(DATES, pd.DataFrame({'day': ['1']}))
+    saved_at = cache.saved_at(DATES)
+    monkeypatch.setattr('extraction_cache.time.time', lambda: saved_at + 61)
+    assert cache.get(DATES) is None
+    # a longer TTL for one source keeps it
+    cache.put(DATES, pd.DataFrame({'day': ['1']}))
+    monkeypatch.setattr('extraction_cache.time.time', lambda: saved_at + 200)
+    assert cache.get(DATES, ttl=3600) is not None
+
+def test_least_recently_used_entries_are_evicted_over_the_size_limit(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr('extraction_cache.time.time', lambda: next(clock))
+    entry_df = pd.DataFrame({'value': range(1000)})
+    sources = [f"https://example.com/source_{number}.csv" for number in range(3)]
+
+    cache = ExtractionCache(str(tmp_path), max_bytes=None)
+    cache.put(sources[0], entry_df)
+    entry_size = cache.manifest[cache._key(sources[0])]['size']
+    # room for two entries
+    cache.max_bytes = 2 * entry_size
+    cache.put(sources[1], entry_df)
+    # reading the first entry makes the second the least recently used
+    cache.get(sources[0])
+    cache.put(sources[2], entry_df)
+
+    assert sorted(entry['source'] for entry in cache.manifest.values()) == [sources[0], sources[2]]
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.parquet')]) == 2
+
+def test_cached_extraction_runs_the_extraction_once_per_version(tmp_path):
+    extractor = DataExtractor(cache=ExtractionCache(str(tmp_path)))
+    extractions = []
+
+    def extract():
+        extractions.append(1)
+        return pd.DataFrame({'store_code': ['WEB-1388012W']})
+
+    for validator in ('"etag-1"', '"etag-1"', '"etag-2"'):
+        assert extractor._cached_extract(PRODUCTS, validator, extract)['store_code'].tolist() == ['WEB-1388012W']
+    assert len(extractions) == 2
@@ -0,0 +1,14 @@
+from benchmark import EXTRACT_AND_CHART_MODULES, HEAVY_MODULES, HELP_IMPORT_BUDGET, QUERY_IMPORT_BUDGET, profile_imports
+
+def test_help_imports_no_heavy_modules():
+    seconds, modules = profile_imports(['--help'])
+    assert [module for module in HEAVY_MODULES if module in modules] == []
+    assert seconds < HELP_IMPORT_BUDGET
+
+def test_query_imports_no_extract_or_chart_modules(sqlite_creds):
+    # the query subcommand runs the business queries against an empty SQLite database, which is enough to import everything it needs
+    seconds, modules = profile_imports(['--sales-data-creds', sqlite_creds, '--no-chart', 'query'])
+    # the queries ran, rather than main.py stopping before it reached them
+    assert {'sqlalchemy', 'query_runner'} <= modules
+    assert [module for module in EXTRACT_AND_CHART_MODULES if module in modules] == []
+    assert seconds < QUERY_IMPORT_BUDGET
@@ -0,0 +1,109 @@
+import pandas as pd
+from sqlalchemy import text
+
+from benchmark import make_source_frames
+
+from database_utils import DatabaseConnector
+import main
+from main import PipelineContext
+from schema import TABLE_SCHEMAS, add_constraints, create_tables
+
+def raw_cards(*rows):
+    return pd.DataFrame(rows, columns=['card_number', 'expiry_date', 'card_provider', 'date_payment_confirmed'])
+
+def raw_users(indexes):
+    return pd.DataFrame({
+        'index': indexes,
+        'first_name': [f'first {index}' for index in indexes],
+        'last_name': [f'last {index}' for index in indexes],
+        'date_of_birth': '1990-01-01',
+        'company': 'Company',
+        'email_address': [f'user{index}@example.com' for index in indexes],
+        'address': 'Address',
+        'country': 'United Kingdom',
+        'country_code': 'GB',
+        'phone_number': '0123456789',
+        'join_date': '2020-01-01',
+        'user_uuid': [f'00000000-0000-0000-0000-{index:012d}' for index in indexes],
+    })
+
+def create_and_load(connector, creds, table_name, load):
+    # the pipeline creates the typed table, loads it and then adds its primary key, which the incremental upserts use
+    table_schemas = {table_name: TABLE_SCHEMAS[table_name]}
+    create_tables(connector.init_db_engine(creds), table_schemas)
+    rows = load()
+    add_constraints(connector.init_db_engine(creds), table_schemas)
+    return rows
+
+def stored_rows(connector, creds, query):
+    with connector.init_db_engine(creds).connect() as connection:
+        return connection.execute(text(query)).fetchall()
+
+def test_incremental_card_load_adds_new_late_dated_and_changed_cards(sqlite_creds, monkeypatch):
+    first_pdf = raw_cards(('4000000000000001', '01/30', 'VISA 16 digit', '2022-05-01'),
+                          ('4000000000000002', '02/30', 'VISA 16 digit', '2022-05-10'))
+    # the second PDF changes a card's expiry date, and adds a card confirmed before the last load's latest date
+    second_pdf = raw_cards(('4000000000000001', '01/30', 'VISA 16 digit', '2022-05-01'),
+                           ('4000000000000002', '03/31', 'VISA 16 digit', '2022-05-10'),
+                           ('4000000000000003', '04/32', 'Mastercard', '2021-01-01'))
+
+    with DatabaseConnector() as connector:
+        monkeypatch.setattr(main, 'extract_card_details', lambda context: first_pdf)
+        create_and_load(connector, sqlite_creds, 'dim_card_details', lambda: main.card_data(PipelineContext(connector, sales_data_creds=sqlite_creds)))
+
+        monkeypatch.setattr(main, 'extract_card_details', lambda context: second_pdf)
+        upserted = []
+        upsert_to_db = connector.upsert_to_db
+        monkeypatch.setattr(connector, 'upsert_to_db', lambda input_df, *args, **kwargs: upserted.append(input_df) or upsert_to_db(input_df, *args, **kwargs))
+        main.card_data(PipelineContext(connector, sales_data_creds=sqlite_creds, incremental=True))
+
+        # only the changed and the new card are sent again
+        assert sorted(upserted[0]['card_number'].astype(str)) == ['4000000000000002', '4000000000000003']
+        assert stored_rows(connector, sqlite_creds, "SELECT card_number, expiry_date FROM dim_card_details ORDER BY card_number") == [
+            ('4000000000000001', '01/30'), ('4000000000000002', '03/31'), ('4000000000000003', '04/32')]
+
+def test_incremental_product_load_upserts_into_the_referenced_table(sqlite_creds, monkeypatch):
+    first_source = make_source_frames(40)['products']
+    # the second source adds a product and changes a price
+    second_source = pd.concat([first_source, make_source_frames(1, start_row=40)['products']], ignore_index=True)
+
+    with DatabaseConnector() as connector:
+        monkeypatch.setattr(main, 'extract_products', lambda context: first_source)
+        first_products = create_and_load(connector, sqlite_creds, 'dim_products', lambda: main.product_data(PipelineContext(connector, sales_data_creds=sqlite_creds)))
+
+        changed_code = first_products['product_code'].iloc[0]
+        # the cleaner upper-cases the product codes
+        second_source.loc[second_source['product_code'].str.upper() == changed_code, 'product_price'] = '£1234.00'
+        monkeypatch.setattr(main, 'extract_products', lambda context: second_source)
+        second_products = main.product_data(PipelineContext(connector, sales_data_creds=sqlite_creds, incremental=True))
+
+        stored_prices = dict(stored_rows(connector, sqlite_creds, "SELECT product_code, product_price_sterling FROM dim_products"))
+        assert len(second_products) == len(first_products) + 1
+        assert sorted(stored_prices) == sorted(second_products['product_code'])
+        assert stored_prices[changed_code] == 1234.0
+
+def test_changed_rows_finds_nothing_when_the_source_is_unchanged(sqlite_creds):
+    cards_df = pd.DataFrame({'card_number': [4000000000000001, 4000000000000002], 'expiry_date': ['01/30', '02/30'],
+                             'date_payment_confirmed': pd.to_datetime(['2022-05-01', None])})
+    with DatabaseConnector() as connector:
+        connector.upload_to_db(cards_df.astype({'card_number': str}), 'dim_card_details', sqlite_creds)
+
+        assert connector.changed_rows(cards_df, 'dim_card_details', sqlite_creds, ['card_number']).empty
+
+def test_incremental_rds_load_reads_rows_past_the_watermark(sqlite_creds, tmp_path):
+    rds_creds = tmp_path / 'rds_creds.yaml'
+    rds_creds.write_text(f"URL: sqlite:///{tmp_path / 'rds.db'}\n")
+
+    with DatabaseConnector() as connector:
+        connector.upload_to_db(raw_users([0, 1, 2]), 'legacy_users', str(rds_creds))
+        full_load = lambda: main.user_data(PipelineContext(connector, rds_creds=str(rds_creds), sales_data_creds=sqlite_creds, chunksize=2))
+        assert create_and_load(connector, sqlite_creds, 'dim_users', full_load) == 3
+        # the full load records the last row number it read
+        assert connector.read_watermark('legacy_users', sqlite_creds) == '2'
+
+        connector.upload_to_db(raw_users([3, 4]), 'legacy_users', str(rds_creds), if_exists='append')
+        assert main.user_data(PipelineContext(connector, rds_creds=str(rds_creds), sales_data_creds=sqlite_creds, chunksize=2, incremental=True)) == 2
+
+        assert connector.read_watermark('legacy_users', sqlite_creds) == '4'
+        assert [row[0] for row in stored_rows(connector, sqlite_creds, "SELECT first_name FROM dim_users ORDER BY first_name")] == [
+            'first 0', 'first 1', 'first 2', 'first 3', 'first 4']
@@ -0,0 +1,95 @@
+import logging
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from database_utils import DatabaseConnector
+from integrity import ReferentialIntegrityChecker
+import main
+
+USER = '0a1b2c3d-0000-4000-8000-000000000001'
+
+def orders_chunk(rows):
+    return pd.DataFrame(rows, columns=['date_uuid', 'user_uuid', 'card_number', 'store_code', 'product_code', 'product_quantity'])
+
+def make_checker(action):
+    checker = ReferentialIntegrityChecker('orders_table', action=action)
+    checker.add_keys('dim_users', 'user_uuid', pd.Series([USER]))
+    checker.add_keys('dim_card_details', 'card_number', pd.Series(['4000000000000001']))
+    checker.add_keys('dim_products', 'product_code', pd.Series(['A1-1234567B']))
+    checker.add_keys('dim_date_times', 'date_uuid', pd.Series(['d0000000-0000-4000-8000-000000000001']))
+    return checker
+
+@pytest.fixture
+def chunks():
+    return [orders_chunk([('d0000000-0000-4000-8000-000000000001', USER.upper(), '4000000000000001', 'WEB-1388012W', 'A1-1234567B', 1),
+                          ('d0000000-0000-4000-8000-000000000001', USER, '4999999999999999', 'WEB-1388012W', 'A1-1234567B', 2),
+                          ('d0000000-0000-4000-8000-000000000001', USER, '4999999999999999', 'WEB-1388012W', 'Z9-0000000Z', 3),
+                          (None, USER, '4000000000000001', 'WEB-1388012W', 'A1-1234567B', 4)]),
+            orders_chunk([('d0000000-0000-4000-8000-000000000001', USER, '4999999999999999', 'WEB-1388012W', 'A1-1234567B', 5)])]
+
+def test_report_counts_orphans_across_chunks_and_keeps_every_row(chunks):
+    checker = make_checker('report')
+    checked = [checker.check(chunk_df) for chunk_df in chunks]
+
+    assert [len(chunk.rows) for chunk in checked] == [4, 1]
+    # UUIDs match whatever their case, and a null key is not an orphan
+    assert checker.reports['fk_orders_users'].orphan_rows == 0
+    assert checker.reports['fk_orders_date'].orphan_rows == 0
+    card_report = checker.reports['fk_orders_card']
+    assert (card_report.rows_checked, card_report.orphan_rows, len(card_report.orphan_keys), card_report.samples) == (5, 3, 1, ['4999999999999999'])
+    assert checker.reports['fk_orders_product'].samples == ['Z9-0000000Z']
+    assert checker.orphan_rows == 4
+
+def test_report_is_logged(chunks, caplog):
+    checker = make_checker('report')
+    checker.check(chunks[0])
+    with caplog.at_level(logging.INFO, logger='integrity'):
+        checker.log_report()
+
+    warnings = [record.getMessage() for record in caplog.records if record.levelno == logging.WARNING]
+    assert len(warnings) == 2
+    assert any('fk_orders_card orphans found, 2 of 4 rows' in message and '4999999999999999' in message for message in warnings)
+
+def test_quarantine_leaves_the_orphans_out_with_the_keys_they_break(chunks):
+    checked = make_checker('quarantine').check(chunks[0])
+
+    assert checked.rows['product_quantity'].tolist() == [1, 4]
+    assert checked.orphans['product_quantity'].tolist() == [2, 3]
+    assert checked.orphans['orphan_keys'].tolist() == ['fk_orders_card', 'fk_orders_card,fk_orders_product']
+
+def test_repair_returns_each_missing_key_once(chunks):
+    checker = make_checker('repair')
+    first, second = checker.check(chunks[0]), checker.check(chunks[1])
+
+    assert len(first.rows) == 4
+    assert {table_name: keys_df.iloc[:, 0].tolist() for table_name, keys_df in first.missing_keys.items()} == {
+        'dim_card_details': ['4999999999999999'], 'dim_products': ['Z9-0000000Z']}
+    # the card was already added for the first chunk
+    assert second.missing_keys == {}
+
+def test_keys_are_loaded_from_the_database(chunks, sqlite_creds):
+    with DatabaseConnector() as connector:
+        connector.upload_to_db(pd.DataFrame({'user_uuid': [USER]}), 'dim_users', sqlite_creds)
+        connector.upload_to_db(pd.DataFrame({'card_number': ['4000000000000001', '4999999999999999']}), 'dim_card_details', sqlite_creds)
+        connector.upload_to_db(pd.DataFrame({'product_code': ['A1-1234567B']}), 'dim_products', sqlite_creds)
+        connector.upload_to_db(pd.DataFrame({'date_uuid': ['d0000000-0000-4000-8000-000000000001']}), 'dim_date_times', sqlite_creds)
+        checker = ReferentialIntegrityChecker('orders_table')
+        checker.load_keys(connector.init_db_engine(sqlite_creds), chunksize=1)
+
+    checker.check(chunks[0])
+    assert {name: report.orphan_rows for name, report in checker.reports.items() if report.orphan_rows} == {'fk_orders_product': 1}
+
+def test_unknown_action_is_refused():
+    with pytest.raises(ValueError, match='quarantine'):
+        ReferentialIntegrityChecker('orders_table', action='delete')
+
+@pytest.mark.parametrize('action, table_name, rows', [('quarantine', 'orders_table_quarantine', 2), ('repair', 'dim_card_details', 1)])
+def test_orphans_are_quarantined_or_repaired_in_the_database(chunks, sqlite_creds, action, table_name, rows):
+    with DatabaseConnector() as connector:
+        context = main.PipelineContext(connector, sales_data_creds=sqlite_creds)
+        rows_to_upload = main.upload_checked(context, make_checker(action), chunks[0], first_chunk=True)
+        with connector.init_db_engine(sqlite_creds).connect() as connection:
+            assert connection.execute(text(f"SELECT COUNT(*) FROM {table_name}")).scalar() == rows
+
+    assert len(rows_to_upload) == (2 if action == 'quarantine' else 4)
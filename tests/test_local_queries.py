@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import text
+
+from benchmark import DESTINATION_TABLES, make_source_frames
+from data_cleaning import DatabaseCleaning, clean_source_frame
+from database_utils import DatabaseConnector
+from local_queries import LocalQueryEngine, cross_check
+from query_runner import QueryRunner, frames_match
+from schema import TABLE_SCHEMAS, create_tables, extra_row_statements, prepare_frame
+
+QUERIES = 'sql_files/essential_queries/business_queries.sql'
+
+@pytest.fixture(scope='module')
+def clean_frames():
+    cleaner = DatabaseCleaning()
+    return {DESTINATION_TABLES[source_name]: clean_source_frame(cleaner, source_name, source_df) for source_name, source_df in make_source_frames(2000).items()}
+
+@pytest.fixture
+def local_engine(clean_frames, monkeypatch):
+    # the query files are read relative to the repository
+    monkeypatch.chdir(__file__.rsplit('/tests/', 1)[0])
+    local_engine = LocalQueryEngine()
+    for table_name, clean_df in clean_frames.items():
+        local_engine.load_frame(table_name, clean_df)
+    local_engine.add_extra_rows()
+    yield local_engine
+    local_engine.close()
+
+def test_business_queries_run_unchanged_on_the_cleaned_frames(local_engine):
+    results = local_engine.run_file(QUERIES)
+    reads = [result for result in results if result.kind == 'read']
+
+    assert [result.error for result in results if result.error is not None] == []
+    assert [result.query_number for result in reads] == list(range(1, len(reads) + 1))
+    assert all(result.data is not None for result in reads)
+
+def test_parquet_snapshot_gives_the_same_answers(local_engine, tmp_path):
+    local_engine.save_parquet(str(tmp_path))
+    parquet_engine = LocalQueryEngine()
+    parquet_engine.load_parquet(str(tmp_path))
+
+    for local_result, parquet_result in zip(local_engine.run_file(QUERIES), parquet_engine.run_file(QUERIES)):
+        if local_result.kind == 'read':
+            assert frames_match(local_result.data, parquet_result.data), f"query {local_result.query_number}"
+    parquet_engine.close()
+
+def test_local_answers_match_postgresql_on_the_same_rows(local_engine, clean_frames, postgres_creds):
+    with DatabaseConnector() as connector:
+        engine = connector.init_db_engine(postgres_creds)
+        create_tables(engine)
+        for table_name, clean_df in clean_frames.items():
+            connector.upload_to_db(prepare_frame(TABLE_SCHEMAS[table_name], clean_df), table_name, postgres_creds, if_exists='truncate')
+        with engine.begin() as connection:
+            for table_name in TABLE_SCHEMAS:
+                for statement in extra_row_statements(TABLE_SCHEMAS[table_name]):
+                    connection.execute(text(statement))
+
+        assert cross_check(local_engine.run_file(QUERIES), QueryRunner(engine).run_file(QUERIES)) == []
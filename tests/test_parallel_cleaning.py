@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pytest
+
+from benchmark import make_source_frames
+from data_cleaning import DatabaseCleaning, clean_source_frame
+from parallel_cleaning import ParallelCleaner
+
+@pytest.fixture(scope='module')
+def source_frames():
+    return make_source_frames(3000)
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_parallel_cleaning_gives_the_serial_rows(source_frames, compact):
+    serial_cleaner = DatabaseCleaning(compact=compact)
+    # small partitions, so every table is split between the workers
+    with ParallelCleaner(max_workers=2, compact=compact, partition_rows=700, min_rows=0) as parallel_cleaner:
+        for table_name, source_df in source_frames.items():
+            serial_df = clean_source_frame(serial_cleaner, table_name, source_df)
+            parallel_df = clean_source_frame(parallel_cleaner, table_name, source_df)
+            # the partial weight sums add up in a different order, so the imputed weights may differ in the last bits
+            pd.testing.assert_frame_equal(serial_df, parallel_df, check_exact=False, obj=table_name)
+
+def test_threads_cleaning_at_once_share_one_worker_pool(source_frames):
+    with ParallelCleaner(max_workers=2, partition_rows=700, min_rows=0) as parallel_cleaner:
+        executors = []
+        worker_pool = parallel_cleaner._worker_pool
+
+        def record_pool():
+            executors.append(worker_pool())
+            return executors[-1]
+
+        parallel_cleaner._worker_pool = record_pool
+        with ThreadPoolExecutor(max_workers=4) as stage_threads:
+            list(stage_threads.map(lambda _: parallel_cleaner.clean_card_data(source_frames['card_details']), range(4)))
+
+        assert len(executors) == 4 and len({id(executor) for executor in executors}) == 1
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from pypdf import PdfWriter
+
+import data_extraction
+from data_extraction import DataExtractor
+
+def blank_pdf(path, page_count):
+    writer = PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(width=200, height=200)
+    with open(path, 'wb') as pdf_file:
+        writer.write(pdf_file)
+    return str(path)
+
+def test_pages_are_counted_from_the_page_tree(tmp_path):
+    assert DataExtractor()._count_pdf_pages(blank_pdf(tmp_path / 'cards.pdf', 7)) == 7
+
+def test_pdf_is_parsed_in_page_ranges_in_page_order(tmp_path, monkeypatch):
+    parsed_pages = []
+
+    def read_pdf(pdf_path, pages):
+        parsed_pages.append(pages)
+        return [pd.DataFrame({'card_number': [f'{pages}-a', f'{pages}-b']})]
+
+    # threads stand in for the worker processes and a stub for tabula, which needs a JVM
+    monkeypatch.setattr(data_extraction, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(data_extraction.tabula, 'read_pdf', read_pdf)
+    pdf_df = DataExtractor().retrieve_pdf_data(blank_pdf(tmp_path / 'cards.pdf', 5), max_workers=2)
+
+    # every page is parsed once, on its own
+    assert sorted(parsed_pages) == [1, 2, 3, 4, 5]
+    assert list(pdf_df.index.get_level_values('pdf_page')) == [1, 1, 2, 2, 3, 3, 4, 4, 5, 5]
+    assert pdf_df['card_number'].tolist()[:3] == ['1-a', '1-b', '2-a']
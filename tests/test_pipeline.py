@@ -0,0 +1,63 @@
+import threading
+import pytest
+
+from pipeline import Pipeline
+from tracing import Tracer
+
+def test_independent_stages_run_at_the_same_time_and_dependents_wait():
+    both_loads_running = threading.Barrier(2, timeout=5)
+    order = []
+
+    def load(name):
+        def run(context):
+            # each load waits for the other, which only returns if they run at the same time
+            both_loads_running.wait()
+            order.append(name)
+            return name
+        return run
+
+    pipeline = Pipeline(max_workers=2)
+    pipeline.add_stage('create_tables', lambda context: order.append('create_tables'))
+    pipeline.add_stage('user_data', load('user_data'), depends_on=('create_tables',))
+    pipeline.add_stage('card_data', load('card_data'), depends_on=('create_tables',))
+    pipeline.add_stage('create_schema', lambda context: order.append('create_schema') or len(order), depends_on=('user_data', 'card_data'))
+    results = pipeline.run(None)
+
+    assert order[0] == 'create_tables' and order[-1] == 'create_schema'
+    assert results == {'create_tables': None, 'user_data': 'user_data', 'card_data': 'card_data', 'create_schema': 4}
+    assert set(pipeline.timings) == {'create_tables', 'user_data', 'card_data', 'create_schema'}
+
+def test_a_failed_stage_stops_only_the_stages_that_depend_on_it():
+    ran = []
+    pipeline = Pipeline(max_workers=2)
+    pipeline.add_stage('stores_data', lambda context: 1 / 0)
+    pipeline.add_stage('product_data', lambda context: ran.append('product_data'))
+    pipeline.add_stage('create_schema', lambda context: ran.append('create_schema'), depends_on=('stores_data', 'product_data'))
+    pipeline.add_stage('business_queries', lambda context: ran.append('business_queries'), depends_on=('create_schema',))
+
+    with pytest.raises(RuntimeError, match='stores_data, create_schema, business_queries'):
+        pipeline.run(None)
+    assert ran == ['product_data']
+
+def test_only_and_skip_select_stages_and_unselected_dependencies_count_as_done():
+    ran = []
+    pipeline = Pipeline()
+    for name, depends_on in [('create_tables', ()), ('user_data', ('create_tables',)), ('create_schema', ('user_data',))]:
+        pipeline.add_stage(name, lambda context, name=name: ran.append(name), depends_on=depends_on)
+
+    assert pipeline.select_stages(skip=['create_tables']) == ['user_data', 'create_schema']
+    pipeline.run(None, only=['create_schema'])
+    assert ran == ['create_schema']
+    with pytest.raises(ValueError, match='Unknown stage'):
+        pipeline.select_stages(only=['orders'])
+    with pytest.raises(ValueError, match='unknown stage'):
+        pipeline.add_stage('build_rollups', lambda context: None, depends_on=('orders_data',))
+
+def test_each_stage_runs_in_its_own_span_under_the_run():
+    tracer = Tracer()
+    pipeline = Pipeline(tracer=tracer)
+    pipeline.add_stage('date_data', lambda context: None)
+    pipeline.run(None)
+
+    spans = {span.name: span for span in tracer.spans}
+    assert spans['date_data'].parent_id == spans['etl_run'].span_id
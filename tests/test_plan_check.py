@@ -0,0 +1,54 @@
+import json
+import pytest
+from sqlalchemy import inspect, text
+
+from database_utils import DatabaseConnector
+from plan_check import check_plans
+
+@pytest.fixture
+def orders_engine(postgres_creds):
+    with DatabaseConnector() as connector:
+        engine = connector.init_db_engine(postgres_creds)
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE orders_table (order_id BIGINT GENERATED ALWAYS AS IDENTITY, store_code VARCHAR(12), product_quantity SMALLINT)"))
+            connection.execute(text("INSERT INTO orders_table (store_code, product_quantity) SELECT 'S' || (n % 5000), n % 10 FROM generate_series(1, 50000) AS n"))
+            connection.execute(text("ANALYZE orders_table"))
+        yield engine
+
+def write_script(tmp_path, *statements):
+    script_path = tmp_path / 'queries.sql'
+    script_path.write_text(';\n'.join(statements) + ';\n')
+    return str(script_path)
+
+def test_sequential_scan_of_the_fact_table_fails_until_it_is_indexed(orders_engine, tmp_path):
+    queries = write_script(tmp_path, "SELECT SUM(product_quantity) FROM orders_table WHERE store_code = 'S42'")
+    assert check_plans(orders_engine, queries)[0].problems == ['sequential scan on orders_table']
+
+    with orders_engine.begin() as connection:
+        connection.execute(text("CREATE INDEX ix_orders_store_code ON orders_table (store_code)"))
+    assert check_plans(orders_engine, queries)[0].problems == []
+
+def test_cost_over_the_baseline_fails_and_the_baseline_can_be_updated(orders_engine, tmp_path):
+    queries = write_script(tmp_path, "SELECT store_code, SUM(product_quantity) FROM orders_table GROUP BY store_code")
+    baseline_path = tmp_path / 'plan_baseline.json'
+    check = check_plans(orders_engine, queries, str(baseline_path), large_tables=(), update_baseline=True)[0]
+    assert check.problems == [] and json.loads(baseline_path.read_text()) == {check.sql: check.total_cost}
+
+    # the query got slower than the recorded cost allows
+    baseline_path.write_text(json.dumps({check.sql: check.total_cost / 3}))
+    regressed = check_plans(orders_engine, queries, str(baseline_path), large_tables=())[0]
+    assert len(regressed.problems) == 1 and 'over the baseline' in regressed.problems[0]
+
+def test_schema_changes_are_planned_against_and_rolled_back(orders_engine, tmp_path):
+    queries = write_script(tmp_path, "ALTER TABLE orders_table ADD COLUMN weight_class VARCHAR(14)",
+                           "UPDATE orders_table SET weight_class = 'Light'",
+                           "SELECT weight_class, COUNT(*) FROM orders_table GROUP BY weight_class")
+    checks = check_plans(orders_engine, queries, large_tables=())
+
+    assert [check.query_number for check in checks] == [1]
+    assert 'weight_class' not in [column['name'] for column in inspect(orders_engine).get_columns('orders_table')]
+
+def test_plans_are_only_checked_on_postgresql(sqlite_creds, tmp_path):
+    with DatabaseConnector() as connector:
+        with pytest.raises(ValueError, match='PostgreSQL'):
+            check_plans(connector.init_db_engine(sqlite_creds), write_script(tmp_path, "SELECT 1"))
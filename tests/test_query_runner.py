@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from database_utils import DatabaseConnector
+from query_runner import QueryRunner, classify_statement, frames_match, split_statements, statement_keyword
+
+def test_semicolons_in_strings_identifiers_and_comments_do_not_split():
+    script = """SELECT 'a;b', "odd;name" FROM t; -- a comment; with a semicolon
+    /* a block /* nested; */ comment; */ SELECT $tag$ body; $tag$, 'it''s; here';
+    -- only a comment;
+    ;
+    SELECT 1"""
+
+    assert split_statements(script) == [
+        """SELECT 'a;b', "odd;name" FROM t""",
+        """-- a comment; with a semicolon
+    /* a block /* nested; */ comment; */ SELECT $tag$ body; $tag$, 'it''s; here'""",
+        'SELECT 1',
+    ]
+
+@pytest.mark.parametrize('statement, kind', [
+    ('SELECT * FROM orders_table', 'read'),
+    ('-- DELETE is only in this comment\nSELECT 1', 'read'),
+    ("SELECT 'INSERT INTO orders_table'", 'read'),
+    ('WITH totals AS (SELECT 1) SELECT * FROM totals', 'read'),
+    ('WITH moved AS (DELETE FROM orders_table RETURNING *) SELECT * FROM moved', 'write'),
+    ('SELECT * INTO orders_copy FROM orders_table', 'write'),
+    ('ALTER TABLE orders_table ALTER COLUMN product_quantity TYPE SMALLINT', 'write'),
+    ('UPDATE dim_products SET weight_class = NULL', 'write'),
+])
+def test_statements_are_classed_as_reads_or_writes(statement, kind):
+    assert classify_statement(statement) == kind
+
+def test_the_first_keyword_skips_comments():
+    assert statement_keyword('/* set up */ -- the table\n  create table t (a int)') == 'CREATE'
+    assert statement_keyword('-- nothing') == ''
+
+def test_reads_after_a_write_see_it(sqlite_creds):
+    script = """CREATE TABLE store_counts (country_code TEXT, total_no_stores INTEGER);
+    INSERT INTO store_counts VALUES ('GB', 265), ('DE', 141);
+    SELECT country_code FROM store_counts ORDER BY total_no_stores DESC;
+    SELECT SUM(total_no_stores) AS total FROM store_counts;
+    SELECT * FROM missing_table"""
+    with DatabaseConnector() as connector:
+        results = QueryRunner(connector.init_db_engine(sqlite_creds)).run(script)
+
+    assert [(result.kind, result.query_number) for result in results] == [('write', None), ('write', None), ('read', 1), ('read', 2), ('read', 3)]
+    assert results[2].data['country_code'].tolist() == ['GB', 'DE']
+    assert results[3].data['total'].tolist() == [406]
+    # a failed statement is recorded and does not stop the rest
+    assert results[4].error is not None and 'missing_table' in results[4].error
+
+def test_frames_match_within_the_tolerance():
+    assert frames_match(pd.DataFrame({'store_type': ['Local'], 'total_sales': [100.004]}), pd.DataFrame({'store_type': ['Local'], 'total_sales': [100.0]}))
+    assert not frames_match(pd.DataFrame({'total_sales': [100.5]}), pd.DataFrame({'total_sales': [100.0]}))
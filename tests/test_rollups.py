@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import text
+
+from database_utils import DatabaseConnector
+from rollups import UNMATCHED_TABLE, check_rollups, refresh_rollups
+
+RAW_QUERIES = 'sql_files/essential_queries/business_queries.sql'
+ROLLUP_QUERIES = 'sql_files/essential_queries/business_queries_rollup.sql'
+
+def add_orders(connection, orders):
+    for date_uuid, store_code, product_code, product_quantity in orders:
+        connection.execute(text("INSERT INTO orders_table (date_uuid, store_code, product_code, product_quantity) VALUES (:date_uuid, :store_code, :product_code, :product_quantity)"),
+                           {'date_uuid': date_uuid, 'store_code': store_code, 'product_code': product_code, 'product_quantity': product_quantity})
+
+@pytest.fixture
+def sales_data(postgres_creds, monkeypatch):
+    # the query files are read relative to the repository
+    monkeypatch.chdir(__file__.rsplit('/tests/', 1)[0])
+    with DatabaseConnector() as connector:
+        with connector.init_db_engine(postgres_creds).begin() as connection:
+            connection.execute(text("CREATE TABLE dim_store_details (store_code VARCHAR(12), store_type VARCHAR(255), country_code VARCHAR(2), locality TEXT, staff_numbers SMALLINT)"))
+            connection.execute(text("CREATE TABLE dim_products (product_code VARCHAR(11), product_price_sterling FLOAT)"))
+            connection.execute(text("CREATE TABLE dim_date_times (date_uuid TEXT, year VARCHAR(4), month VARCHAR(2), day VARCHAR(2), timestamp TEXT)"))
+            connection.execute(text("CREATE TABLE orders_table (order_id BIGINT GENERATED ALWAYS AS IDENTITY, date_uuid TEXT, store_code VARCHAR(12), product_code VARCHAR(11), product_quantity SMALLINT)"))
+            connection.execute(text("INSERT INTO dim_store_details VALUES ('S1', 'Local', 'DE', 'Berlin', 3), ('S2', 'Web Portal', 'GB', NULL, 5), ('S3', 'Outlet', 'DE', 'Bonn', 2)"))
+            connection.execute(text("INSERT INTO dim_products VALUES ('P1', 2.5), ('P2', 10.0)"))
+            connection.execute(text("INSERT INTO dim_date_times VALUES ('D1', '2020', '01', '01', '10:00:00'), ('D2', '2021', '02', '03', '11:00:00')"))
+            # the orders of store S4, product P3 and date D3 arrive before their dimension rows
+            add_orders(connection, [('D1', 'S1', 'P1', 2), ('D2', 'S2', 'P2', 1), ('D1', 'S4', 'P2', 4), ('D3', 'S1', 'P1', 7), ('D2', 'S3', 'P3', 3)])
+        yield connector, postgres_creds
+
+def test_rollup_matches_the_raw_tables_after_full_and_incremental_refreshes(sales_data):
+    connector, creds = sales_data
+    engine = connector.init_db_engine(creds)
+    assert refresh_rollups(connector, creds, full=True) == 5
+    assert check_rollups(engine, RAW_QUERIES, ROLLUP_QUERIES) == []
+
+    with engine.begin() as connection:
+        add_orders(connection, [('D1', 'S1', 'P1', 1), ('D3', 'S3', 'P1', 2), ('D2', 'S3', 'P2', 3)])
+    assert refresh_rollups(connector, creds) == 3
+    assert check_rollups(engine, RAW_QUERIES, ROLLUP_QUERIES) == []
+
+def test_late_arriving_dimension_rows_move_their_orders_into_the_rollup(sales_data):
+    connector, creds = sales_data
+    engine = connector.init_db_engine(creds)
+    refresh_rollups(connector, creds, full=True)
+    with engine.connect() as connection:
+        assert connection.execute(text(f"SELECT COUNT(*) FROM {UNMATCHED_TABLE}")).scalar() == 3
+
+    # the missing store, product and date are loaded after the orders, with no new orders
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO dim_store_details VALUES ('S4', 'Super Store', 'US', 'Boston', 9)"))
+        connection.execute(text("INSERT INTO dim_products VALUES ('P3', 4.0)"))
+    assert refresh_rollups(connector, creds) == 0
+    assert check_rollups(engine, RAW_QUERIES, ROLLUP_QUERIES) == []
+
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO dim_date_times VALUES ('D3', '2022', '03', '04', '12:00:00')"))
+    refresh_rollups(connector, creds)
+    assert check_rollups(engine, RAW_QUERIES, ROLLUP_QUERIES) == []
+    with engine.connect() as connection:
+        assert connection.execute(text(f"SELECT COUNT(*) FROM {UNMATCHED_TABLE}")).scalar() == 0
+        # every order is now in a fully matched group
+        assert connection.execute(text("SELECT SUM(number_of_sales) FROM sales_rollup WHERE store_matched AND product_matched AND date_matched")).scalar() == 5
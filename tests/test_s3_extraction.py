@@ -0,0 +1,94 @@
+import gzip
+import io
+import boto3
+from moto import mock_aws
+import pandas as pd
+import pytest
+
+from data_extraction import DataExtractor
+
+BUCKET = 'data-handling-public'
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        # the parameters of every GetObject call, to see which requests were ranged
+        client.get_object_calls = []
+        client.meta.events.register('provide-client-params.s3.GetObject', lambda params, **kwargs: client.get_object_calls.append(dict(params)))
+        yield client
+
+@pytest.fixture
+def date_times_df():
+    # read_json parses columns named like timestamps as dates, so the time of day is kept under another name
+    return pd.DataFrame({'time_of_day': [f"{hour:02d}:00:00" for hour in range(24)] * 50,
+                         'month': [str(month) for month in range(1, 13)] * 100,
+                         'year': ['2022'] * 1200,
+                         'day': ['1'] * 1200,
+                         'time_period': ['Evening'] * 1200,
+                         'date_uuid': [f"uuid-{row}" for row in range(1200)]})
+
+def object_bytes(df, key):
+    '''
+    This function writes a DataFrame in the format its key's extension names.
+    '''
+    buffer = io.BytesIO()
+    if '.parquet' in key:
+        df.to_parquet(buffer, index=False)
+    elif '.jsonl' in key:
+        buffer.write(df.to_json(orient='records', lines=True).encode('utf-8'))
+    elif '.json' in key:
+        buffer.write(df.to_json(orient='columns').encode('utf-8'))
+    else:
+        buffer.write(df.to_csv(index=False).encode('utf-8'))
+    data = buffer.getvalue()
+    return gzip.compress(data) if key.endswith('.gz') else data
+
+def put_frame(s3_client, df, key):
+    s3_client.put_object(Bucket=BUCKET, Key=key, Body=object_bytes(df, key))
+    return f"s3://{BUCKET}/{key}"
+
+def assert_same_rows(extracted_df, expected_df):
+    # JSON and CSV do not keep the column types, so compare the values as text
+    pd.testing.assert_frame_equal(extracted_df.reset_index(drop=True).astype(str), expected_df.astype(str), check_dtype=False)
+
+@pytest.mark.parametrize('key', ['date_details.csv', 'date_details.json', 'date_details.jsonl', 'date_details.parquet', 'date_details.csv.gz', 'date_details.json.gz'])
+def test_each_format_is_read_from_the_stream(s3_client, date_times_df, key):
+    s3_address = put_frame(s3_client, date_times_df, key)
+    extracted_df = DataExtractor(s3_client=s3_client).extract_from_s3(s3_address)
+
+    assert_same_rows(extracted_df, date_times_df)
+    # small objects are one request, except Parquet, which needs a seekable file and is always downloaded in ranges
+    ranged = ['Range' in params for params in s3_client.get_object_calls]
+    assert ranged == [key.endswith('.parquet')]
+
+@pytest.mark.parametrize('key', ['date_details.csv', 'date_details.parquet'])
+def test_large_objects_are_downloaded_in_ranges(s3_client, date_times_df, key):
+    s3_address = put_frame(s3_client, date_times_df, key)
+    object_size = s3_client.head_object(Bucket=BUCKET, Key=key)['ContentLength']
+    part_size = 1024
+
+    extracted_df = DataExtractor(s3_client=s3_client).extract_from_s3(s3_address, multipart_threshold=2048, part_size=part_size, max_workers=4)
+
+    assert_same_rows(extracted_df, date_times_df)
+    ranges = sorted(params['Range'] for params in s3_client.get_object_calls)
+    expected_ranges = sorted(f"bytes={start}-{min(start + part_size, object_size) - 1}" for start in range(0, object_size, part_size))
+    assert ranges == expected_ranges
+    # every part is pinned to the version that was sized
+    assert {params['IfMatch'] for params in s3_client.get_object_calls} == {s3_client.head_object(Bucket=BUCKET, Key=key)['ETag']}
+
+@pytest.mark.parametrize('key', ['date_details.csv', 'date_details.csv.gz', 'date_details.jsonl', 'date_details.jsonl.gz', 'date_details.parquet'])
+def test_chunked_reads(s3_client, date_times_df, key):
+    s3_address = put_frame(s3_client, date_times_df, key)
+    chunks = list(DataExtractor(s3_client=s3_client).extract_from_s3(s3_address, chunksize=500))
+
+    assert [len(chunk_df) for chunk_df in chunks] == [500, 500, 200]
+    assert_same_rows(pd.concat(chunks), date_times_df)
+
+def test_chunked_json_needs_json_lines(s3_client, date_times_df):
+    s3_address = put_frame(s3_client, date_times_df, 'date_details.json')
+    with pytest.raises(ValueError):
+        DataExtractor(s3_client=s3_client).extract_from_s3(s3_address, chunksize=500)
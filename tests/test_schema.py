@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+
+import schema
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_create_schema_sql_is_what_schema_py_prints():
+    # the checked in DDL is regenerated with python3 schema.py, so it must not drift from the definitions the pipeline uses
+    printed = subprocess.run([sys.executable, 'schema.py'], cwd=REPO, capture_output=True, text=True, check=True).stdout
+    with open(os.path.join(REPO, 'sql_files', 'essential_queries', 'create_schema.sql')) as sql_file:
+        assert printed == sql_file.read()
+
+def test_every_foreign_key_references_the_primary_key_of_a_defined_table():
+    for table_schema in schema.TABLE_SCHEMAS.values():
+        for foreign_key in table_schema.foreign_keys:
+            assert schema.TABLE_SCHEMAS[foreign_key.references_table].primary_key == foreign_key.references_column
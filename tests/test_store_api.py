@@ -0,0 +1,104 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import pytest
+import requests
+
+from data_extraction import DataExtractor
+
+NUMBER_OF_STORES = 20
+# store number -> the error statuses it answers with before it succeeds
+TRANSIENT_ERRORS = {3: [429], 7: [503, 500]}
+
+class StubStoreAPI(BaseHTTPRequestHandler):
+    '''
+    This class answers like the store API: number_stores gives the number of stores, and store_details/<n> gives the details of store n.
+    '''
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if self.headers.get('x-api-key') != 'test-key':
+                return self._send(403, {'message': 'Forbidden'})
+            if self.path == '/number_stores':
+                return self._send(200, {'statuscode': 200, 'number_stores': NUMBER_OF_STORES})
+            store_number = int(self.path.rsplit('/', 1)[-1])
+            if store_number >= NUMBER_OF_STORES:
+                return self._send(404, {'message': 'Store not found'})
+            with server.lock:
+                errors = server.errors.get(store_number)
+                status = errors.pop(0) if errors else 200
+            if status != 200:
+                return self._send(status, {'message': 'Try again'})
+            # later stores answer sooner, so the responses arrive out of order
+            server.release.wait(0.002 * (NUMBER_OF_STORES - store_number))
+            self._send(200, {'index': store_number, 'store_code': f"ST-{store_number:03d}"})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def store_api():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubStoreAPI)
+    server.lock = threading.Lock()
+    server.release = threading.Event()
+    server.requests = []
+    server.in_flight = server.max_in_flight = 0
+    server.errors = {store_number: list(statuses) for store_number, statuses in TRANSIENT_ERRORS.items()}
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+HEADER = {'x-api-key': 'test-key'}
+
+def test_number_of_stores(store_api):
+    _, url = store_api
+    assert DataExtractor().list_number_of_stores(f"{url}/number_stores", HEADER) == NUMBER_OF_STORES
+
+@pytest.mark.parametrize('max_workers', [1, 8])
+def test_stores_come_back_in_order_after_retries(store_api, max_workers):
+    server, url = store_api
+    stores_df = DataExtractor().retrieve_stores_data(f"{url}/store_details/", NUMBER_OF_STORES, HEADER, max_workers=max_workers, backoff=0)
+
+    assert stores_df['index'].tolist() == list(range(NUMBER_OF_STORES))
+    assert stores_df['store_code'].tolist() == [f"ST-{store_number:03d}" for store_number in range(NUMBER_OF_STORES)]
+    # each transient error was retried once, and every other store was requested once
+    retried = sum(len(statuses) for statuses in TRANSIENT_ERRORS.values())
+    assert len(server.requests) == NUMBER_OF_STORES + retried
+    if max_workers > 1:
+        assert server.max_in_flight > 1
+    else:
+        assert server.max_in_flight == 1
+
+def test_gives_up_after_the_last_retry(store_api):
+    server, url = store_api
+    server.errors[2] = [503] * 3
+    with pytest.raises(requests.HTTPError):
+        DataExtractor().retrieve_stores_data(f"{url}/store_details/", 4, HEADER, max_workers=2, retries=2, backoff=0)
+
+@pytest.mark.parametrize('header, number_of_stores', [({'x-api-key': 'wrong-key'}, 2), (HEADER, NUMBER_OF_STORES + 1)])
+def test_client_errors_are_raised_without_retrying(store_api, header, number_of_stores):
+    server, url = store_api
+    with pytest.raises(requests.HTTPError) as error:
+        DataExtractor().retrieve_stores_data(f"{url}/store_details/", number_of_stores, header, max_workers=4, backoff=0)
+    assert error.value.response.status_code in (403, 404)
+    # a 4xx other than 429 is not retried
+    failed = [path for path in server.requests if path.endswith(f"/{number_of_stores - 1}")]
+    assert len(failed) == 1
@@ -0,0 +1,303 @@
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where the memory figures are left out
+    resource = None
+
+''' Spans for timing the steps of the ETL run. Each span records its wall time, the CPU time of the thread that ran it,
+how much the process memory changed over it and any row counts set on it. The peak memory of the process only ever
+rises, so it is recorded once, on the root span, rather than on each step. Spans nest within a thread, and the finished spans can be exported
+as JSON lines in the OpenTelemetry span layout or as a Prometheus textfile.'''
+
+# the open spans of each thread, innermost last
+_local = threading.local()
+
+def _open_spans():
+    '''
+    This function returns the stack of open spans for the calling thread.
+    '''
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+    return _local.spans
+
+def _current_rss_bytes():
+    '''
+    This function returns the resident memory of the process in bytes, or None where /proc is not available.
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _max_rss_bytes():
+    '''
+    This function returns the peak resident memory of the process so far in bytes, or None where it cannot be read.
+    '''
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    return max_rss if os.uname().sysname == 'Darwin' else max_rss * 1024
+
+class Span:
+    '''
+    This class holds the timings and attributes of one step of the run.
+
+    '''
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        '''
+        This function creates a span, which starts timing straight away.
+
+        Args:
+            name (str): The name of the step, e.g. 'clean'.
+            trace_id (str): The id shared by every span of the run.
+            parent_id (str): The id of the enclosing span, or None for the root span.
+            attributes (dict): Attributes to record with the span, e.g. the table name.
+        '''
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = 'OK'
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = None
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.thread_time()
+        self._start_rss = _current_rss_bytes()
+
+    def set_attribute(self, key, value):
+        '''
+        This function records an attribute on the span, e.g. rows_in or rows_out.
+        '''
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        '''
+        This function records several attributes on the span.
+        '''
+        self.attributes.update(attributes)
+
+    def end(self):
+        '''
+        This function stops the span's timers and records its wall time, CPU time and memory.
+        '''
+        self.end_time_ns = time.time_ns()
+        self.attributes['wall_seconds'] = time.perf_counter() - self._start_wall
+        self.attributes['cpu_seconds'] = time.thread_time() - self._start_cpu
+        end_rss = _current_rss_bytes()
+        if end_rss is not None and self._start_rss is not None:
+            self.attributes['rss_delta_bytes'] = end_rss - self._start_rss
+        # the process peak covers every step run so far, so it only describes the run as a whole
+        max_rss = _max_rss_bytes() if self.parent_id is None else None
+        if max_rss is not None:
+            self.attributes['process_max_rss_bytes'] = max_rss
+
+    def to_dict(self):
+        '''
+        This function returns the span in the OpenTelemetry JSON span layout.
+        '''
+        return {'traceId': self.trace_id, 'spanId': self.span_id, 'parentSpanId': self.parent_id, 'name': self.name,
+                'startTimeUnixNano': self.start_time_ns, 'endTimeUnixNano': self.end_time_ns,
+                'status': {'code': self.status}, 'attributes': self.attributes}
+
+class _NoSpan:
+    '''
+    This class stands in for a span when nothing is being traced, so callers can set attributes without checking.
+
+    '''
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+def current_span():
+    '''
+    This function returns the innermost open span of the calling thread, or a span that ignores attributes if there is none.
+
+    Returns:
+        Span: The current span.
+    '''
+    open_spans = _open_spans()
+    return open_spans[-1] if open_spans else _NO_SPAN
+
+class Tracer:
+    '''
+    This class can be used to record nested spans for the steps of a run and export them.
+
+    '''
+
+    def __init__(self):
+        '''
+        This function starts a new trace.
+        '''
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        # stages record their spans from different threads
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        '''
+        This function opens a span around a block of code. The span is a child of the calling thread's current span,
+        or of parent when the block runs on a different thread from the span it belongs to.
+
+        Args:
+            name (str): The name of the step, e.g. 'extract', 'clean' or 'upload'.
+            parent (Span): The enclosing span, if it was opened on another thread.
+            **attributes: Attributes to record with the span, e.g. table='dim_users'.
+
+        Yields:
+            Span: The open span, for setting row counts on.
+        '''
+        open_spans = _open_spans()
+        if parent is None and open_spans:
+            parent = open_spans[-1]
+        span = Span(name, self.trace_id, None if parent is None else parent.span_id, attributes)
+        open_spans.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'ERROR'
+            span.set_attribute('error', repr(e))
+            raise
+        finally:
+            open_spans.pop()
+            span.end()
+            with self._lock:
+                self.spans.append(span)
+
+    def iterate(self, name, iterable, **attributes):
+        '''
+        This function wraps an iterator of DataFrame chunks so that fetching each chunk is timed in its own span,
+        while the caller's work on the chunk is left out of it.
+
+        Args:
+            name (str): The name of the step, e.g. 'extract'.
+            iterable (iterable): The chunks, e.g. from read_rds_table with a chunksize.
+            **attributes: Attributes to record with each span.
+
+        Yields:
+            pandas.DataFrame: Each chunk in turn.
+        '''
+        iterator = iter(iterable)
+        while True:
+            with self.span(name, **attributes) as span:
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    span.set_attribute('rows_out', 0)
+                    return
+                span.set_attribute('rows_out', len(chunk))
+            yield chunk
+
+    def export_json_lines(self, file_path):
+        '''
+        This function appends the finished spans to a JSON lines file, one span per line, so runs can be compared over time.
+
+        Args:
+            file_path (str): Path to the JSON lines file.
+        '''
+        with self._lock:
+            spans = list(self.spans)
+        with open(file_path, 'a') as trace_file:
+            for span in spans:
+                trace_file.write(json.dumps(span.to_dict(), default=str) + '\n')
+
+    def write_prometheus(self, file_path):
+        '''
+        This function writes the run's metrics in the Prometheus text format, for the node exporter's textfile collector.
+        Spans with the same stage, step and table are added together, e.g. the clean spans of every chunk of a table.
+
+        Args:
+            file_path (str): Path to the .prom file, which is replaced in a single step.
+        '''
+        totals = {}
+        for stage, span in self._spans_with_stage():
+            labels = (stage, span.name, str(span.attributes.get('table', '')))
+            total = totals.setdefault(labels, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': 0, 'rows_out': 0, 'rss_delta_bytes': 0, 'rows_dropped': {}})
+            total['wall_seconds'] += span.attributes['wall_seconds']
+            total['cpu_seconds'] += span.attributes['cpu_seconds']
+            total['rows_in'] += span.attributes.get('rows_in', 0)
+            total['rows_out'] += span.attributes.get('rows_out', 0)
+            total['rss_delta_bytes'] = max(total['rss_delta_bytes'], span.attributes.get('rss_delta_bytes') or 0)
+            for key, value in span.attributes.items():
+                if key.startswith('rows_dropped_by_'):
+                    mask = key[len('rows_dropped_by_'):]
+                    total['rows_dropped'][mask] = total['rows_dropped'].get(mask, 0) + value
+
+        metrics = [('etl_step_wall_seconds', 'wall_seconds', 'Wall time of the step in seconds.'),
+                   ('etl_step_cpu_seconds', 'cpu_seconds', 'CPU time of the thread that ran the step in seconds.'),
+                   ('etl_step_rows_in', 'rows_in', 'Rows passed into the step.'),
+                   ('etl_step_rows_out', 'rows_out', 'Rows returned by the step.'),
+                   ('etl_step_rss_delta_bytes', 'rss_delta_bytes', 'Largest growth in resident memory over one span of the step, e.g. one chunk.')]
+        lines = []
+        for metric_name, key, help_text in metrics:
+            lines += [f"# HELP {metric_name} {help_text}", f"# TYPE {metric_name} gauge"]
+            for (stage, step, table), total in totals.items():
+                lines.append(f'{metric_name}{{stage="{stage}",step="{step}",table="{table}"}} {total[key]}')
+        lines += ["# HELP etl_step_rows_dropped Rows removed by each cleaning mask.", "# TYPE etl_step_rows_dropped gauge"]
+        for (stage, step, table), total in totals.items():
+            for mask, rows_dropped in total['rows_dropped'].items():
+                lines.append(f'etl_step_rows_dropped{{stage="{stage}",step="{step}",table="{table}",mask="{mask}"}} {rows_dropped}')
+        max_rss = _max_rss_bytes()
+        if max_rss is not None:
+            lines += ["# HELP etl_process_max_rss_bytes Peak resident memory of the process over the whole run.", "# TYPE etl_process_max_rss_bytes gauge",
+                      f"etl_process_max_rss_bytes {max_rss}"]
+        lines += ["# HELP etl_last_run_timestamp_seconds When the run finished.", "# TYPE etl_last_run_timestamp_seconds gauge",
+                  f"etl_last_run_timestamp_seconds {time.time()}"]
+
+        temporary_path = file_path + '.tmp'
+        with open(temporary_path, 'w') as prometheus_file:
+            prometheus_file.write('\n'.join(lines) + '\n')
+        os.replace(temporary_path, file_path)
+
+    def print_summary(self):
+        '''
+        This function prints the wall time, CPU time and row counts of each stage and the steps within it.
+        '''
+        for stage, span in self._spans_with_stage():
+            if span.name == stage:
+                print(f"{stage}: {span.attributes['wall_seconds']:.2f}s wall, {span.attributes['cpu_seconds']:.2f}s CPU")
+        steps = {}
+        for stage, span in self._spans_with_stage():
+            if span.name != stage and stage is not None:
+                step = steps.setdefault((stage, span.name), {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': 0, 'rows_out': 0, 'count': 0})
+                step['wall_seconds'] += span.attributes['wall_seconds']
+                step['cpu_seconds'] += span.attributes['cpu_seconds']
+                step['rows_in'] += span.attributes.get('rows_in', 0)
+                step['rows_out'] += span.attributes.get('rows_out', 0)
+                step['count'] += 1
+        for (stage, step_name), step in steps.items():
+            print(f"  {stage} {step_name} x{step['count']}: {step['wall_seconds']:.2f}s wall, {step['cpu_seconds']:.2f}s CPU, "
+                  f"{step['rows_in']} rows in, {step['rows_out']} rows out")
+
+    def _spans_with_stage(self):
+        '''
+        This function pairs each finished span with the name of the stage it ran in, which is its ancestor just below the root span.
+        '''
+        with self._lock:
+            spans = list(self.spans)
+        spans_by_id = {span.span_id: span for span in spans}
+        paired = []
+        for span in spans:
+            if span.parent_id is None:
+                continue
+            stage_span = span
+            while stage_span.parent_id in spans_by_id and spans_by_id[stage_span.parent_id].parent_id is not None:
+                stage_span = spans_by_id[stage_span.parent_id]
+            paired.append((stage_span.name, span))
+        return paired